@@ -0,0 +1,78 @@
+"""
+Benchmarks each calculator over the history and glucose fixtures, to compare interpreters and dependency versions.
+
+Run from the repository root:
+
+    python -m benchmarks.calculators
+"""
+from __future__ import print_function
+
+import json
+import platform
+
+import numpy
+
+from benchmarks.insulin_models import best_of
+from openapscontrib.predict.convolution import convolve_carb_effect
+from openapscontrib.predict.convolution import convolve_insulin_effect
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_carb_effect
+from openapscontrib.predict.predict import calculate_cob
+from openapscontrib.predict.predict import calculate_cob_and_carb_effect
+from openapscontrib.predict.predict import calculate_glucose_from_effects
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import calculate_iob
+from openapscontrib.predict.predict import calculate_iob_and_insulin_effect
+from openapscontrib.predict.predict import calculate_momentum_effect
+from openapscontrib.predict.predict import future_glucose
+from tests.predict_tests import get_file_at_path
+
+
+def load_fixture(filename):
+    with open(get_file_at_path('fixtures/' + filename)) as fp:
+        return json.load(fp)
+
+
+def main():
+    normalized_history = load_fixture('normalize_history.json')
+    carb_history = load_fixture('carb_effect_from_history_input.json')
+    recent_glucose = load_fixture('glucose_from_effects_glucose_input.json')
+    momentum_glucose = load_fixture('momentum_effect_rising_glucose_input.json')
+    insulin_sensitivities = Schedule(load_fixture('read_insulin_sensitivies.json')['sensitivities'])
+    carb_ratios = Schedule(load_fixture('read_carb_ratios.json')['schedule'])
+    effects = [
+        load_fixture('glucose_from_effects_insulin_effect_input.json'),
+        load_fixture('glucose_from_effects_carb_effect_input.json')
+    ]
+
+    calculators = [
+        ('calculate_insulin_effect', lambda: calculate_insulin_effect(normalized_history, 4, insulin_sensitivities)),
+        ('calculate_iob', lambda: calculate_iob(normalized_history, 4)),
+        ('calculate_iob_and_insulin_effect', lambda: calculate_iob_and_insulin_effect(
+            normalized_history, 4, insulin_sensitivities
+        )),
+        ('calculate_carb_effect', lambda: calculate_carb_effect(carb_history, carb_ratios, insulin_sensitivities)),
+        ('calculate_cob', lambda: calculate_cob(carb_history)),
+        ('calculate_cob_and_carb_effect', lambda: calculate_cob_and_carb_effect(
+            carb_history, carb_ratios, insulin_sensitivities
+        )),
+        ('calculate_momentum_effect', lambda: calculate_momentum_effect(momentum_glucose)),
+        ('calculate_glucose_from_effects', lambda: calculate_glucose_from_effects(effects, recent_glucose)),
+        ('future_glucose', lambda: future_glucose(
+            normalized_history, recent_glucose, 4, insulin_sensitivities, carb_ratios
+        )),
+        ('convolve_insulin_effect', lambda: convolve_insulin_effect(normalized_history, 4, insulin_sensitivities)),
+        ('convolve_carb_effect', lambda: convolve_carb_effect(carb_history, carb_ratios, insulin_sensitivities)),
+    ]
+
+    print('Python {} ({}), NumPy {}'.format(
+        platform.python_version(), platform.python_implementation(), numpy.__version__
+    ))
+    print('{:<34}{:>12}'.format('calculator', 'time (ms)'))
+
+    for name, calculator in calculators:
+        print('{:<34}{:>12.3f}'.format(name, best_of(calculator)))
+
+
+if __name__ == '__main__':
+    main()
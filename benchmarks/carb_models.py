@@ -0,0 +1,54 @@
+"""
+Benchmarks each registered carb model: its curve over an array of times, and the carb effect calculator and
+convolution engine over the meal fixture.
+
+Run from the repository root:
+
+    python -m benchmarks.carb_models
+"""
+from __future__ import print_function
+
+import json
+
+import numpy
+
+from benchmarks.insulin_models import best_of
+from openapscontrib.predict.carbs import carb_models
+from openapscontrib.predict.carbs import get_carb_model
+from openapscontrib.predict.convolution import convolve_carb_effect
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_carb_effect
+from tests.predict_tests import get_file_at_path
+
+
+def main():
+    with open(get_file_at_path('fixtures/carb_effect_from_history_input.json')) as fp:
+        normalized_history = json.load(fp)
+
+    with open(get_file_at_path('fixtures/read_insulin_sensitivies.json')) as fp:
+        insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+    with open(get_file_at_path('fixtures/read_carb_ratios.json')) as fp:
+        carb_ratios = Schedule(json.load(fp)['schedule'])
+
+    t = numpy.linspace(-10, 190, 100000)
+
+    print('{:<12}{:>16}{:>16}{:>20}'.format('model', 'absorbed (ms)', 'effect (ms)', 'convolution (ms)'))
+
+    for name in carb_models:
+        model = get_carb_model(name, 180)
+
+        print('{:<12}{:>16.3f}{:>16.3f}{:>20.3f}'.format(
+            name,
+            best_of(lambda: model.absorbed(t)),
+            best_of(lambda: calculate_carb_effect(
+                normalized_history, carb_ratios, insulin_sensitivities, carb_model=name
+            ), number=1),
+            best_of(lambda: convolve_carb_effect(
+                normalized_history, carb_ratios, insulin_sensitivities, carb_model=name
+            ), number=1)
+        ))
+
+
+if __name__ == '__main__':
+    main()
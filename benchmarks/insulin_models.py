@@ -0,0 +1,55 @@
+"""
+Benchmarks each registered insulin model: its curve and closed-form integral over an array of times, and the insulin
+effect and IOB calculators over the history fixture.
+
+Run from the repository root:
+
+    python -m benchmarks.insulin_models
+"""
+from __future__ import print_function
+
+import json
+import timeit
+
+import numpy
+
+from openapscontrib.predict.insulin import get_insulin_model
+from openapscontrib.predict.insulin import insulin_models
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import calculate_iob
+from tests.predict_tests import get_file_at_path
+
+
+def best_of(function, repeat=5, number=10):
+    """Returns the fastest mean time of a function over several runs, in milliseconds"""
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number * 1000
+
+
+def main():
+    with open(get_file_at_path('fixtures/normalize_history.json')) as fp:
+        normalized_history = json.load(fp)
+
+    with open(get_file_at_path('fixtures/read_insulin_sensitivies.json')) as fp:
+        insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+    t = numpy.linspace(-10, 370, 100000)
+
+    print('{:<14}{:>12}{:>18}{:>18}{:>12}'.format('model', 'iob (ms)', 'integrated (ms)', 'effect (ms)', 'iob (ms)'))
+
+    for name in insulin_models:
+        model = get_insulin_model(name, 360)
+
+        print('{:<14}{:>12.3f}{:>18.3f}{:>18.3f}{:>12.3f}'.format(
+            name,
+            best_of(lambda: model.iob(t)),
+            best_of(lambda: model.integrated_iob(0, 30, t)),
+            best_of(lambda: calculate_insulin_effect(
+                normalized_history, 6, insulin_sensitivities, insulin_model=name
+            ), number=1),
+            best_of(lambda: calculate_iob(normalized_history, 6, insulin_model=name), number=1)
+        ))
+
+
+if __name__ == '__main__':
+    main()
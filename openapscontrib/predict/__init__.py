@@ -13,17 +13,45 @@ from dateutil.tz import gettz
 import json
 import os
 
-from openaps.uses.use import Use
-
-from predict import Schedule
-from predict import calculate_momentum_effect
-from predict import calculate_carb_effect
-from predict import calculate_cob
-from predict import calculate_glucose_from_effects
-from predict import calculate_insulin_effect
-from predict import calculate_iob
-from predict import future_glucose
-from predict import glucose_data_tuple
+try:
+    from openaps.uses.use import Use
+except (ImportError, SyntaxError):
+    # openaps only runs on Python 2, so its commands are unavailable without it. The calculators are still importable.
+    Use = object
+
+from . import compact
+from .backtest import backtest
+from .backtest import load_manifest
+from .carbs import carb_models
+from .instrumentation import run
+from .instrumentation import span
+from .importer import Importer
+from .insulin import insulin_models
+from .integration import AdaptiveSimpson
+from .convolution import convolve_carb_effect
+from .convolution import convolve_cob
+from .convolution import convolve_insulin_effect
+from .ensemble import predict_glucose_bands
+from .predict import GlucoseSeries
+from .predict import Schedule
+from .predict import calculate_momentum_effect
+from .predict import calculate_carb_effect
+from .predict import calculate_cob
+from .predict import calculate_cob_and_carb_effect
+from .predict import calculate_glucose_from_effects
+from .predict import calculate_insulin_effect
+from .predict import calculate_iob
+from .predict import calculate_iob_and_insulin_effect
+from .predict import future_glucose
+from .recommend import recommend_temp_basal
+from .scenarios import predict_scenarios
+
+
+try:
+    basestring
+except NameError:
+    # Python 3
+    basestring = str
 
 
 # set_config is needed by openaps for all vendors.
@@ -50,13 +78,20 @@ def display_device(device):
 # or are compatible with it:
 def get_uses(device, config):
     return [
+        archive_import,
         glucose,
+        glucose_backtest,
+        glucose_bands,
         glucose_from_effects,
         glucose_momentum_effect,
+        glucose_scenarios,
         scheiner_carb_effect,
         scheiner_cob,
+        scheiner_cob_and_carb_effect,
+        temp_basal_recommendation,
         walsh_insulin_effect,
-        walsh_iob
+        walsh_iob,
+        walsh_iob_and_insulin_effect
     ]
 
 
@@ -69,11 +104,27 @@ def _opt_date(timestamp):
     :rtype: datetime.datetime|NoneType
     """
     if timestamp:
-        return parse(timestamp)
+        with span('parse_date'):
+            return parse(timestamp)
+
+
+def _opt_list(value):
+    """Parses a list argument, which may have been saved to the report config as a string
+
+    :param value: The list, or its string representation
+    :type value: list|basestring
+    :return: The list if a value was specified
+    :rtype: list|NoneType
+    """
+    if isinstance(value, basestring):
+        return ast.literal_eval(value)
+
+    return value
 
 
 def _json_file(filename):
-    return json.load(argparse.FileType('r')(filename))
+    with span('load_json'):
+        return json.load(argparse.FileType('r')(filename))
 
 
 def _opt_json_file(filename):
@@ -88,6 +139,55 @@ def _opt_json_file(filename):
         return _json_file(filename)
 
 
+def _effect_file(filename):
+    """Parses an effect schedule file, which may be JSON or compactly encoded
+
+    :param filename: The path to the file to parse
+    :type filename: basestring
+    :return: The effect entries, or their series if the file is compact
+    :rtype: list(dict)|EffectSeries
+    """
+    if compact.is_compact(filename):
+        with span('load_compact'):
+            return compact.load(filename)
+
+    return _json_file(filename)
+
+
+def _compact_effect(effect):
+    """Encodes an effect schedule compactly, for reports which use the text reporter
+
+    :param effect: The effect entries
+    :type effect: list(dict)
+    :return: The contents of the report file
+    :rtype: bytes
+    """
+    return compact.dumps(effect)
+
+
+def _recent_glucose_file(filename):
+    """Parses a glucose data file into columns, and checks that its latest entry is recent
+
+    :param filename: The path to the file to parse
+    :type filename: basestring
+    :return: The glucose entries as columns, read once for momentum and the prediction anchor
+    :rtype: GlucoseSeries
+    """
+    recent_glucose = GlucoseSeries(_json_file(filename))
+
+    if len(recent_glucose) > 0:
+        glucose_file_time = datetime.fromtimestamp(os.path.getmtime(filename))
+        last_glucose_datetime = recent_glucose.datetime(0)
+
+        if last_glucose_datetime.utcoffset() is not None:
+            last_glucose_datetime = make_naive(last_glucose_datetime)
+
+        assert abs(glucose_file_time - last_glucose_datetime) < timedelta(minutes=15), \
+            'Glucose data is more than 15 minutes old'
+
+    return recent_glucose
+
+
 def make_naive(value, timezone=None):
     """
     Makes an aware datetime.datetime naive in a given time zone.
@@ -150,7 +250,7 @@ class glucose_momentum_effect(Use):
         :rtype: tuple(list, dict)
         """
         args = (
-            _json_file(params['glucose']),
+            GlucoseSeries(_json_file(params['glucose'])),
         )
 
         kwargs = dict()
@@ -164,9 +264,11 @@ class glucose_momentum_effect(Use):
         return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
 
-        return calculate_momentum_effect(*args, **kwargs)
+            return calculate_momentum_effect(*args, **kwargs)
 
 
 # noinspection PyPep8Naming
@@ -198,6 +300,13 @@ class scheiner_carb_effect(Use):
             help='The total length of carbohydrate absorption in minutes'
         )
 
+        parser.add_argument(
+            '--carb-model',
+            nargs=argparse.OPTIONAL,
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
+        )
+
         parser.add_argument(
             '--absorption-delay',
             type=int,
@@ -205,12 +314,51 @@ class scheiner_carb_effect(Use):
             help='The delay time between a dosing event and when absorption begins'
         )
 
+        parser.add_argument(
+            '--start-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the beginning of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--end-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the end of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--engine',
+            nargs=argparse.OPTIONAL,
+            choices=('event', 'convolution'),
+            help='Evaluate each meal at every timestamp (event), or convolve a meal vector with the '
+                 'absorption curve (convolution). Defaults to event.'
+        )
+
+        parser.add_argument(
+            '--dtype',
+            nargs=argparse.OPTIONAL,
+            choices=('float64', 'float32'),
+            help='The precision of the convolution engine. float32 halves its memory, within 5e-4 mg/dL of float64. '
+                 'Defaults to float64.'
+        )
+
     def get_params(self, args):
         params = super(scheiner_carb_effect, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('history', 'carb_ratios', 'insulin_sensitivities', 'absorption_time', 'absorption_delay'):
+        for key in ('history',
+                    'carb_ratios',
+                    'insulin_sensitivities',
+                    'absorption_time',
+                    'carb_model',
+                    'absorption_delay',
+                    'start_at',
+                    'end_at',
+                    'engine',
+                    'dtype'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -232,7 +380,10 @@ class scheiner_carb_effect(Use):
             Schedule(_json_file(params['insulin_sensitivities'])['sensitivities'])
         )
 
-        kwargs = dict()
+        kwargs = dict(
+            start_at=_opt_date(_opt_json_file(params.get('start_at'))),
+            end_at=_opt_date(_opt_json_file(params.get('end_at')))
+        )
 
         if params.get('absorption_time'):
             kwargs.update(absorption_duration=int(params.get('absorption_time')))
@@ -240,12 +391,29 @@ class scheiner_carb_effect(Use):
         if params.get('absorption_delay'):
             kwargs.update(absorption_delay=int(params.get('absorption_delay')))
 
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
+
+        if params.get('dtype') and params.get('engine') == 'convolution':
+            kwargs.update(dtype=params.get('dtype'))
+
         return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                params = self.get_params(args)
+                args, kwargs = self.get_program(params)
 
-        return calculate_carb_effect(*args, **kwargs)
+            if params.get('engine') == 'convolution':
+                return convolve_carb_effect(*args, **kwargs)
+
+            return calculate_carb_effect(*args, **kwargs)
+
+    @staticmethod
+    def prerender_text(effect):
+        """Encodes the effect compactly when the report is added with the text reporter"""
+        return _compact_effect(effect)
 
 
 # noinspection PyPep8Naming
@@ -267,6 +435,13 @@ class scheiner_cob(Use):
             help='The total length of carbohydrate absorption in minutes'
         )
 
+        parser.add_argument(
+            '--carb-model',
+            nargs=argparse.OPTIONAL,
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
+        )
+
         parser.add_argument(
             '--absorption-delay',
             type=int,
@@ -274,12 +449,43 @@ class scheiner_cob(Use):
             help='The delay time between a dosing event and when absorption begins'
         )
 
+        parser.add_argument(
+            '--start-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the beginning of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--end-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the end of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--engine',
+            nargs=argparse.OPTIONAL,
+            choices=('event', 'convolution'),
+            help='Evaluate each meal at every timestamp (event), or convolve a meal vector with the '
+                 'absorption curve (convolution). Defaults to event.'
+        )
+
+        parser.add_argument(
+            '--dtype',
+            nargs=argparse.OPTIONAL,
+            choices=('float64', 'float32'),
+            help='The precision of the convolution engine. float32 halves its memory, within 1e-4 g of float64. '
+                 'Defaults to float64.'
+        )
+
     def get_params(self, args):
         params = super(scheiner_cob, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('history', 'absorption_time', 'absorption_delay'):
+        for key in ('history', 'absorption_time', 'carb_model', 'absorption_delay', 'start_at', 'end_at', 'engine',
+                    'dtype'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -299,7 +505,10 @@ class scheiner_cob(Use):
             _json_file(params['history']),
         )
 
-        kwargs = dict()
+        kwargs = dict(
+            start_at=_opt_date(_opt_json_file(params.get('start_at'))),
+            end_at=_opt_date(_opt_json_file(params.get('end_at')))
+        )
 
         if params.get('absorption_time'):
             kwargs.update(absorption_duration=int(params.get('absorption_time')))
@@ -307,17 +516,34 @@ class scheiner_cob(Use):
         if params.get('absorption_delay'):
             kwargs.update(absorption_delay=int(params.get('absorption_delay')))
 
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
+
+        if params.get('dtype') and params.get('engine') == 'convolution':
+            kwargs.update(dtype=params.get('dtype'))
+
         return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                params = self.get_params(args)
+                args, kwargs = self.get_program(params)
 
-        return calculate_cob(*args, **kwargs)
+            if params.get('engine') == 'convolution':
+                return convolve_cob(*args, **kwargs)
+
+            return calculate_cob(*args, **kwargs)
+
+    @staticmethod
+    def prerender_text(effect):
+        """Encodes the effect compactly when the report is added with the text reporter"""
+        return _compact_effect(effect)
 
 
 # noinspection PyPep8Naming
-class walsh_insulin_effect(Use):
-    """Predict insulin effect on glucose, using Walsh's IOB algorithm
+class scheiner_cob_and_carb_effect(Use):
+    """Predict unabsorbed carbohydrates and carb effect on glucose together, using the Scheiner GI curve
 
     """
     @staticmethod
@@ -328,29 +554,27 @@ class walsh_insulin_effect(Use):
         )
 
         parser.add_argument(
-            '--settings',
-            nargs=argparse.OPTIONAL,
-            help='JSON-encoded pump settings file, optional if --insulin-action-curve is set'
+            '--carb-ratios',
+            help='JSON-encoded carb ratio schedule file'
         )
 
         parser.add_argument(
-            '--insulin-action-curve',
-            nargs=argparse.OPTIONAL,
-            type=float,
-            choices=range(3, 7),
-            help='Insulin action curve, optional if --settings is set'
+            '--insulin-sensitivities',
+            help='JSON-encoded insulin sensitivities schedule file'
         )
 
         parser.add_argument(
-            '--insulin-sensitivities',
-            help='JSON-encoded insulin sensitivities schedule file'
+            '--absorption-time',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The total length of carbohydrate absorption in minutes'
         )
 
         parser.add_argument(
-            '--basal-dosing-end',
+            '--carb-model',
             nargs=argparse.OPTIONAL,
-            help='The timestamp at which temp basal dosing should be assumed to end, '
-                 'as a JSON-encoded pump clock file'
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
         )
 
         parser.add_argument(
@@ -360,12 +584,33 @@ class walsh_insulin_effect(Use):
             help='The delay time between a dosing event and when absorption begins'
         )
 
+        parser.add_argument(
+            '--start-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the beginning of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--end-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the end of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
     def get_params(self, args):
-        params = super(walsh_insulin_effect, self).get_params(args)
+        params = super(scheiner_cob_and_carb_effect, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('history', 'settings', 'insulin_action_curve', 'insulin_sensitivities', 'basal_dosing_end', 'absorption_delay'):
+        for key in ('history',
+                    'carb_ratios',
+                    'insulin_sensitivities',
+                    'absorption_time',
+                    'carb_model',
+                    'absorption_delay',
+                    'start_at',
+                    'end_at'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -383,29 +628,37 @@ class walsh_insulin_effect(Use):
         """
         args = (
             _json_file(params['history']),
-            int(params.get('insulin_action_curve', None) or
-                _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
+            Schedule(_json_file(params['carb_ratios'])['schedule']),
             Schedule(_json_file(params['insulin_sensitivities'])['sensitivities'])
         )
 
         kwargs = dict(
-            basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end')))
+            start_at=_opt_date(_opt_json_file(params.get('start_at'))),
+            end_at=_opt_date(_opt_json_file(params.get('end_at')))
         )
 
+        if params.get('absorption_time'):
+            kwargs.update(absorption_duration=int(params.get('absorption_time')))
+
         if params.get('absorption_delay'):
             kwargs.update(absorption_delay=int(params.get('absorption_delay')))
 
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
+
         return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
 
-        return calculate_insulin_effect(*args, **kwargs)
+            return calculate_cob_and_carb_effect(*args, **kwargs)
 
 
 # noinspection PyPep8Naming
-class walsh_iob(Use):
-    """Predict IOB using Walsh's algorithm
+class walsh_insulin_effect(Use):
+    """Predict insulin effect on glucose, using Walsh's IOB algorithm
 
     """
     @staticmethod
@@ -425,8 +678,19 @@ class walsh_iob(Use):
             '--insulin-action-curve',
             nargs=argparse.OPTIONAL,
             type=float,
-            choices=range(3, 7),
-            help='Insulin action curve, optional if --settings is set'
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
+        )
+
+        parser.add_argument(
+            '--insulin-sensitivities',
+            help='JSON-encoded insulin sensitivities schedule file'
         )
 
         parser.add_argument(
@@ -457,18 +721,47 @@ class walsh_iob(Use):
                  'as a JSON-encoded ISO date'
         )
 
+        parser.add_argument(
+            '--integration-tolerance',
+            type=float,
+            nargs=argparse.OPTIONAL,
+            help='Integrate temp basals adaptively to this error, as a fraction of the dose. '
+                 'Defaults to a fixed resolution.'
+        )
+
+        parser.add_argument(
+            '--engine',
+            nargs=argparse.OPTIONAL,
+            choices=('event', 'convolution'),
+            help='Evaluate each dose at every timestamp (event), or convolve a delivery vector with the '
+                 'insulin curve (convolution). Defaults to event.'
+        )
+
+        parser.add_argument(
+            '--dtype',
+            nargs=argparse.OPTIONAL,
+            choices=('float64', 'float32'),
+            help='The precision of the convolution engine. float32 halves its memory, within 5e-4 mg/dL of float64. '
+                 'Defaults to float64.'
+        )
+
     def get_params(self, args):
-        params = super(walsh_iob, self).get_params(args)
+        params = super(walsh_insulin_effect, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
         for key in ('history',
                     'settings',
                     'insulin_action_curve',
+                    'insulin_model',
+                    'insulin_sensitivities',
                     'basal_dosing_end',
                     'absorption_delay',
                     'start_at',
-                    'end_at'):
+                    'end_at',
+                    'integration_tolerance',
+                    'engine',
+                    'dtype'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -486,8 +779,9 @@ class walsh_iob(Use):
         """
         args = (
             _json_file(params['history']),
-            int(params.get('insulin_action_curve', None) or
-                _opt_json_file(params.get('settings', ''))['insulin_action_curve'])
+            float(params.get('insulin_action_curve', None) or
+                _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
+            Schedule(_json_file(params['insulin_sensitivities'])['sensitivities'])
         )
 
         kwargs = dict(
@@ -499,43 +793,116 @@ class walsh_iob(Use):
         if params.get('absorption_delay'):
             kwargs.update(absorption_delay=int(params.get('absorption_delay')))
 
+        if params.get('integration_tolerance') and params.get('engine') != 'convolution':
+            kwargs.update(integrator=AdaptiveSimpson(tolerance=float(params.get('integration_tolerance'))))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        if params.get('dtype') and params.get('engine') == 'convolution':
+            kwargs.update(dtype=params.get('dtype'))
+
         return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                params = self.get_params(args)
+                args, kwargs = self.get_program(params)
+
+            if params.get('engine') == 'convolution':
+                return convolve_insulin_effect(*args, **kwargs)
 
-        return calculate_iob(*args, **kwargs)
+            return calculate_insulin_effect(*args, **kwargs)
+
+    @staticmethod
+    def prerender_text(effect):
+        """Encodes the effect compactly when the report is added with the text reporter"""
+        return _compact_effect(effect)
 
 
 # noinspection PyPep8Naming
-class glucose_from_effects(Use):
-    """Predict glucose from one or more effect schedules
+class walsh_iob(Use):
+    """Predict IOB using Walsh's algorithm
 
     """
     @staticmethod
     def configure_app(app, parser):
         parser.add_argument(
-            'effects',
-            nargs=argparse.ONE_OR_MORE,
-            help='JSON-encoded effect schedules data files'
+            'history',
+            help='JSON-encoded pump history data file, normalized by openapscontrib.mmhistorytools'
         )
 
         parser.add_argument(
-            '--glucose',
-            help='JSON-encoded glucose data file in reverse-chronological order'
+            '--settings',
+            nargs=argparse.OPTIONAL,
+            help='JSON-encoded pump settings file, optional if --insulin-action-curve is set'
         )
 
         parser.add_argument(
-            '--momentum',
-            help='JSON-encoded momentum effect schedule data file'
+            '--insulin-action-curve',
+            nargs=argparse.OPTIONAL,
+            type=float,
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
+        )
+
+        parser.add_argument(
+            '--basal-dosing-end',
+            nargs=argparse.OPTIONAL,
+            help='The timestamp at which temp basal dosing should be assumed to end, '
+                 'as a JSON-encoded pump clock file'
+        )
+
+        parser.add_argument(
+            '--absorption-delay',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The delay time between a dosing event and when absorption begins'
+        )
+
+        parser.add_argument(
+            '--start-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the beginning of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--end-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the end of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--integration-tolerance',
+            type=float,
+            nargs=argparse.OPTIONAL,
+            help='Integrate temp basals adaptively to this error, as a fraction of the dose. '
+                 'Defaults to a fixed resolution.'
         )
 
     def get_params(self, args):
-        params = super(glucose_from_effects, self).get_params(args)
+        params = super(walsh_iob, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('effects', 'glucose', 'momentum'):
+        for key in ('history',
+                    'settings',
+                    'insulin_action_curve',
+                    'insulin_model',
+                    'basal_dosing_end',
+                    'absorption_delay',
+                    'start_at',
+                    'end_at',
+                    'integration_tolerance'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -551,46 +918,853 @@ class glucose_from_effects(Use):
         :return:
         :rtype: tuple(list, dict)
         """
-        effect_files = params['effects']
-
+        args = (
+            _json_file(params['history']),
+            float(params.get('insulin_action_curve', None) or
+                _opt_json_file(params.get('settings', ''))['insulin_action_curve'])
+        )
+
+        kwargs = dict(
+            basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end'))),
+            start_at=_opt_date(_opt_json_file(params.get('start_at'))),
+            end_at=_opt_date(_opt_json_file(params.get('end_at')))
+        )
+
+        if params.get('absorption_delay'):
+            kwargs.update(absorption_delay=int(params.get('absorption_delay')))
+
+        if params.get('integration_tolerance'):
+            kwargs.update(integrator=AdaptiveSimpson(tolerance=float(params.get('integration_tolerance'))))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        return args, kwargs
+
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
+
+            return calculate_iob(*args, **kwargs)
+
+    @staticmethod
+    def prerender_text(effect):
+        """Encodes the effect compactly when the report is added with the text reporter"""
+        return _compact_effect(effect)
+
+
+# noinspection PyPep8Naming
+class walsh_iob_and_insulin_effect(Use):
+    """Predict IOB and insulin effect on glucose together, using Walsh's algorithm
+
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'history',
+            help='JSON-encoded pump history data file, normalized by openapscontrib.mmhistorytools'
+        )
+
+        parser.add_argument(
+            '--settings',
+            nargs=argparse.OPTIONAL,
+            help='JSON-encoded pump settings file, optional if --insulin-action-curve is set'
+        )
+
+        parser.add_argument(
+            '--insulin-action-curve',
+            nargs=argparse.OPTIONAL,
+            type=float,
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
+        )
+
+        parser.add_argument(
+            '--insulin-sensitivities',
+            help='JSON-encoded insulin sensitivities schedule file'
+        )
+
+        parser.add_argument(
+            '--basal-dosing-end',
+            nargs=argparse.OPTIONAL,
+            help='The timestamp at which temp basal dosing should be assumed to end, '
+                 'as a JSON-encoded pump clock file'
+        )
+
+        parser.add_argument(
+            '--absorption-delay',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The delay time between a dosing event and when absorption begins'
+        )
+
+        parser.add_argument(
+            '--start-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the beginning of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--end-at',
+            nargs=argparse.OPTIONAL,
+            help='File containing the timestamp at which to truncate the end of the output, '
+                 'as a JSON-encoded ISO date'
+        )
+
+        parser.add_argument(
+            '--integration-tolerance',
+            type=float,
+            nargs=argparse.OPTIONAL,
+            help='Integrate temp basals adaptively to this error, as a fraction of the dose. '
+                 'Defaults to a fixed resolution.'
+        )
+
+    def get_params(self, args):
+        params = super(walsh_iob_and_insulin_effect, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('history',
+                    'settings',
+                    'insulin_action_curve',
+                    'insulin_model',
+                    'insulin_sensitivities',
+                    'basal_dosing_end',
+                    'absorption_delay',
+                    'start_at',
+                    'end_at',
+                    'integration_tolerance'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into history parser constructor arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        args = (
+            _json_file(params['history']),
+            float(params.get('insulin_action_curve', None) or
+                _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
+            Schedule(_json_file(params['insulin_sensitivities'])['sensitivities'])
+        )
+
+        kwargs = dict(
+            basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end'))),
+            start_at=_opt_date(_opt_json_file(params.get('start_at'))),
+            end_at=_opt_date(_opt_json_file(params.get('end_at')))
+        )
+
+        if params.get('absorption_delay'):
+            kwargs.update(absorption_delay=int(params.get('absorption_delay')))
+
+        if params.get('integration_tolerance'):
+            kwargs.update(integrator=AdaptiveSimpson(tolerance=float(params.get('integration_tolerance'))))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        return args, kwargs
+
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
+
+            return calculate_iob_and_insulin_effect(*args, **kwargs)
+
+
+# noinspection PyPep8Naming
+class glucose_from_effects(Use):
+    """Predict glucose from one or more effect schedules
+
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'effects',
+            nargs=argparse.ONE_OR_MORE,
+            help='JSON-encoded or compact effect schedules data files'
+        )
+
+        parser.add_argument(
+            '--glucose',
+            help='JSON-encoded glucose data file in reverse-chronological order'
+        )
+
+        parser.add_argument(
+            '--momentum',
+            help='JSON-encoded momentum effect schedule data file'
+        )
+
+    def get_params(self, args):
+        params = super(glucose_from_effects, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('effects', 'glucose', 'momentum'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into history parser constructor arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        effect_files = params['effects']
+
         if isinstance(effect_files, str):
             effect_files = ast.literal_eval(effect_files)
 
-        recent_glucose = _json_file(params['glucose'])
+        recent_glucose = _recent_glucose_file(params['glucose'])
+
+        effects = []
+
+        for f in effect_files:
+            file_time = datetime.fromtimestamp(os.path.getmtime(f))
+            assert datetime.now() - file_time < timedelta(minutes=5), '{} is more than 5 minutes old'.format(f)
+
+            effects.append(_effect_file(f))
+
+        args = (effects, recent_glucose)
+        kwargs = {}
+
+        momentum_file_name = params.get('momentum')
+        if momentum_file_name:
+            kwargs['momentum'] = _opt_json_file(params.get('momentum'))
+            file_time = datetime.fromtimestamp(os.path.getmtime(params['momentum']))
+            assert datetime.now() - file_time < timedelta(minutes=5), '{} is more than 5 minutes old'.format()
+
+        return args, kwargs
+
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
+
+            return calculate_glucose_from_effects(*args, **kwargs)
+
+
+# noinspection PyPep8Naming
+class temp_basal_recommendation(Use):
+    """Rank candidate temp basals by how well they keep predicted glucose within a target range
+
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'history',
+            help='JSON-encoded pump history data file, normalized by openapscontrib.mmhistorytools'
+        )
+
+        parser.add_argument(
+            'glucose',
+            help='JSON-encoded glucose data file in reverse-chronological order'
+        )
+
+        parser.add_argument(
+            '--settings',
+            nargs=argparse.OPTIONAL,
+            help='JSON-encoded pump settings file, optional if --insulin-action-curve is set'
+        )
+
+        parser.add_argument(
+            '--insulin-action-curve',
+            nargs=argparse.OPTIONAL,
+            type=float,
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
+        )
+
+        parser.add_argument(
+            '--insulin-sensitivities',
+            help='JSON-encoded insulin sensitivities schedule file'
+        )
+
+        parser.add_argument(
+            '--carb-ratios',
+            help='JSON-encoded carb ratio schedule file'
+        )
+
+        parser.add_argument(
+            '--carb-model',
+            nargs=argparse.OPTIONAL,
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
+        )
+
+        parser.add_argument(
+            '--basal-dosing-end',
+            nargs=argparse.OPTIONAL,
+            help='The timestamp at which temp basal dosing should be assumed to end, '
+                 'as a JSON-encoded pump clock file. Defaults to the latest glucose entry, '
+                 'since the recommended temp basal replaces the one running'
+        )
+
+        parser.add_argument(
+            '--rates',
+            nargs=argparse.ONE_OR_MORE,
+            type=float,
+            help='The candidate temp basal rates in U/hour, relative to the scheduled basal'
+        )
+
+        parser.add_argument(
+            '--durations',
+            nargs=argparse.ONE_OR_MORE,
+            type=int,
+            help='The candidate temp basal durations in minutes. Defaults to 30.'
+        )
+
+        parser.add_argument(
+            '--target-range',
+            nargs=2,
+            type=float,
+            help='The low and high target glucose in mg/dL. Defaults to 90 120.'
+        )
+
+    def get_params(self, args):
+        params = super(temp_basal_recommendation, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('history',
+                    'glucose',
+                    'settings',
+                    'insulin_action_curve',
+                    'insulin_model',
+                    'insulin_sensitivities',
+                    'carb_ratios',
+                    'carb_model',
+                    'basal_dosing_end',
+                    'rates',
+                    'durations',
+                    'target_range'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into history parser constructor arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        args = (
+            _json_file(params['history']),
+            _json_file(params['glucose']),
+            float(params.get('insulin_action_curve', None) or
+                _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
+            Schedule(_json_file(params['insulin_sensitivities'])['sensitivities']),
+            Schedule(_json_file(params['carb_ratios'])['schedule']),
+            [float(rate) for rate in _opt_list(params['rates'])]
+        )
+
+        kwargs = dict(
+            basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end')))
+        )
+
+        if params.get('durations'):
+            kwargs.update(durations=[int(duration) for duration in _opt_list(params['durations'])])
+
+        if params.get('target_range'):
+            kwargs.update(target_range=tuple(float(target) for target in _opt_list(params['target_range'])))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
+
+        return args, kwargs
+
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
+
+            return recommend_temp_basal(*args, **kwargs)
+
+
+# noinspection PyPep8Naming
+class archive_import(Use):
+    """Append the history, glucose and calibrations of changed report files to binary archives
+
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'reports',
+            help='The openaps report directory to scan for JSON-encoded history, glucose and calibration files'
+        )
+
+        parser.add_argument(
+            'archive',
+            help='The directory of the archives, created if missing'
+        )
+
+    def get_params(self, args):
+        params = super(archive_import, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('reports', 'archive'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into importer constructor and ingest arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        args = (
+            params['archive'],
+            params['reports']
+        )
+
+        return args, {}
+
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
+
+            archive_directory, report_directory = args
+
+            return Importer(archive_directory).ingest(report_directory, **kwargs)
+
+
+# noinspection PyPep8Naming
+class glucose_backtest(Use):
+    """Replay archived snapshots through glucose prediction, and summarize the error against recorded glucose
+
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'snapshots',
+            help='JSON-encoded list of snapshots, each a dictionary of the history, glucose, settings, '
+                 'insulin_sensitivities and carb_ratios files of one loop, relative to the list'
+        )
+
+        parser.add_argument(
+            '--actual-glucose',
+            nargs=argparse.OPTIONAL,
+            help='JSON-encoded recorded glucose data file. Defaults to the glucose of every snapshot.'
+        )
+
+        parser.add_argument(
+            '--horizons',
+            type=int,
+            nargs='+',
+            help='The minutes after each prediction at which to compare with recorded glucose. Defaults to 30 60 120'
+        )
+
+        parser.add_argument(
+            '--processes',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The number of worker processes. Defaults to the number of CPUs.'
+        )
+
+    def get_params(self, args):
+        params = super(glucose_backtest, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('snapshots',
+                    'actual_glucose',
+                    'horizons',
+                    'processes'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into history parser constructor arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        args = (
+            load_manifest(params['snapshots']),
+        )
+
+        kwargs = dict(
+            actual_glucose=_opt_json_file(params.get('actual_glucose'))
+        )
+
+        if params.get('horizons'):
+            kwargs.update(horizons=[int(horizon) for horizon in _opt_list(params['horizons'])])
 
-        if len(recent_glucose) > 0:
-            glucose_file_time = datetime.fromtimestamp(os.path.getmtime(params['glucose']))
-            last_glucose_datetime = parse(glucose_data_tuple(recent_glucose[0])[0])
+        if params.get('processes'):
+            kwargs.update(processes=int(params.get('processes')))
 
-            if last_glucose_datetime.utcoffset() is not None:
-                last_glucose_datetime = make_naive(last_glucose_datetime)
+        return args, kwargs
 
-            assert abs(glucose_file_time - last_glucose_datetime) < timedelta(minutes=15), \
-                'Glucose data is more than 15 minutes old'
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
 
-        effects = []
+            return backtest(*args, **kwargs)
 
-        for f in effect_files:
-            file_time = datetime.fromtimestamp(os.path.getmtime(f))
-            assert datetime.now() - file_time < timedelta(minutes=5), '{} is more than 5 minutes old'.format(f)
 
-            effects.append(_json_file(f))
+# noinspection PyPep8Naming
+class glucose_bands(Use):
+    """Predict percentile bands of glucose over an ensemble of perturbed insulin sensitivities, carb ratios,
+    absorption times and insulin action curves
 
-        args = (effects, recent_glucose)
-        kwargs = {}
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'history',
+            help='JSON-encoded pump history data file, normalized by openapscontrib.mmhistorytools'
+        )
 
-        momentum_file_name = params.get('momentum')
-        if momentum_file_name:
-            kwargs['momentum'] = _opt_json_file(params.get('momentum'))
-            file_time = datetime.fromtimestamp(os.path.getmtime(params['momentum']))
-            assert datetime.now() - file_time < timedelta(minutes=5), '{} is more than 5 minutes old'.format()
+        parser.add_argument(
+            'glucose',
+            help='JSON-encoded glucose data file in reverse-chronological order'
+        )
+
+        parser.add_argument(
+            '--settings',
+            nargs=argparse.OPTIONAL,
+            help='JSON-encoded pump settings file, optional if --insulin-action-curve is set'
+        )
+
+        parser.add_argument(
+            '--insulin-action-curve',
+            nargs=argparse.OPTIONAL,
+            type=float,
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
+        )
+
+        parser.add_argument(
+            '--insulin-sensitivities',
+            help='JSON-encoded insulin sensitivities schedule file'
+        )
+
+        parser.add_argument(
+            '--carb-ratios',
+            help='JSON-encoded carb ratio schedule file'
+        )
+
+        parser.add_argument(
+            '--carb-model',
+            nargs=argparse.OPTIONAL,
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
+        )
+
+        parser.add_argument(
+            '--basal-dosing-end',
+            nargs=argparse.OPTIONAL,
+            help='The timestamp at which temp basal dosing should be assumed to end, '
+                 'as a JSON-encoded pump clock file'
+        )
+
+        parser.add_argument(
+            '--absorption-time',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The total length of carbohydrate absorption in minutes'
+        )
+
+        parser.add_argument(
+            '--percentiles',
+            type=float,
+            nargs='+',
+            help='The percentiles of predicted glucose to return. Defaults to 10 50 90'
+        )
+
+        parser.add_argument(
+            '--members',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The number of members in the ensemble. Defaults to 1000'
+        )
+
+        parser.add_argument(
+            '--seed',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The seed of the random number generator, for repeatable bands'
+        )
+
+        parser.add_argument(
+            '--dtype',
+            nargs=argparse.OPTIONAL,
+            choices=('float64', 'float32'),
+            help='The precision of the ensemble. float32 halves its memory, within 5e-4 mg/dL of float64. '
+                 'Defaults to float64.'
+        )
+
+    def get_params(self, args):
+        params = super(glucose_bands, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('history',
+                    'glucose',
+                    'settings',
+                    'insulin_action_curve',
+                    'insulin_model',
+                    'insulin_sensitivities',
+                    'carb_ratios',
+                    'carb_model',
+                    'basal_dosing_end',
+                    'absorption_time',
+                    'percentiles',
+                    'members',
+                    'seed',
+                    'dtype'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into history parser constructor arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        args = (
+            _json_file(params['history']),
+            _json_file(params['glucose']),
+            float(params.get('insulin_action_curve', None) or
+                _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
+            Schedule(_json_file(params['insulin_sensitivities'])['sensitivities']),
+            Schedule(_json_file(params['carb_ratios'])['schedule'])
+        )
+
+        kwargs = dict(
+            basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end')))
+        )
+
+        if params.get('absorption_time'):
+            kwargs.update(absorption_duration=int(params.get('absorption_time')))
+
+        if params.get('percentiles'):
+            kwargs.update(percentiles=[float(p) for p in _opt_list(params['percentiles'])])
+
+        if params.get('members'):
+            kwargs.update(members=int(params.get('members')))
+
+        if params.get('seed') is not None:
+            kwargs.update(seed=int(params.get('seed')))
+
+        if params.get('dtype'):
+            kwargs.update(dtype=params.get('dtype'))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
+
+        return args, kwargs
+
+    def main(self, args, app):
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
+
+            return predict_glucose_bands(*args, **kwargs)
+
+
+# noinspection PyPep8Naming
+class glucose_scenarios(Use):
+    """Predict glucose for hypothetical boluses, temp basals and meals
+
+    """
+    @staticmethod
+    def configure_app(app, parser):
+        parser.add_argument(
+            'history',
+            help='JSON-encoded pump history data file, normalized by openapscontrib.mmhistorytools'
+        )
+
+        parser.add_argument(
+            'glucose',
+            help='JSON-encoded glucose data file in reverse-chronological order'
+        )
+
+        parser.add_argument(
+            'scenarios',
+            help='JSON-encoded list of scenarios, each a list of hypothetical events in the normalized history format'
+        )
+
+        parser.add_argument(
+            '--settings',
+            nargs=argparse.OPTIONAL,
+            help='JSON-encoded pump settings file, optional if --insulin-action-curve is set'
+        )
+
+        parser.add_argument(
+            '--insulin-action-curve',
+            nargs=argparse.OPTIONAL,
+            type=float,
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
+        )
+
+        parser.add_argument(
+            '--insulin-sensitivities',
+            help='JSON-encoded insulin sensitivities schedule file'
+        )
+
+        parser.add_argument(
+            '--carb-ratios',
+            help='JSON-encoded carb ratio schedule file'
+        )
+
+        parser.add_argument(
+            '--carb-model',
+            nargs=argparse.OPTIONAL,
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
+        )
+
+        parser.add_argument(
+            '--basal-dosing-end',
+            nargs=argparse.OPTIONAL,
+            help='The timestamp at which temp basal dosing should be assumed to end, '
+                 'as a JSON-encoded pump clock file'
+        )
+
+        parser.add_argument(
+            '--absorption-time',
+            type=int,
+            nargs=argparse.OPTIONAL,
+            help='The total length of carbohydrate absorption in minutes, for hypothetical meals'
+        )
+
+    def get_params(self, args):
+        params = super(glucose_scenarios, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('history',
+                    'glucose',
+                    'scenarios',
+                    'settings',
+                    'insulin_action_curve',
+                    'insulin_model',
+                    'insulin_sensitivities',
+                    'carb_ratios',
+                    'carb_model',
+                    'basal_dosing_end',
+                    'absorption_time'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    @staticmethod
+    def get_program(params):
+        """Parses params into history parser constructor arguments
+
+        :param params:
+        :type params: dict
+        :return:
+        :rtype: tuple(list, dict)
+        """
+        args = (
+            _json_file(params['history']),
+            _json_file(params['glucose']),
+            float(params.get('insulin_action_curve', None) or
+                _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
+            Schedule(_json_file(params['insulin_sensitivities'])['sensitivities']),
+            Schedule(_json_file(params['carb_ratios'])['schedule']),
+            _json_file(params['scenarios'])
+        )
+
+        kwargs = dict(
+            basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end')))
+        )
+
+        if params.get('absorption_time'):
+            kwargs.update(absorption_duration=int(params.get('absorption_time')))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
 
         return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
 
-        return calculate_glucose_from_effects(*args, **kwargs)
+            return predict_scenarios(*args, **kwargs)
 
 
 # noinspection PyPep8Naming
@@ -624,8 +1798,14 @@ class glucose(Use):
             '--insulin-action-curve',
             nargs=argparse.OPTIONAL,
             type=float,
-            choices=range(3, 7),
-            help='Insulin action curve, optional if --settings is set'
+            help='Insulin action curve in hours, optional if --settings is set'
+        )
+
+        parser.add_argument(
+            '--insulin-model',
+            nargs=argparse.OPTIONAL,
+            choices=insulin_models.keys(),
+            help='The insulin action curve model. Defaults to walsh.'
         )
 
         parser.add_argument(
@@ -638,6 +1818,13 @@ class glucose(Use):
             help='JSON-encoded carb ratio schedule file'
         )
 
+        parser.add_argument(
+            '--carb-model',
+            nargs=argparse.OPTIONAL,
+            choices=carb_models.keys(),
+            help='The carbohydrate absorption curve model. Defaults to scheiner.'
+        )
+
         parser.add_argument(
             '--basal-dosing-end',
             nargs=argparse.OPTIONAL,
@@ -657,6 +1844,12 @@ class glucose(Use):
         if params.get('basal_dosing_end') is None:
             params.pop('basal_dosing_end', None)
 
+        if params.get('insulin_model') is None:
+            params.pop('insulin_model', None)
+
+        if params.get('carb_model') is None:
+            params.pop('carb_model', None)
+
         params.pop('use', None)
         params.pop('action', None)
         params.pop('report', None)
@@ -674,30 +1867,30 @@ class glucose(Use):
         pump_history_file_time = datetime.fromtimestamp(os.path.getmtime(params['pump-history']))
         assert datetime.now() - pump_history_file_time < timedelta(minutes=5), 'History data is more than 5 minutes old'
 
-        recent_glucose = _json_file(params['glucose'])
-
-        if len(recent_glucose) > 0:
-            glucose_file_time = datetime.fromtimestamp(os.path.getmtime(params['glucose']))
-            last_glucose_datetime = parse(glucose_data_tuple(recent_glucose[0])[0])
-
-            if last_glucose_datetime.utcoffset() is not None:
-                last_glucose_datetime = make_naive(last_glucose_datetime)
-
-            assert abs(glucose_file_time - last_glucose_datetime) < timedelta(minutes=15), \
-                'Glucose data is more than 15 minutes old'
+        recent_glucose = _recent_glucose_file(params['glucose'])
 
         args = (
             _json_file(params['pump-history']),
             recent_glucose,
-            int(params.get('insulin_action_curve', None) or
+            float(params.get('insulin_action_curve', None) or
                 _opt_json_file(params.get('settings', ''))['insulin_action_curve']),
             Schedule(_json_file(params['insulin_sensitivities'])['sensitivities']),
             Schedule(_json_file(params['carb_ratios'])['schedule']),
         )
 
-        return args, dict(basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end'))))
+        kwargs = dict(basal_dosing_end=_opt_date(_opt_json_file(params.get('basal_dosing_end'))))
+
+        if params.get('insulin_model'):
+            kwargs.update(insulin_model=params.get('insulin_model'))
+
+        if params.get('carb_model'):
+            kwargs.update(carb_model=params.get('carb_model'))
+
+        return args, kwargs
 
     def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+        with run(self.name):
+            with span('get_program'):
+                args, kwargs = self.get_program(self.get_params(args))
 
-        return future_glucose(*args, **kwargs)
+            return future_glucose(*args, **kwargs)
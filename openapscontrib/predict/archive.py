@@ -0,0 +1,348 @@
+"""
+archive - an append-only binary store of history and glucose records for retrospective analysis
+
+Each archive is a pair of files. `<path>.bin` holds fixed-size records in chronological order of their start, and is
+read with `numpy.memmap`, so a time range is found by binary search over the mapped start column and read without
+copying or parsing. `<path>.json` is the companion index: the number of complete records, the longest record duration,
+and the tables of unit and type names that the record codes refer to.
+
+Records are appended in order. Records at the end of the archive can also be replaced, for example when a temp basal's
+planned end is corrected after it's cancelled, or when late glucose is backfilled. A replacement is first written to a
+`<path>.journal` file, which is applied again if the archive is opened after an interrupted replacement.
+
+Timestamps are stored as microseconds since the epoch of their wall-clock time, dropping any UTC offset, in the same
+way the backtest compares timestamps. Records keep the fields the calculators use, so descriptions and per-meal
+absorption times aren't archived.
+"""
+import datetime
+from dateutil.parser import parse
+import json
+import os
+
+import numpy
+
+from .models import Unit
+from .predict import GlucoseSeries
+from .predict import microseconds
+
+
+try:
+    basestring
+except NameError:
+    # Python 3
+    basestring = str
+
+
+RECORD = numpy.dtype([
+    ('start', '<i8'),
+    ('end', '<i8'),
+    ('amount', '<f8'),
+    ('unit', 'u1'),
+    ('type', 'u1')
+])
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+GLUCOSE_TYPE = 'Glucose'
+
+
+def epoch_microseconds(timestamp):
+    """Returns the wall-clock time of a timestamp in microseconds since the epoch
+
+    :param timestamp: An ISO date string, or a datetime
+    :type timestamp: basestring|datetime.datetime
+    :rtype: int
+    """
+    if isinstance(timestamp, basestring):
+        timestamp = parse(timestamp)
+
+    return microseconds(timestamp.replace(tzinfo=None) - EPOCH)
+
+
+def isoformat(values):
+    """Formats microseconds since the epoch as ISO date strings, like `datetime.isoformat`
+
+    :param values: Microseconds since the epoch
+    :type values: numpy.ndarray
+    :rtype: list(str)
+    """
+    values = numpy.asarray(values, dtype='datetime64[us]')
+
+    return numpy.where(
+        values.astype(numpy.int64) % 10 ** 6 == 0,
+        numpy.datetime_as_string(values, unit='s'),
+        numpy.datetime_as_string(values, unit='us')
+    ).tolist()
+
+
+class Archive(object):
+    """An append-only archive of records, each with a start and end time, an amount, a unit, and a type"""
+    def __init__(self, path):
+        """
+
+        :param path: The path of the archive files, without an extension
+        :type path: basestring
+        """
+        self.path = path
+        self.data_path = path + '.bin'
+        self.index_path = path + '.json'
+        self.journal_path = path + '.journal'
+        self._records = None
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as fp:
+                self.index = json.load(fp)
+        else:
+            self.index = {'count': 0, 'max_duration': 0, 'units': [], 'types': []}
+
+        if os.path.exists(self.journal_path):
+            self._apply_journal()
+
+    def __len__(self):
+        return self.index['count']
+
+    @property
+    def all_records(self):
+        """The memory-mapped records
+
+        :rtype: numpy.ndarray
+        """
+        if len(self) == 0:
+            return numpy.zeros(0, dtype=RECORD)
+
+        if self._records is None or len(self._records) != len(self):
+            self._records = numpy.memmap(self.data_path, dtype=RECORD, mode='r', shape=(len(self),))
+
+        return self._records
+
+    def records(self, start=None, end=None):
+        """Returns the records which start within a time range, without copying them
+
+        :param start: The start of the range, inclusive
+        :type start: datetime.datetime
+        :param end: The end of the range, inclusive
+        :type end: datetime.datetime
+        :return: A read-only view of the records, in chronological order
+        :rtype: numpy.ndarray
+        """
+        records = self.all_records
+        starts = records['start']
+        first = 0 if start is None else numpy.searchsorted(starts, epoch_microseconds(start), side='left')
+        last = len(records) if end is None else numpy.searchsorted(starts, epoch_microseconds(end), side='right')
+
+        return records[first:max(first, last)]
+
+    def overlapping(self, start=None, end=None):
+        """Returns the records whose span overlaps a time range
+
+        Records are ordered by start, so only the records which started within the longest duration before the range
+        are searched.
+
+        :param start: The start of the range, inclusive
+        :type start: datetime.datetime
+        :param end: The end of the range, inclusive
+        :type end: datetime.datetime
+        :return: The records, in chronological order
+        :rtype: numpy.ndarray
+        """
+        if start is None:
+            return self.records(end=end)
+
+        records = self.records(start - datetime.timedelta(microseconds=self.index['max_duration']), end)
+
+        return records[records['end'] >= epoch_microseconds(start)]
+
+    def code(self, table, name):
+        """Returns the code of a unit or type name, adding it to its table if it's new
+
+        :param table: The table key in the index, "units" or "types"
+        :type table: str
+        :param name: The name to encode
+        :type name: basestring
+        :rtype: int
+        """
+        names = self.index[table]
+
+        if name not in names:
+            if len(names) > numpy.iinfo(RECORD[table[:-1]]).max:
+                raise ValueError('Too many distinct {} to encode {}'.format(table, name))
+
+            names.append(name)
+
+        return names.index(name)
+
+    def append(self, records):
+        """Appends records, sorted by start, to the end of the archive
+
+        :param records: The records to append
+        :type records: numpy.ndarray
+        :raises ValueError: If a record starts before the last record in the archive
+        """
+        if len(records) == 0:
+            return
+
+        records = numpy.sort(numpy.asarray(records, dtype=RECORD), order='start', kind='mergesort')
+
+        if len(self) > 0 and records['start'][0] < self.all_records['start'][-1]:
+            raise ValueError('Records must be appended in chronological order')
+
+        with open(self.data_path, 'ab') as fp:
+            # Discard any records written after the last complete update of the index
+            fp.truncate(len(self) * RECORD.itemsize)
+            fp.write(records.tobytes())
+
+        self.index['count'] += len(records)
+        self._update_max_duration(records)
+        self._save_index()
+
+    def replace_tail(self, first, records):
+        """Replaces the records from an index to the end of the archive
+
+        :param first: The index of the first record to replace. The archive's length appends the records.
+        :type first: int
+        :param records: The records to write from the index, in chronological order
+        :type records: numpy.ndarray
+        :raises ValueError: If the records aren't in chronological order, or start before the record preceding the index
+        """
+        records = numpy.asarray(records, dtype=RECORD)
+
+        if numpy.any(numpy.diff(records['start']) < 0) or (
+            0 < first and len(records) > 0 and records['start'][0] < self.all_records['start'][first - 1]
+        ):
+            raise ValueError('Records must be written in chronological order')
+
+        temporary_path = self.journal_path + '.tmp'
+
+        with open(temporary_path, 'wb') as fp:
+            fp.write(numpy.array([first], dtype='<i8').tobytes())
+            fp.write(records.tobytes())
+
+        os.rename(temporary_path, self.journal_path)
+        self._apply_journal()
+
+    def _apply_journal(self):
+        """Writes the records of the journal to the archive, then removes the journal
+
+        The journal holds the index of the first record to replace, followed by the records.
+        """
+        with open(self.journal_path, 'rb') as fp:
+            data = fp.read()
+
+        first = int(numpy.frombuffer(data[:8], dtype='<i8')[0])
+        records = numpy.frombuffer(data[8:], dtype=RECORD)
+        self._records = None
+
+        with open(self.data_path, 'ab') as fp:
+            fp.truncate(first * RECORD.itemsize)
+            fp.write(records.tobytes())
+
+        self.index['count'] = first + len(records)
+        self._update_max_duration(records)
+        self._save_index()
+
+        os.remove(self.journal_path)
+
+    def _update_max_duration(self, records):
+        if len(records) > 0:
+            self.index['max_duration'] = max(
+                self.index['max_duration'], int((records['end'] - records['start']).max())
+            )
+
+    def _save_index(self):
+        temporary_path = self.index_path + '.tmp'
+
+        with open(temporary_path, 'w') as fp:
+            json.dump(self.index, fp)
+
+        os.rename(temporary_path, self.index_path)
+
+    def history_records(self, normalized_history):
+        """Encodes normalized history events as records
+
+        :param normalized_history: History data, normalized by openapscontrib.mmhistorytools
+        :type normalized_history: list(dict)
+        :rtype: numpy.ndarray
+        """
+        records = numpy.zeros(len(normalized_history), dtype=RECORD)
+
+        for i, history_event in enumerate(normalized_history):
+            records[i] = (
+                epoch_microseconds(history_event['start_at']),
+                epoch_microseconds(history_event['end_at']),
+                history_event['amount'],
+                self.code('units', history_event['unit']),
+                self.code('types', history_event['type'])
+            )
+
+        return records
+
+    def glucose_records(self, recent_glucose, event_type=GLUCOSE_TYPE):
+        """Encodes glucose entries as records
+
+        :param recent_glucose: Glucose entries in any of the shapes read by `GlucoseSeries`
+        :type recent_glucose: list(dict)
+        :param event_type: The type name of the entries, such as "Glucose" or "Calibration"
+        :type event_type: basestring
+        :rtype: numpy.ndarray
+        """
+        series = GlucoseSeries(recent_glucose)
+        records = numpy.zeros(len(series), dtype=RECORD)
+        records['start'] = [epoch_microseconds(date) for date in series.dates]
+        records['end'] = records['start']
+        records['amount'] = series.values
+        records['unit'] = self.code('units', Unit.milligrams_per_deciliter)
+        records['type'] = self.code('types', event_type)
+
+        return records
+
+    def history(self, start=None, end=None):
+        """Returns the history events which overlap a time range, in the shape the calculators read
+
+        :param start: The start of the range, inclusive
+        :type start: datetime.datetime
+        :param end: The end of the range, inclusive
+        :type end: datetime.datetime
+        :return: History data in reverse-chronological order
+        :rtype: list(dict)
+        """
+        records = self.overlapping(start, end)[::-1]
+        units = self.index['units']
+        types = self.index['types']
+
+        return [{
+            'type': types[type_code],
+            'start_at': start_at,
+            'end_at': end_at,
+            'amount': amount,
+            'unit': units[unit]
+        } for start_at, end_at, amount, unit, type_code in zip(
+            isoformat(records['start']),
+            isoformat(records['end']),
+            records['amount'].tolist(),
+            records['unit'].tolist(),
+            records['type'].tolist()
+        )]
+
+    def glucose(self, start=None, end=None, event_type=GLUCOSE_TYPE):
+        """Returns the glucose entries of a type within a time range, in the shape the calculators read
+
+        :param start: The start of the range, inclusive
+        :type start: datetime.datetime
+        :param end: The end of the range, inclusive
+        :type end: datetime.datetime
+        :param event_type: The type name of the entries
+        :type event_type: basestring
+        :return: Glucose entries in reverse-chronological order
+        :rtype: list(dict)
+        """
+        if event_type not in self.index['types']:
+            return []
+
+        records = self.records(start, end)[::-1]
+        records = records[records['type'] == self.index['types'].index(event_type)]
+
+        return [{
+            'date': date,
+            'amount': amount,
+            'unit': Unit.milligrams_per_deciliter
+        } for date, amount in zip(isoformat(records['start']), records['amount'].tolist())]
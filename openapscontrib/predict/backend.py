@@ -0,0 +1,180 @@
+"""
+backend - optional native loops for the curve and integration hot paths
+
+When numba is installed, the kernels in this module are compiled, and the curve functions and the per-event loops of
+`calculate_insulin_effect` and `calculate_iob` evaluate each dose over all of its timestamps in one native call.
+Otherwise the kernels are never called, and the calculators use their NumPy and pure Python implementations.
+
+The kernels are plain Python and reproduce the operations of the Python implementations in the same order, so the
+native backend matches them to within the rounding of the compiled power function. Set the OPENAPS_PREDICT_BACKEND
+environment variable to "numpy" to disable the native backend.
+"""
+import os
+
+import numpy
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+BACKEND_ENVIRONMENT_VARIABLE = 'OPENAPS_PREDICT_BACKEND'
+
+NUMBA = 'numba'
+NUMPY = 'numpy'
+
+
+def available():
+    """Returns the names of the backends which can be used in this install
+
+    :return: The backend names
+    :rtype: list(str)
+    """
+    return [NUMPY] + ([NUMBA] if njit is not None else [])
+
+
+def use(backend):
+    """Selects the backend used by the calculators
+
+    :param backend: The backend name, "numba" or "numpy"
+    :type backend: str
+    :raises ValueError: If the backend isn't available
+    """
+    global name
+
+    if backend not in available():
+        raise ValueError('Backend "{}" is not available. Choose from {}'.format(backend, ', '.join(available())))
+
+    name = backend
+
+
+def native():
+    """Returns whether the native backend is in use
+
+    :rtype: bool
+    """
+    return name == NUMBA
+
+
+def walsh_iob_curve(t, insulin_action_duration, coefficients):
+    if t >= insulin_action_duration:
+        return 0.0
+    elif t <= 0:
+        return 1.0
+    else:
+        return (coefficients[0] * (t ** 4.0) + coefficients[1] * (t ** 3.0) + coefficients[2] * (t ** 2.0) +
+                coefficients[3] * t + coefficients[4])
+
+
+def walsh_iob_curves(t, insulin_action_duration, coefficients):
+    iob = numpy.empty(t.shape[0])
+
+    for i in range(t.shape[0]):
+        iob[i] = walsh_iob_curve(t[i], insulin_action_duration, coefficients)
+
+    return iob
+
+
+def carb_effect_curves(t, absorption_time):
+    effect = numpy.empty(t.shape[0])
+
+    for i in range(t.shape[0]):
+        if t[i] <= 0:
+            effect[i] = 0.0
+        elif t[i] <= absorption_time / 2.0:
+            effect[i] = 2.0 / (absorption_time ** 2.0) * (t[i] ** 2.0)
+        elif t[i] < absorption_time:
+            effect[i] = -1.0 + 4.0 / absorption_time * (t[i] - t[i] ** 2.0 / (2.0 * absorption_time))
+        else:
+            effect[i] = 1.0
+
+    return effect
+
+
+def bolus_effects(t, amount, insulin_sensitivity, insulin_action_duration, coefficients):
+    """The native form of `cumulative_bolus_effect_at_time` over an array of times"""
+    effect = numpy.empty(t.shape[0])
+
+    for i in range(t.shape[0]):
+        if t[i] < 0:
+            effect[i] = 0.0
+        else:
+            effect[i] = -amount * insulin_sensitivity * (
+                1 - walsh_iob_curve(t[i], insulin_action_duration, coefficients)
+            )
+
+    return effect
+
+
+def temp_basal_effects(t, rate, t1, insulin_sensitivities, insulin_action_duration, coefficients, segments):
+    """The native form of `cumulative_temp_basal_effect_at_time` over an array of times, integrating with the
+    default FixedSimpson series"""
+    effect = numpy.empty(t.shape[0])
+    dx = t1 / segments
+
+    for i in range(t.shape[0]):
+        if t[i] < 0:
+            effect[i] = 0.0
+            continue
+
+        int_iob = 0.0
+
+        if t[i] <= t1 + insulin_action_duration:
+            integral = (walsh_iob_curve(t[i], insulin_action_duration, coefficients) +
+                        walsh_iob_curve(t[i] - t1, insulin_action_duration, coefficients))
+
+            for j in range(1, segments - 1, 2):
+                integral += (4 * walsh_iob_curve(t[i] - j * dx, insulin_action_duration, coefficients) +
+                             2 * walsh_iob_curve(t[i] - (j + 1) * dx, insulin_action_duration, coefficients))
+
+            int_iob = integral * dx / 3.0 / 1.0
+
+        effect[i] = rate / 60.0 * -insulin_sensitivities[i] * (t1 - int_iob)
+
+    return effect
+
+
+def bolus_iob(t, amount, insulin_action_duration, coefficients, visual_iob_only):
+    """The IOB of a bolus over an array of times, as in `calculate_iob`"""
+    iob = numpy.empty(t.shape[0])
+
+    for i in range(t.shape[0]):
+        if visual_iob_only or t[i] >= 0:
+            iob[i] = amount * walsh_iob_curve(t[i], insulin_action_duration, coefficients)
+        else:
+            iob[i] = 0.0
+
+    return iob
+
+
+def temp_basal_iob(t, amount, t1, insulin_action_duration, coefficients, dt, absorption_delay):
+    """The native form of `sum_iob` over an array of times, integrating with the default RiemannSum series"""
+    iob = numpy.empty(t.shape[0])
+
+    for i in range(t.shape[0]):
+        delivered_end = min(t1, numpy.floor((t[i] + absorption_delay) / dt) * dt + dt)
+        integral = 0.0
+
+        for j in range(int(max(0.0, numpy.ceil(delivered_end / dt)))):
+            s = j * float(dt)
+            integral += max(0.0, min(s + dt, delivered_end) - s) / t1 * walsh_iob_curve(
+                t[i] - s, insulin_action_duration, coefficients
+            )
+
+        iob[i] = amount * integral
+
+    return iob
+
+
+if njit is not None:
+    walsh_iob_curve = njit(cache=True)(walsh_iob_curve)
+    walsh_iob_curves = njit(cache=True)(walsh_iob_curves)
+    carb_effect_curves = njit(cache=True)(carb_effect_curves)
+    bolus_effects = njit(cache=True)(bolus_effects)
+    temp_basal_effects = njit(cache=True)(temp_basal_effects)
+    bolus_iob = njit(cache=True)(bolus_iob)
+    temp_basal_iob = njit(cache=True)(temp_basal_iob)
+
+
+name = NUMBA if njit is not None and os.environ.get(BACKEND_ENVIRONMENT_VARIABLE) != NUMPY else NUMPY
@@ -0,0 +1,347 @@
+"""
+backtest - replays archived loop snapshots and scores their predictions against recorded glucose
+
+A snapshot is a dictionary of the input files of one loop, keyed like the arguments of the `glucose` command:
+`history`, `glucose`, `insulin_sensitivities`, `carb_ratios`, and either `settings` or `insulin_action_curve`, with an
+optional `basal_dosing_end`. Snapshots are sharded across a process pool. Settings and schedules rarely change between
+loops, so each worker caches the parsed settings and Schedule objects by path and modification time. History and
+glucose differ in every snapshot, so they're parsed without caching, and a worker's memory doesn't grow with the
+archive.
+"""
+from collections import OrderedDict
+import datetime
+from dateutil.parser import parse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy
+
+from .predict import GlucoseSeries
+from .predict import Schedule
+from .predict import calculate_carb_effect
+from .predict import calculate_glucose_from_effects
+from .predict import calculate_insulin_effect
+
+
+try:
+    basestring
+except NameError:
+    # Python 3
+    basestring = str
+
+
+STAGES = ('parse', 'insulin_effect', 'carb_effect', 'glucose_from_effects')
+
+
+# The number of settings and schedule files each worker keeps parsed
+CACHE_SIZE = 16
+
+_json_files = OrderedDict()
+_schedules = OrderedDict()
+
+
+def read_json(path):
+    """Parses a JSON file
+
+    :param path: The path to the file
+    :type path: basestring
+    :return: The decoded JSON object
+    :rtype: dict|list
+    """
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def cached(cache, path, key, load):
+    """Returns a value from a bounded cache of parsed files, loading it if the file is new or has changed
+
+    Each file keeps a single entry, which is replaced when its modification time changes. The least recently used
+    entries are evicted beyond `CACHE_SIZE`.
+
+    :param cache: The cache
+    :type cache: OrderedDict
+    :param path: The path to the file
+    :type path: basestring
+    :param key: Further distinguishes the values parsed from one file
+    :type key: basestring|NoneType
+    :param load: Parses the value from the path
+    :type load: function
+    :return: The parsed value
+    """
+    cache_key = (os.path.abspath(path), key)
+    mtime = os.path.getmtime(path)
+    entry = cache.pop(cache_key, None)
+
+    if entry is None or entry[0] != mtime:
+        entry = (mtime, load(path))
+
+    cache[cache_key] = entry
+
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+    return entry[1]
+
+
+def load_json(path):
+    """Parses a settings file, reusing the result while the file is unchanged
+
+    :param path: The path to the file
+    :type path: basestring
+    :return: The decoded JSON object
+    :rtype: dict|list
+    """
+    return cached(_json_files, path, None, read_json)
+
+
+def load_schedule(path, key):
+    """Parses a schedule file, reusing the Schedule and its lookup cache while the file is unchanged
+
+    :param path: The path to the file
+    :type path: basestring
+    :param key: The key of the schedule entries in the file
+    :type key: basestring
+    :return: The schedule
+    :rtype: Schedule
+    """
+    return cached(_schedules, path, key, lambda p: Schedule(read_json(p)[key]))
+
+
+def load_manifest(path):
+    """Reads a JSON list of snapshots, resolving their file paths relative to the manifest
+
+    :param path: The path to the manifest
+    :type path: basestring
+    :return: The snapshots
+    :rtype: list(dict)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+
+    with open(path) as fp:
+        snapshots = json.load(fp)
+
+    return [{
+        key: os.path.join(directory, value) if isinstance(value, basestring) else value
+        for key, value in snapshot.items()
+    } for snapshot in snapshots]
+
+
+def naive_datetime(timestamp):
+    return parse(timestamp).replace(tzinfo=None)
+
+
+def glucose_series(recent_glucose):
+    """Returns the dates and values of glucose entries in chronological order, without duplicate dates
+
+    :param recent_glucose: Glucose entries in any order
+    :type recent_glucose: list(dict)
+    :return: The entry dates as epoch seconds, and their glucose values
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+    """
+    series = GlucoseSeries(recent_glucose)
+    values = {}
+
+    for date, value in zip(series.dates, series.values.tolist()):
+        values[(naive_datetime(date) - datetime.datetime(1970, 1, 1)).total_seconds()] = value
+
+    seconds = sorted(values)
+
+    return numpy.array(seconds), numpy.array([values[s] for s in seconds])
+
+
+def backtest_snapshot(snapshot, horizons=(30, 60, 120), dt=5, absorption_delay=10):
+    """Predicts glucose from a single snapshot at each horizon after its latest glucose entry
+
+    :param snapshot: The paths to the input files of the snapshot
+    :type snapshot: dict
+    :param horizons: The minutes after the latest glucose entry at which to evaluate the prediction
+    :type horizons: list(int)
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_delay: The delay to expect between input effects and sensor glucose readings
+    :type absorption_delay: int
+    :return: The date of the latest glucose entry, the predicted glucose at each horizon, and the seconds spent in
+             each stage
+    :rtype: dict
+    """
+    timings = {}
+
+    started_at = time.time()
+    normalized_history = read_json(snapshot['history'])
+    recent_glucose = read_json(snapshot['glucose'])
+    insulin_action_curve = float(
+        snapshot.get('insulin_action_curve') or load_json(snapshot['settings'])['insulin_action_curve']
+    )
+    insulin_sensitivity_schedule = load_schedule(snapshot['insulin_sensitivities'], 'sensitivities')
+    carb_ratio_schedule = load_schedule(snapshot['carb_ratios'], 'schedule')
+    basal_dosing_end = snapshot.get('basal_dosing_end')
+
+    if basal_dosing_end:
+        basal_dosing_end = parse(read_json(basal_dosing_end))
+
+    timings['parse'] = time.time() - started_at
+
+    started_at = time.time()
+    insulin_effect = calculate_insulin_effect(
+        normalized_history,
+        insulin_action_curve,
+        insulin_sensitivity_schedule,
+        dt=dt,
+        absorption_delay=absorption_delay,
+        basal_dosing_end=basal_dosing_end
+    )
+    timings['insulin_effect'] = time.time() - started_at
+
+    started_at = time.time()
+    carb_effect = calculate_carb_effect(
+        normalized_history,
+        carb_ratio_schedule,
+        insulin_sensitivity_schedule,
+        dt=dt,
+        absorption_delay=absorption_delay
+    )
+    timings['carb_effect'] = time.time() - started_at
+
+    started_at = time.time()
+    predicted_glucose = calculate_glucose_from_effects([insulin_effect, carb_effect], recent_glucose)
+    timings['glucose_from_effects'] = time.time() - started_at
+
+    if len(predicted_glucose) == 0:
+        return {'date': None, 'predicted': {}, 'timings': timings}
+
+    # Effects are constant once every dose and meal has finished, so the last prediction holds after the horizon
+    predicted_seconds, predicted_values = glucose_series(predicted_glucose)
+    last_glucose_datetime = naive_datetime(predicted_glucose[0]['date'])
+    horizon_seconds = predicted_seconds[0] + numpy.array(horizons, dtype=float) * 60
+
+    return {
+        'date': last_glucose_datetime.isoformat(),
+        'predicted': dict(zip(horizons, numpy.interp(horizon_seconds, predicted_seconds, predicted_values).tolist())),
+        'timings': timings
+    }
+
+
+def _backtest_snapshot(arguments):
+    """Unpacks the arguments of `backtest_snapshot` for Pool.map, and records errors instead of raising them"""
+    snapshot, kwargs = arguments
+
+    try:
+        return backtest_snapshot(snapshot, **kwargs)
+    except (EnvironmentError, KeyError, ValueError) as e:
+        return {'date': None, 'predicted': {}, 'timings': {}, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def error_statistics(errors):
+    """Summarizes prediction errors
+
+    :param errors: Predicted minus actual glucose values, in mg/dL
+    :type errors: numpy.ndarray
+    :return: The count, mean error, mean absolute error, root mean squared error, and 90th percentile absolute error
+    :rtype: dict
+    """
+    if len(errors) == 0:
+        return {'count': 0}
+
+    absolute_errors = numpy.abs(errors)
+
+    return {
+        'count': len(errors),
+        'mean_error': float(numpy.mean(errors)),
+        'mean_absolute_error': float(numpy.mean(absolute_errors)),
+        'rmse': float(numpy.sqrt(numpy.mean(errors ** 2))),
+        'p90_absolute_error': float(numpy.percentile(absolute_errors, 90))
+    }
+
+
+def backtest(
+    snapshots,
+    actual_glucose=None,
+    horizons=(30, 60, 120),
+    dt=5,
+    absorption_delay=10,
+    tolerance=5,
+    processes=None
+):
+    """Replays snapshots through the glucose prediction and compares each prediction with recorded glucose
+
+    :param snapshots: The paths to the input files of each snapshot
+    :type snapshots: list(dict)
+    :param actual_glucose: Recorded glucose entries in any order. Defaults to the glucose of every snapshot.
+    :type actual_glucose: list(dict)
+    :param horizons: The minutes after the latest glucose entry of each snapshot at which to compare predictions
+    :type horizons: list(int)
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_delay: The delay to expect between input effects and sensor glucose readings
+    :type absorption_delay: int
+    :param tolerance: The largest distance in minutes from a horizon to the recorded glucose compared with it
+    :type tolerance: float
+    :param processes: The size of the process pool. Defaults to the number of CPUs, and 1 runs in this process.
+    :type processes: int
+    :return: Error statistics for each horizon, and the total and mean seconds spent in each stage
+    :rtype: dict
+    """
+    started_at = time.time()
+    arguments = [(snapshot, dict(horizons=horizons, dt=dt, absorption_delay=absorption_delay))
+                 for snapshot in snapshots]
+
+    processes = processes or multiprocessing.cpu_count()
+
+    if processes == 1:
+        results = [_backtest_snapshot(argument) for argument in arguments]
+    else:
+        pool = multiprocessing.Pool(processes)
+
+        try:
+            # Contiguous shards keep consecutive snapshots, which share most of their files, on the same worker
+            results = pool.map(_backtest_snapshot, arguments, chunksize=max(1, len(arguments) // (4 * processes)))
+        finally:
+            pool.close()
+            pool.join()
+
+    if actual_glucose is None:
+        actual_glucose = [
+            entry for snapshot, result in zip(snapshots, results) if 'error' not in result
+            for entry in read_json(snapshot['glucose'])
+        ]
+
+    actual_seconds, actual_values = glucose_series(actual_glucose)
+    epoch = datetime.datetime(1970, 1, 1)
+    errors = {horizon: [] for horizon in horizons}
+
+    for result in results:
+        if result['date'] is None or len(actual_seconds) == 0:
+            continue
+
+        for horizon, predicted in result['predicted'].items():
+            target = (naive_datetime(result['date']) - epoch).total_seconds() + horizon * 60
+            index = numpy.searchsorted(actual_seconds, target)
+            nearest = min(
+                (max(index - 1, 0), min(index, len(actual_seconds) - 1)),
+                key=lambda i: abs(actual_seconds[i] - target)
+            )
+
+            if abs(actual_seconds[nearest] - target) <= tolerance * 60:
+                errors[horizon].append(predicted - actual_values[nearest])
+
+    stage_seconds = {
+        stage: [result['timings'][stage] for result in results if stage in result['timings']] for stage in STAGES
+    }
+
+    return {
+        'snapshots': len(results),
+        'errors': [{'snapshot': i, 'error': result['error']} for i, result in enumerate(results) if 'error' in result],
+        'horizons': {
+            str(horizon): error_statistics(numpy.array(errors[horizon])) for horizon in horizons
+        },
+        'stages': {
+            stage: {
+                'total_s': sum(seconds),
+                'mean_s': sum(seconds) / len(seconds) if seconds else 0.0,
+                'max_s': max(seconds or [0.0])
+            } for stage, seconds in stage_seconds.items()
+        },
+        'wall_s': time.time() - started_at
+    }
@@ -0,0 +1,177 @@
+"""
+carbs - carbohydrate absorption models
+
+A model describes the fraction of a meal which has been absorbed over the minutes after it is eaten, with a given total
+absorption time. Each model provides `absorbed(t)` over an array of times, and `kernel(dt, absorption_delay)`, its
+values at each grid offset for the convolution engine. Models are registered by name in `carb_models`, and the
+calculators create one per absorption time with `get_carb_model`, so a new curve is added by registering its class
+without changing the calculators.
+"""
+from collections import OrderedDict
+import math
+
+import numpy
+
+from . import backend
+
+
+def carb_effect_curve(t, absorption_time):
+    """Returns the fraction of total carbohydrate effect with a given absorption time on blood
+    glucose at the specified number of minutes after eating.
+
+    This is the integral of Carbs on Board (COB), defined by a Scheiner GI curve from Think Link a
+    Pancreas, fig 7-8. This is based on an algorithm that first appeared in GlucoDyn
+
+    See: https://github.com/kenstack/GlucoDyn
+
+    :param t: The time in minutes since the carbs were eaten
+    :type t: float
+    :param absorption_time: The total absorption time of the carbohydrates in minutes
+    :type absorption_time: int
+    :return: A percentage of the initial carb intake, from 0 to 1
+    :rtype: float
+    """
+
+    if t <= 0:
+        return 0.0
+    elif t <= absorption_time / 2.0:
+        return 2.0 / (absorption_time ** 2) * (t ** 2)
+    elif t < absorption_time:
+        return -1.0 + 4.0 / absorption_time * (t - t ** 2 / (2.0 * absorption_time))
+    else:
+        return 1.0
+
+
+def carb_effect_curves(t, absorption_time):
+    """Evaluates `carb_effect_curve` over an array of times
+
+    :param t: The times in minutes since the carbs were eaten
+    :type t: numpy.ndarray
+    :param absorption_time: The total absorption time of the carbohydrates in minutes
+    :type absorption_time: int
+    :return: Percentages of the initial carb intake, from 0 to 1
+    :rtype: numpy.ndarray
+    """
+    if backend.native():
+        t = numpy.asarray(t, dtype=float)
+
+        return backend.carb_effect_curves(t.ravel(), float(absorption_time)).reshape(t.shape)
+
+    return numpy.select(
+        [t <= 0, t <= absorption_time / 2.0, t < absorption_time],
+        [
+            0.0,
+            2.0 / (absorption_time ** 2) * (t ** 2),
+            -1.0 + 4.0 / absorption_time * (t - t ** 2 / (2.0 * absorption_time))
+        ],
+        default=1.0
+    )
+
+
+class CarbModel(object):
+    """The base of carb absorption models
+
+    Subclasses implement `absorbed(t)`, which returns the fraction of a meal absorbed at each of an array of times in
+    minutes since the carbs were eaten, from 0 to 1.
+    """
+    def __init__(self, absorption_time):
+        """
+
+        :param absorption_time: The total absorption time of the carbohydrates in minutes
+        :type absorption_time: float
+        :raises ValueError: If the absorption time isn't positive
+        """
+        if absorption_time <= 0:
+            raise ValueError('The absorption time must be positive: {}'.format(absorption_time))
+
+        self.absorption_time = absorption_time
+
+    def kernel(self, dt, absorption_delay):
+        """Returns the fraction of a meal which has been absorbed at each dt following the meal
+
+        The kernel ends at the first point where the meal is completely absorbed; every later value is 1.
+
+        :param dt: The time differential of the grid in minutes
+        :type dt: int
+        :param absorption_delay: The delay time before a meal begins absorption in minutes
+        :type absorption_delay: int
+        :return: The cumulative absorption at each grid offset
+        :rtype: numpy.ndarray
+        """
+        count = int(math.ceil(float(self.absorption_time + absorption_delay) / dt)) + 1
+
+        return self.absorbed(numpy.arange(count) * dt - absorption_delay)
+
+
+class ScheinerCarbModel(CarbModel):
+    """The Scheiner GI curve, with an absorption rate which rises linearly until half the absorption time, then falls"""
+    def absorbed(self, t):
+        return carb_effect_curves(numpy.asarray(t, dtype=float), self.absorption_time)
+
+    def kernel(self, dt, absorption_delay):
+        count = int(math.ceil(float(self.absorption_time + absorption_delay) / dt)) + 1
+
+        return numpy.array([carb_effect_curve(m * dt - absorption_delay, self.absorption_time) for m in range(count)])
+
+
+class LinearCarbModel(CarbModel):
+    """A constant absorption rate over the absorption time"""
+    def absorbed(self, t):
+        return numpy.clip(numpy.asarray(t, dtype=float) / self.absorption_time, 0.0, 1.0)
+
+
+class ParabolicCarbModel(CarbModel):
+    """An absorption rate which is highest when the meal is eaten, and falls linearly to 0 at the absorption time"""
+    def absorbed(self, t):
+        x = numpy.clip(numpy.asarray(t, dtype=float) / self.absorption_time, 0.0, 1.0)
+
+        return x * (2 - x)
+
+
+class BilinearCarbModel(CarbModel):
+    """An absorption rate which rises linearly over the first 15% of the absorption time, holds until half of it, and
+    falls linearly to 0 at the end, as in Loop's piecewise linear absorption"""
+    end_of_rise = 0.15
+    start_of_fall = 0.5
+
+    def absorbed(self, t):
+        x = numpy.clip(numpy.asarray(t, dtype=float) / self.absorption_time, 0.0, 1.0)
+        rise, fall = self.end_of_rise, self.start_of_fall
+
+        # The peak rate which makes the area under the rate curve 1
+        scale = 2.0 / (1 + fall - rise)
+
+        return numpy.select(
+            [x < rise, x < fall],
+            [
+                scale * x ** 2 / (2 * rise),
+                scale * (x - rise / 2)
+            ],
+            default=scale * (fall - rise / 2 + ((x - fall) - (x ** 2 - fall ** 2) / 2) / (1 - fall))
+        )
+
+
+# Carb model classes by name. Each is constructed with the absorption time in minutes.
+carb_models = OrderedDict([
+    ('scheiner', ScheinerCarbModel),
+    ('linear', LinearCarbModel),
+    ('parabolic', ParabolicCarbModel),
+    ('bilinear', BilinearCarbModel)
+])
+
+
+def get_carb_model(name, absorption_time):
+    """Creates a registered carb absorption model
+
+    :param name: The name of the model in `carb_models`
+    :type name: basestring
+    :param absorption_time: The total absorption time of the carbohydrates in minutes
+    :type absorption_time: float
+    :return: The model
+    :rtype: CarbModel
+    :raises ValueError: If the model isn't registered, or the absorption time isn't positive
+    """
+    if name not in carb_models:
+        raise ValueError('Carb model "{}" is not registered. Choose from {}'.format(name, ', '.join(carb_models)))
+
+    return carb_models[name](absorption_time)
@@ -0,0 +1,259 @@
+"""
+ensemble - Monte Carlo prediction bands for uncertain therapy settings
+
+Each member of the ensemble scales the insulin sensitivity, carb ratio, carb absorption time and duration of insulin
+action by a random factor. Doses and meals are rasterized onto the simulation grid once, and every member shares that
+delivery vector. A member only changes the kernel it is convolved with, so the kernels for a chunk of members are built
+as one matrix and convolved together in the frequency domain. Chunking bounds the size of the intermediate arrays, and
+only the predicted glucose of each member is kept for the percentiles.
+"""
+from dateutil.parser import parse
+import numpy
+
+from .convolution import carb_deliveries
+from .convolution import carb_effect_duration
+from .convolution import carb_effect_kernels
+from .convolution import convolve_cumulative_rows
+from .convolution import insulin_delivery
+from .convolution import insulin_effect_kernels
+from .convolution import simulation_grid
+from .instrumentation import span
+from .instrumentation import timed
+from .models import Unit
+from .predict import glucose_data_tuple
+
+
+def sample_scales(random_state, members, error):
+    """Draws log-normally distributed scale factors, centered on 1
+
+    :param random_state: The random number generator
+    :type random_state: numpy.random.RandomState
+    :param members: The number of factors to draw
+    :type members: int
+    :param error: The standard deviation of the logarithm of the factors
+    :type error: float
+    :return: The scale factors
+    :rtype: numpy.ndarray
+    """
+    return numpy.exp(random_state.normal(0.0, 1.0, members) * error)
+
+
+def ensemble_effects(deliveries, insulin, isf_scales, carb_ratio_scales, absorption_scales, insulin_action_scales,
+                     insulin_action_duration, dt, absorption_delay, insulin_model='walsh', carb_model='scheiner',
+                     dtype=numpy.float64):
+    """Calculates the combined insulin and carb effect of each member of a chunk of the ensemble
+
+    :param deliveries: A dictionary of absorption times to the mg/dL-weighted amount eaten at each grid point
+    :type deliveries: dict
+    :param insulin: The sensitivity-weighted insulin, in mg/dL, delivered at each grid point
+    :type insulin: numpy.ndarray
+    :param isf_scales: The insulin sensitivity factor of each member
+    :type isf_scales: numpy.ndarray
+    :param carb_ratio_scales: The carb ratio factor of each member
+    :type carb_ratio_scales: numpy.ndarray
+    :param absorption_scales: The carb absorption time factor of each member
+    :type absorption_scales: numpy.ndarray
+    :param insulin_action_scales: The duration of insulin action factor of each member
+    :type insulin_action_scales: numpy.ndarray
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: int
+    :param dt: The time differential of the grid in minutes
+    :type dt: int
+    :param absorption_delay: The delay time before a dose or meal begins absorption in minutes
+    :type absorption_delay: int
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
+    :param dtype: The dtype in which to convolve and combine the effects
+    :type dtype: numpy.dtype
+    :return: The relative effect on blood glucose at each grid point, with a row for each member
+    :rtype: numpy.ndarray
+    """
+    insulin_effect = convolve_cumulative_rows(
+        insulin.astype(dtype, copy=False),
+        insulin_effect_kernels(
+            insulin_action_duration, dt, absorption_delay, insulin_action_scales, insulin_model=insulin_model,
+            dtype=dtype
+        )
+    )
+
+    carb_effect = numpy.zeros_like(insulin_effect)
+
+    for absorption_duration, delivery in sorted(deliveries.items()):
+        carb_effect += convolve_cumulative_rows(
+            delivery.astype(dtype, copy=False),
+            carb_effect_kernels(
+                absorption_duration, dt, absorption_delay, absorption_scales, carb_model=carb_model, dtype=dtype
+            )
+        )
+
+    isf_scales = isf_scales.astype(dtype, copy=False)
+    carb_ratio_scales = carb_ratio_scales.astype(dtype, copy=False)
+
+    return isf_scales[:, numpy.newaxis] * (carb_effect / carb_ratio_scales[:, numpy.newaxis] - insulin_effect)
+
+
+@timed()
+def predict_glucose_bands(
+    normalized_history,
+    recent_glucose,
+    insulin_action_curve,
+    insulin_sensitivity_schedule,
+    carb_ratio_schedule,
+    percentiles=(10, 50, 90),
+    members=1000,
+    isf_error=0.1,
+    carb_ratio_error=0.1,
+    absorption_error=0.2,
+    insulin_action_error=0.1,
+    dt=5,
+    absorption_duration=180,
+    absorption_delay=10,
+    basal_dosing_end=None,
+    chunk_size=256,
+    seed=None,
+    dtype=numpy.float64,
+    insulin_model='walsh',
+    carb_model='scheiner'
+):
+    """Calculates percentile bands of predicted glucose over an ensemble of perturbed therapy settings
+
+    Each error is the standard deviation of the logarithm of a member's scale factor for that setting, so 0.1 is
+    roughly a 10% error. Absorption time and duration of insulin action are perturbed by stretching their curves in time.
+    Effects are calculated on the convolution grid, so with every error set to 0 the bands match a prediction from
+    `convolve_insulin_effect` and `convolve_carb_effect`.
+
+    :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param recent_glucose: Historical glucose in reverse-chronological order, cleaned by openapscontrib.glucosetools
+    :type recent_glucose: list(dict)
+    :param insulin_action_curve: Duration of insulin action for the patient in hours
+    :type insulin_action_curve: float
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
+    :type carb_ratio_schedule: Schedule
+    :param percentiles: The percentiles of predicted glucose to return, from 0 to 100
+    :type percentiles: list(float)
+    :param members: The number of members in the ensemble
+    :type members: int
+    :param isf_error: The log-normal error of insulin sensitivity
+    :type isf_error: float
+    :param carb_ratio_error: The log-normal error of carb ratio
+    :type carb_ratio_error: float
+    :param absorption_error: The log-normal error of carb absorption time
+    :type absorption_error: float
+    :param insulin_action_error: The log-normal error of the duration of insulin action
+    :type insulin_action_error: float
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_duration: The total absorption time of the carbohydrates in minutes, for entries which
+                                don't specify their own `absorption_time`
+    :type absorption_duration: int
+    :param absorption_delay: The delay to expect between input effects and sensor glucose readings
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+    :type basal_dosing_end: datetime.datetime
+    :param chunk_size: The number of members to evaluate together
+    :type chunk_size: int
+    :param seed: The seed of the random number generator, for repeatable bands
+    :type seed: int
+    :param dtype: The dtype of the ensemble. numpy.float32 halves the memory of the convolutions and predictions, and
+                  moves the bands of the test fixtures by less than 5e-4 mg/dL.
+    :type dtype: numpy.dtype
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
+    :return: A dictionary of formatted percentiles to lists of predicted glucose values
+    :rtype: dict
+    """
+    keys = ['{:g}'.format(p) for p in percentiles]
+
+    if len(recent_glucose) == 0:
+        return {key: [] for key in keys}
+
+    last_glucose_date, last_glucose_value = glucose_data_tuple(recent_glucose[0])
+    first_prediction = {
+        'date': last_glucose_date,
+        'amount': float(last_glucose_value),
+        'unit': Unit.milligrams_per_deciliter
+    }
+
+    if len(normalized_history) == 0:
+        return {key: [dict(first_prediction)] for key in keys}
+
+    with span('sample'):
+        random_state = numpy.random.RandomState(seed)
+        isf_scales = sample_scales(random_state, members, isf_error)
+        carb_ratio_scales = sample_scales(random_state, members, carb_ratio_error)
+        absorption_scales = sample_scales(random_state, members, absorption_error)
+        insulin_action_scales = sample_scales(random_state, members, insulin_action_error)
+
+    insulin_action_duration = insulin_action_curve * 60
+
+    simulation_timestamps, _ = simulation_grid(
+        normalized_history,
+        dt,
+        max(
+            insulin_action_duration * insulin_action_scales.max() + absorption_delay,
+            (carb_effect_duration(normalized_history, absorption_duration, 0) * absorption_scales.max() +
+             absorption_delay)
+        )
+    )
+
+    # Predictions continue from the last glucose entry, as in `calculate_glucose_from_effects`
+    last_glucose_datetime = parse(last_glucose_date).replace(tzinfo=None)
+    first_index = len([timestamp for timestamp in simulation_timestamps if timestamp <= last_glucose_datetime])
+    prediction_timestamps = simulation_timestamps[first_index:]
+
+    with span('rasterize'):
+        insulin = insulin_delivery(
+            normalized_history, simulation_timestamps, insulin_sensitivity_schedule, dt, basal_dosing_end
+        )
+
+        deliveries, _ = carb_deliveries(
+            normalized_history,
+            simulation_timestamps,
+            dt,
+            absorption_duration,
+            carb_ratio_schedule=carb_ratio_schedule,
+            insulin_sensitivity_schedule=insulin_sensitivity_schedule
+        )
+
+    predicted_glucose = numpy.empty((members, len(prediction_timestamps)), dtype=dtype)
+
+    with span('convolve'):
+        for start in range(0, members, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            effect = ensemble_effects(
+                deliveries,
+                insulin,
+                isf_scales[chunk],
+                carb_ratio_scales[chunk],
+                absorption_scales[chunk],
+                insulin_action_scales[chunk],
+                insulin_action_duration,
+                dt,
+                absorption_delay,
+                insulin_model=insulin_model,
+                carb_model=carb_model,
+                dtype=dtype
+            )
+
+            reference = effect[:, first_index - 1:first_index] if first_index > 0 else 0.0
+            predicted_glucose[chunk] = last_glucose_value + effect[:, first_index:] - reference
+
+    with span('percentile'):
+        bands = numpy.percentile(predicted_glucose, percentiles, axis=0).tolist()
+
+    with span('serialize'):
+        return {
+            key: [dict(first_prediction)] + [{
+                'date': timestamp.isoformat(),
+                'amount': amount,
+                'unit': Unit.milligrams_per_deciliter
+            } for timestamp, amount in zip(prediction_timestamps, band)]
+            for key, band in zip(keys, bands)
+        }
@@ -0,0 +1,219 @@
+"""
+importer - incrementally ingests openaps report files into binary archives
+
+Reports are rewritten as whole JSON lists on every loop, so a file whose modification time and size are unchanged since
+the last ingest is skipped without being read. Each changed file is classified by the shape of its entries.
+
+Records are identified by their start, unit and type. Pump history reads overlap heavily between loops, and a record
+at the end of one read may be revised by the next, such as a temp basal whose planned end is shortened when it's
+replaced. Records from files modified later take precedence, and replace the archived version of a record. Records which
+start up to `LOOK_BACK` before the end of the archive, such as backfilled sensor glucose, are merged into the end of the
+archive in order, and older records are dropped. An ingest costs time in proportion to the changed reports and the
+look-back window, and not to the size of the archive.
+"""
+import datetime
+import json
+import os
+
+import numpy
+
+from .archive import Archive
+from .archive import RECORD
+from .predict import microseconds
+
+
+HISTORY = 'history'
+GLUCOSE = 'glucose'
+CALIBRATIONS = 'calibrations'
+
+KINDS = (HISTORY, GLUCOSE, CALIBRATIONS)
+
+STATE_FILENAME = 'imports.json'
+
+# How long before the end of an archive records are still accepted
+LOOK_BACK = datetime.timedelta(hours=24)
+
+
+def report_kind(entries):
+    """Classifies the decoded contents of a report file by the shape of its first entry
+
+    :param entries: The decoded JSON report
+    :type entries: list(dict)|dict
+    :return: The archive kind the entries belong to, or None if they don't belong in an archive
+    :rtype: str|NoneType
+    """
+    if not isinstance(entries, list) or len(entries) == 0 or not isinstance(entries[0], dict):
+        return None
+
+    entry = entries[0]
+
+    if 'start_at' in entry and 'end_at' in entry and 'type' in entry:
+        return HISTORY
+    elif 'meter_glucose' in entry:
+        return CALIBRATIONS
+    elif 'sgv' in entry or 'glucose' in entry or ('date' in entry and 'amount' in entry and 'unit' not in entry):
+        return GLUCOSE
+
+
+def merged_tail(archive, records, look_back=LOOK_BACK):
+    """Merges new records into the end of an archive
+
+    :param archive: The archive
+    :type archive: Archive
+    :param records: The new records, in the order their files were modified. Later records replace earlier ones which
+                    share a start, unit and type.
+    :type records: numpy.ndarray
+    :param look_back: How long before the end of the archive records are still accepted
+    :type look_back: datetime.timedelta
+    :return: The index of the first archived record to replace, the records to write from that index, and the number
+             of records added and changed
+    :rtype: tuple(int, numpy.ndarray, int, int)
+    """
+    records = numpy.asarray(records, dtype=RECORD)
+    # Sorting with `order` breaks ties by the other fields, so the start column is sorted alone to keep the input order
+    records = records[numpy.argsort(records['start'], kind='mergesort')]
+    archived = archive.all_records
+
+    if len(archived) > 0:
+        records = records[records['start'] >= archived['start'][-1] - microseconds(look_back)]
+
+    if len(records) == 0:
+        return len(archived), records, 0, 0
+
+    first = numpy.searchsorted(archived['start'], records['start'][0], side='left')
+    tail = archived[first:].tolist()
+    merged = {}
+
+    # Archived records come first, so that new versions replace them
+    for record in tail + records.tolist():
+        merged[(record[0], record[3], record[4])] = record
+
+    changed = sum(1 for record in tail if merged[(record[0], record[3], record[4])] != record)
+    merged = numpy.sort(numpy.array(list(merged.values()), dtype=RECORD), order=['start', 'type', 'unit'])
+
+    return first, merged, len(merged) - len(tail), changed
+
+
+class Importer(object):
+    """Ingests report files into a directory of archives, one for each kind of report"""
+    def __init__(self, archive_directory):
+        """
+
+        :param archive_directory: The directory of the archives and the ingest state
+        :type archive_directory: basestring
+        """
+        if not os.path.isdir(archive_directory):
+            os.makedirs(archive_directory)
+
+        self.directory = archive_directory
+        self.state_path = os.path.join(archive_directory, STATE_FILENAME)
+        self.archives = {kind: Archive(os.path.join(archive_directory, kind)) for kind in KINDS}
+
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as fp:
+                self.state = json.load(fp)
+        else:
+            self.state = {'files': {}}
+
+    def changed_files(self, report_directory):
+        """Returns the JSON files of a report directory which changed since they were last ingested
+
+        :param report_directory: The openaps report directory
+        :type report_directory: basestring
+        :return: The absolute paths of the files, with their modification time and size
+        :rtype: list(tuple(str, float, int))
+        """
+        changed = []
+        archive_directory = os.path.abspath(self.directory)
+
+        for dirpath, dirnames, filenames in os.walk(report_directory):
+            # The archive may be kept within the report directory
+            dirnames[:] = sorted(
+                d for d in dirnames
+                if not d.startswith('.') and os.path.abspath(os.path.join(dirpath, d)) != archive_directory
+            )
+
+            for filename in sorted(filenames):
+                if not filename.endswith('.json'):
+                    continue
+
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                stat = os.stat(path)
+                previous = self.state['files'].get(path)
+
+                if previous is None or previous['mtime'] != stat.st_mtime or previous['size'] != stat.st_size:
+                    changed.append((path, stat.st_mtime, stat.st_size))
+
+        return changed
+
+    def encode(self, kind, entries):
+        """Encodes report entries as records of an archive
+
+        :param kind: The archive kind
+        :type kind: str
+        :param entries: The report entries
+        :type entries: list(dict)
+        :rtype: numpy.ndarray
+        """
+        archive = self.archives[kind]
+
+        if kind == HISTORY:
+            return archive.history_records(entries)
+        elif kind == CALIBRATIONS:
+            return archive.glucose_records(entries, 'Calibration')
+        else:
+            return archive.glucose_records(entries)
+
+    def ingest(self, report_directory):
+        """Appends the new records of every changed report file to the archives
+
+        :param report_directory: The openaps report directory
+        :type report_directory: basestring
+        :return: The number of records added to and changed in each archive, and the files read
+        :rtype: dict
+        """
+        batches = {kind: [] for kind in KINDS}
+        files = {}
+
+        # Files are read in the order they were modified, so the latest version of a record is merged last
+        for path, mtime, size in sorted(self.changed_files(report_directory), key=lambda f: f[1]):
+            try:
+                with open(path) as fp:
+                    entries = json.load(fp)
+            except ValueError:
+                # Reports which are being rewritten are read on the next ingest
+                continue
+
+            kind = report_kind(entries)
+
+            if kind is not None:
+                batches[kind].append(self.encode(kind, entries))
+
+            files[path] = {'mtime': mtime, 'size': size, 'kind': kind}
+
+        appended = {}
+        updated = {}
+
+        for kind in KINDS:
+            archive = self.archives[kind]
+            first, records, appended[kind], updated[kind] = merged_tail(
+                archive, numpy.concatenate(batches[kind]) if batches[kind] else numpy.zeros(0, dtype=RECORD)
+            )
+
+            if appended[kind] > 0 or updated[kind] > 0:
+                archive.replace_tail(first, records)
+
+        # The state is saved last, so an interrupted ingest reads its files again
+        self.state['files'].update(files)
+        temporary_path = self.state_path + '.tmp'
+
+        with open(temporary_path, 'w') as fp:
+            json.dump(self.state, fp)
+
+        os.rename(temporary_path, self.state_path)
+
+        return {
+            'appended': appended,
+            'updated': updated,
+            'files': {path: state['kind'] for path, state in files.items()}
+        }
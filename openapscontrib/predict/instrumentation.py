@@ -0,0 +1,200 @@
+"""
+instrumentation - opt-in timing spans and call counters for the prediction pipeline
+
+Instrumentation is disabled by default. It is enabled either programmatically via `enable()`, or for
+openaps commands by setting the OPENAPS_PREDICT_TIMING environment variable to a file path, or to "-" to
+write the report to stderr.
+"""
+from collections import defaultdict
+from functools import wraps
+import json
+import os
+import sys
+import time
+
+from . import backend
+
+
+TIMING_ENVIRONMENT_VARIABLE = 'OPENAPS_PREDICT_TIMING'
+
+
+class _NullSpan(object):
+    """A reusable context manager which does nothing, returned while instrumentation is disabled"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.recorder.stack.append(self.name)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.time() - self.start
+        path = '/'.join(self.recorder.stack)
+        self.recorder.stack.pop()
+
+        stats = self.recorder.spans[path]
+        stats['count'] += 1
+        stats['total_s'] += elapsed
+        stats['max_s'] = max(stats['max_s'], elapsed)
+
+        return False
+
+
+class Recorder(object):
+    """Collects span timings and call counts for a single run
+
+    Hot paths should guard their calls with the `enabled` attribute, so the disabled cost is a single
+    attribute lookup:
+
+        if recorder.enabled:
+            recorder.count('walsh_iob_curve')
+    """
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.reset()
+
+    def reset(self):
+        self.spans = defaultdict(lambda: {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+        self.counters = defaultdict(int)
+        self.stack = []
+        self.started_at = time.time()
+
+    def span(self, name):
+        """Returns a context manager which times the enclosed block under the given name
+
+        Spans nest, and are reported by their slash-separated path, e.g. "walsh_iob/main/calculate_iob".
+
+        :param name: The name of the stage
+        :type name: basestring
+        :return: A context manager
+        """
+        if not self.enabled:
+            return _null_span
+
+        return _Span(self, name)
+
+    def count(self, name, increment=1):
+        self.counters[name] += increment
+
+    def report(self):
+        """Returns the collected timings as a JSON-serializable dictionary
+
+        :return: The per-run timing report
+        :rtype: dict
+        """
+        return {
+            'backend': backend.name,
+            'wall_s': time.time() - self.started_at,
+            'spans': [dict(name=name, **stats) for name, stats in sorted(self.spans.items())],
+            'counters': dict(self.counters)
+        }
+
+    def write_report(self):
+        """Writes the report as a single line of JSON to the configured output and resets the collected data"""
+        if self.output is None:
+            return
+
+        line = json.dumps(self.report(), sort_keys=True) + '\n'
+
+        if self.output == '-':
+            sys.stderr.write(line)
+        else:
+            with open(self.output, 'a') as fp:
+                fp.write(line)
+
+        self.reset()
+
+
+recorder = Recorder()
+
+
+def enable(output='-'):
+    """Enables instrumentation
+
+    :param output: A file path to which reports are appended, "-" for stderr, or None to only collect in memory
+    :type output: basestring|NoneType
+    """
+    recorder.enabled = True
+    recorder.output = output
+    recorder.reset()
+
+
+def disable():
+    recorder.enabled = False
+    recorder.output = None
+    recorder.reset()
+
+
+def enable_from_environment():
+    """Enables instrumentation if OPENAPS_PREDICT_TIMING is set and instrumentation isn't already enabled"""
+    output = os.environ.get(TIMING_ENVIRONMENT_VARIABLE)
+
+    if output and not recorder.enabled:
+        enable(output)
+
+
+def span(name):
+    return recorder.span(name)
+
+
+def timed(name=None):
+    """Decorates a function so each call is recorded as a span
+
+    :param name: The span name. Defaults to the function name.
+    :type name: basestring
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return func(*args, **kwargs)
+
+            with _Span(recorder, span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class run(object):
+    """Times a top-level command and writes the report when it completes
+
+    Usage:
+        with run('walsh_iob'):
+            ...
+    """
+    def __init__(self, name):
+        self.name = name
+        self.span = None
+
+    def __enter__(self):
+        enable_from_environment()
+        self.span = recorder.span(self.name)
+        self.span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.span.__exit__(exc_type, exc_value, traceback)
+
+        if recorder.enabled and not recorder.stack:
+            recorder.write_report()
+
+        return False
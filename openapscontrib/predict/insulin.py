@@ -0,0 +1,306 @@
+"""
+insulin - insulin action models
+
+A model describes the fraction of a dose which remains on board over the minutes after it is delivered. Each model
+provides `iob(t)` over an array of times, and the closed form `integrated_iob(t0, t1, t)`, the integral of
+`iob(t - s)` for s over the delivery of a spread-out dose from t0 to t1. Models are registered by name in
+`insulin_models`, and the calculators create one per call with `get_insulin_model`, so a new curve is added by
+registering its class without changing the calculators.
+
+The Walsh model keeps the scalar, integrator and native paths the calculators have always used for it. Other models are
+evaluated over all the timestamps of a dose at once, and their spread-out doses are integrated exactly.
+"""
+from collections import OrderedDict
+import math
+
+import numpy
+
+from . import backend
+from .instrumentation import recorder
+
+
+# The coefficients of the Walsh IOB polynomials, highest power first, by duration of insulin action in minutes
+walsh_iob_coefficients = {
+    180: (-3.2030e-9, 1.354e-6, -1.759e-4, 9.255e-4, 0.99951),
+    240: (-3.310e-10, 2.530e-7, -5.510e-5, -9.086e-4, 0.99950),
+    300: (-2.950e-10, 2.320e-7, -5.550e-5, 4.490e-4, 0.99300),
+    360: (-1.493e-10, 1.413e-7, -4.095e-5, 6.365e-4, 0.99700)
+}
+
+
+_derived_walsh_iob_coefficients = {}
+
+
+def walsh_iob_curve_coefficients(insulin_action_duration):
+    """Returns the coefficients of the Walsh IOB polynomial for any duration of insulin action
+
+    The four fitted durations are returned as is. For any other duration, the fitted curves on either side are
+    stretched in time to end at that duration and blended linearly by distance, or the nearest fitted curve is
+    stretched alone outside 3 to 6 hours. Stretching and blending quartics gives a quartic, so each duration costs one
+    computation of five coefficients, cached for the life of the process.
+
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: float
+    :return: The polynomial coefficients, highest power first
+    :rtype: tuple(float)
+    :raises ValueError: If the duration isn't positive
+    """
+    coefficients = walsh_iob_coefficients.get(insulin_action_duration)
+
+    if coefficients is not None:
+        return coefficients
+
+    if insulin_action_duration not in _derived_walsh_iob_coefficients:
+        if insulin_action_duration <= 0:
+            raise ValueError('The duration of insulin action must be positive: {}'.format(insulin_action_duration))
+
+        durations = sorted(walsh_iob_coefficients)
+        lower = max([durations[0]] + [d for d in durations if d < insulin_action_duration])
+        upper = min([durations[-1]] + [d for d in durations if d > insulin_action_duration])
+        weight = 0.0 if upper == lower else float(insulin_action_duration - lower) / (upper - lower)
+
+        def stretched(duration):
+            scale = float(duration) / insulin_action_duration
+
+            return [c * scale ** (4 - k) for k, c in enumerate(walsh_iob_coefficients[duration])]
+
+        _derived_walsh_iob_coefficients[insulin_action_duration] = tuple(
+            (1 - weight) * a + weight * b for a, b in zip(stretched(lower), stretched(upper))
+        )
+
+    return _derived_walsh_iob_coefficients[insulin_action_duration]
+
+
+def walsh_iob_curve(t, insulin_action_duration):
+    """Returns the fraction of a single insulin dosage remaining at the specified number of minutes
+    after delivery; also known as Insulin On Board (IOB).
+
+    This is a Walsh IOB curve, and is based on an algorithm that first appeared in GlucoDyn. Durations other than
+    3, 4, 5 and 6 hours are derived from those curves by `walsh_iob_curve_coefficients`.
+
+    See: https://github.com/kenstack/GlucoDyn
+
+    :param t: time in minutes since the dose began
+    :type t: float
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: float
+    :return: The fraction of a insulin dosage remaining at the specified time
+    :rtype: float
+    """
+    if recorder.enabled:
+        recorder.count('walsh_iob_curve')
+
+    if t >= insulin_action_duration:
+        return 0.0
+    elif t <= 0:
+        return 1.0
+
+    c4, c3, c2, c1, c0 = walsh_iob_curve_coefficients(insulin_action_duration)
+
+    return c4 * (t**4) + c3 * (t**3) + c2 * (t**2) + c1 * t + c0
+
+
+def walsh_iob_curves(t, insulin_action_duration):
+    """Evaluates `walsh_iob_curve` over an array of times
+
+    :param t: The times in minutes since the dose began
+    :type t: numpy.ndarray
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: int
+    :return: The fractions of a insulin dosage remaining at the specified times
+    :rtype: numpy.ndarray
+    """
+    if backend.native():
+        t = numpy.asarray(t, dtype=float)
+
+        return backend.walsh_iob_curves(
+            t.ravel(), float(insulin_action_duration), walsh_iob_curve_coefficients(insulin_action_duration)
+        ).reshape(t.shape)
+
+    c4, c3, c2, c1, c0 = walsh_iob_curve_coefficients(insulin_action_duration)
+
+    return numpy.select(
+        [t >= insulin_action_duration, t <= 0],
+        [0.0, 1.0],
+        default=c4 * (t ** 4) + c3 * (t ** 3) + c2 * (t ** 2) + c1 * t + c0
+    )
+
+
+def walsh_iob_antiderivative(t, insulin_action_duration):
+    """Returns the integral of the Walsh IOB curve from 0 to t, for an array of times
+
+    The curve is 1 before the dose and 0 after the duration of insulin action, so the integral of `walsh_iob_curve`
+    over any interval [a, b] is the difference of this function at b and a.
+
+    :param t: The times in minutes since the dose began
+    :type t: numpy.ndarray
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: int
+    :return: The integrated fraction of the dose remaining, in minutes
+    :rtype: numpy.ndarray
+    """
+    c4, c3, c2, c1, c0 = walsh_iob_curve_coefficients(insulin_action_duration)
+    u = numpy.clip(t, 0, insulin_action_duration)
+    polynomial = (((((c4 / 5.0) * u + c3 / 4.0) * u + c2 / 3.0) * u + c1 / 2.0) * u + c0) * u
+
+    return numpy.where(t < 0, t, polynomial)
+
+
+class WalshInsulinModel(object):
+    """The Walsh IOB curve, a quartic polynomial fitted for durations of 3 to 6 hours"""
+    def __init__(self, insulin_action_duration):
+        """
+
+        :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+        :type insulin_action_duration: float
+        :raises ValueError: If the duration isn't positive
+        """
+        walsh_iob_curve_coefficients(insulin_action_duration)
+        self.insulin_action_duration = insulin_action_duration
+
+    def iob(self, t):
+        """Returns the fraction of a dose remaining at each time
+
+        :param t: The times in minutes since the dose began
+        :type t: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return walsh_iob_curves(numpy.asarray(t, dtype=float), self.insulin_action_duration)
+
+    def integrated_iob(self, t0, t1, t):
+        """Returns the integral of the fraction remaining over the delivery of a spread-out dose
+
+        :param t0: The start time in minutes of the dose
+        :type t0: float|numpy.ndarray
+        :param t1: The end time in minutes of the dose
+        :type t1: float|numpy.ndarray
+        :param t: The current times in minutes
+        :type t: numpy.ndarray
+        :return: The integrated fraction of the dose remaining, in minutes
+        :rtype: numpy.ndarray
+        """
+        t = numpy.asarray(t, dtype=float)
+
+        return (walsh_iob_antiderivative(t - t0, self.insulin_action_duration) -
+                walsh_iob_antiderivative(t - t1, self.insulin_action_duration))
+
+
+class ExponentialInsulinModel(object):
+    """An exponential IOB curve, shaped by the time of peak insulin activity
+
+    The activity curve rises to its peak and decays to exactly 0 at the duration of insulin action, as described at
+    https://github.com/LoopKit/Loop/issues/388#issuecomment-317938473
+    """
+    def __init__(self, insulin_action_duration, peak_activity_time):
+        """
+
+        :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+        :type insulin_action_duration: float
+        :param peak_activity_time: The time of peak insulin activity after a dose, in minutes
+        :type peak_activity_time: float
+        :raises ValueError: If the peak isn't within the first half of the duration
+        """
+        if not 0 < peak_activity_time < insulin_action_duration / 2.0:
+            raise ValueError('The peak activity time {} must be within the first half of the duration of insulin '
+                             'action {}'.format(peak_activity_time, insulin_action_duration))
+
+        duration = float(insulin_action_duration)
+        peak = float(peak_activity_time)
+
+        self.insulin_action_duration = insulin_action_duration
+        self.peak_activity_time = peak_activity_time
+
+        # The time constant of the decay, and the rise time and area factors which make IOB 0 at the duration
+        self.tau = peak * (1 - peak / duration) / (1 - 2 * peak / duration)
+        self.a = 2 * self.tau / duration
+        self.s = 1 / (1 - self.a + (1 + self.a) * math.exp(-duration / self.tau))
+
+    def iob(self, t):
+        """Returns the fraction of a dose remaining at each time
+
+        :param t: The times in minutes since the dose began
+        :type t: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        t = numpy.asarray(t, dtype=float)
+        duration, tau, a, s = self.insulin_action_duration, self.tau, self.a, self.s
+        u = numpy.clip(t, 0, duration)
+
+        iob = 1 - s * (1 - a) * ((u ** 2 / (tau * duration * (1 - a)) - u / tau - 1) * numpy.exp(-u / tau) + 1)
+
+        return numpy.select([t <= 0, t >= duration], [1.0, 0.0], default=iob)
+
+    def antiderivative(self, t):
+        """Returns the integral of the IOB curve from 0 to t, for an array of times
+
+        :param t: The times in minutes since the dose began
+        :type t: numpy.ndarray
+        :return: The integrated fraction of the dose remaining, in minutes
+        :rtype: numpy.ndarray
+        """
+        duration, tau, a, s = self.insulin_action_duration, self.tau, self.a, self.s
+        u = numpy.clip(t, 0, duration)
+
+        # The decaying part integrates as -tau * exp(-u / tau) * (p + tau * p' + tau ** 2 * p'') for its quadratic p
+        def q(x):
+            return (x ** 2 / (tau * duration) - (1 - a) * x / tau - (1 - a) +
+                    tau * (2 * x / (tau * duration) - (1 - a) / tau) + 2 * tau / duration)
+
+        integral = (1 - s * (1 - a)) * u + s * tau * (numpy.exp(-u / tau) * q(u) - q(0.0))
+
+        return numpy.where(t < 0, t, integral)
+
+    def integrated_iob(self, t0, t1, t):
+        """Returns the integral of the fraction remaining over the delivery of a spread-out dose
+
+        :param t0: The start time in minutes of the dose
+        :type t0: float|numpy.ndarray
+        :param t1: The end time in minutes of the dose
+        :type t1: float|numpy.ndarray
+        :param t: The current times in minutes
+        :type t: numpy.ndarray
+        :return: The integrated fraction of the dose remaining, in minutes
+        :rtype: numpy.ndarray
+        """
+        t = numpy.asarray(t, dtype=float)
+
+        return self.antiderivative(t - t0) - self.antiderivative(t - t1)
+
+
+class RapidActingInsulinModel(ExponentialInsulinModel):
+    """The exponential curve of rapid-acting insulin, such as Humalog and Novolog, peaking at 75 minutes"""
+    def __init__(self, insulin_action_duration):
+        super(RapidActingInsulinModel, self).__init__(insulin_action_duration, 75)
+
+
+class UltraRapidInsulinModel(ExponentialInsulinModel):
+    """The exponential curve of ultra-rapid insulin, such as Fiasp, peaking at 55 minutes"""
+    def __init__(self, insulin_action_duration):
+        super(UltraRapidInsulinModel, self).__init__(insulin_action_duration, 55)
+
+
+# Insulin model classes by name. Each is constructed with the duration of insulin action in minutes.
+insulin_models = OrderedDict([
+    ('walsh', WalshInsulinModel),
+    ('rapid_acting', RapidActingInsulinModel),
+    ('ultra_rapid', UltraRapidInsulinModel)
+])
+
+
+def get_insulin_model(name, insulin_action_duration):
+    """Creates a registered insulin model
+
+    :param name: The name of the model in `insulin_models`
+    :type name: basestring
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: float
+    :return: The model
+    :rtype: WalshInsulinModel|ExponentialInsulinModel
+    :raises ValueError: If the model isn't registered, or doesn't support the duration
+    """
+    if name not in insulin_models:
+        raise ValueError('Insulin model "{}" is not registered. Choose from {}'.format(
+            name, ', '.join(insulin_models)
+        ))
+
+    return insulin_models[name](insulin_action_duration)
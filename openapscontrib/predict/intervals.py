@@ -0,0 +1,78 @@
+"""
+intervals - a sorted index of time intervals for active-event queries
+
+Each history event affects glucose over a bounded window. Intervals are sorted by their start, and the length of the
+longest one bounds how far back a query has to look, so finding the intervals which contain a point is a binary search
+followed by a scan of only the intervals which started within that length of it.
+"""
+from bisect import bisect_left
+from bisect import bisect_right
+
+
+class IntervalIndex(object):
+    """An immutable index of closed intervals, each with an associated item
+
+    Intervals may be bounded by any ordered values which support subtraction, such as datetimes or floats. Queries return
+    items in the order their intervals were passed to the index.
+    """
+    def __init__(self, intervals):
+        """
+
+        :param intervals: The start, end and item of each interval
+        :type intervals: list(tuple)
+        """
+        ordered = sorted(enumerate(intervals), key=lambda pair: pair[1][0])
+
+        self.positions = [position for position, _ in ordered]
+        self.starts = [interval[0] for _, interval in ordered]
+        self.ends = [interval[1] for _, interval in ordered]
+        self.items = [interval[2] for _, interval in ordered]
+        self.max_length = max([end - start for start, end in zip(self.starts, self.ends)]) if ordered else None
+
+    def __len__(self):
+        return len(self.items)
+
+    def overlapping(self, start, end):
+        """Returns the items whose intervals overlap a range
+
+        :param start: The start of the range
+        :param end: The end of the range
+        :return: The items, in the order they were indexed
+        :rtype: list
+        """
+        if len(self) == 0:
+            return []
+
+        # An interval can only overlap if it starts within the longest interval length before the range
+        first = bisect_left(self.starts, start - self.max_length)
+        last = bisect_right(self.starts, end)
+
+        matches = [i for i in range(first, last) if self.ends[i] >= start]
+
+        return [self.items[i] for i in sorted(matches, key=lambda i: self.positions[i])]
+
+    def at(self, point):
+        """Returns the items whose intervals contain a point
+
+        :param point: The point to query
+        :return: The items, in the order they were indexed
+        :rtype: list
+        """
+        return self.overlapping(point, point)
+
+
+def timestamp_range(simulation_timestamps, start, end):
+    """Returns the range of indices of sorted timestamps which fall within an interval
+
+    :param simulation_timestamps: The timestamps, in chronological order
+    :type simulation_timestamps: list(datetime.datetime)
+    :param start: The start of the interval, inclusive
+    :type start: datetime.datetime
+    :param end: The end of the interval, inclusive
+    :type end: datetime.datetime
+    :return: The index of the first timestamp in the interval, and the index after the last
+    :rtype: tuple(int, int)
+    """
+    first = bisect_left(simulation_timestamps, start)
+
+    return first, max(first, bisect_right(simulation_timestamps, end))
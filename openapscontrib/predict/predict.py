@@ -1,26 +1,56 @@
 from collections import defaultdict
+from collections import OrderedDict
 import datetime
 from dateutil.parser import parse
-from functools32 import lru_cache
 import math
-from numpy import arange
+import numpy
 from scipy.stats import linregress
-
-from models import Unit
+import threading
+
+from . import backend
+from .carbs import carb_effect_curve
+from .carbs import carb_effect_curves
+from .carbs import get_carb_model
+from .instrumentation import recorder
+from .instrumentation import span
+from .instrumentation import timed
+from .insulin import WalshInsulinModel
+from .insulin import get_insulin_model
+from .insulin import walsh_iob_antiderivative
+from .insulin import walsh_iob_coefficients
+from .insulin import walsh_iob_curve
+from .insulin import walsh_iob_curve_coefficients
+from .insulin import walsh_iob_curves
+from .integration import default_integrator
+from .integration import RiemannSum
+from .intervals import IntervalIndex
+from .intervals import timestamp_range
+from .models import Unit
 
 
 class Schedule(object):
-    def __init__(self, entries):
+    """A daily schedule of values, with a bounded cache of lookups
+
+    Each instance keeps its own least-recently-used cache, so a schedule and its lookups are released together.
+    Lookups are evaluated outside the lock, so concurrent threads only contend to read and update the cache.
+    """
+    def __init__(self, entries, cache_size=128):
         """
 
-        :param entries:
+        :param entries: The schedule entries, each with a `start` time, in order of their start
         :type entries: list(dict)
+        :param cache_size: The maximum number of lookups to cache, or 0 to disable the cache
+        :type cache_size: int
         :return:
         :rtype:
         """
         self.entries = entries
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
-    @lru_cache()
     def at(self, time):
         """
 
@@ -29,6 +59,22 @@ class Schedule(object):
         :return:
         :rtype: dict
         """
+        with self._lock:
+            result = self._cache.pop(time, None)
+
+            if result is not None:
+                # Reinserting the entry marks it as the most recently used
+                self._cache[time] = result
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if recorder.enabled:
+            recorder.count('Schedule.at.hit' if result is not None else 'Schedule.at')
+
+        if result is not None:
+            return result
+
         result = {}
 
         for entry in self.entries:
@@ -36,8 +82,31 @@ class Schedule(object):
                 break
             result = entry
 
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[time] = result
+
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
         return result
 
+    def cache_info(self):
+        """Returns the cache statistics, with the fields of `functools.lru_cache`
+
+        :return: A dictionary of hits, misses, maxsize and currsize
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.cache_size, 'currsize': len(self._cache)}
+
+    def cache_clear(self):
+        """Empties the cache and resets its statistics"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
 
 def floor_datetime_at_minute_interval(timestamp, minute):
     return timestamp - datetime.timedelta(
@@ -84,71 +153,212 @@ def glucose_data_tuple(glucose_entry):
     )
 
 
-def carb_effect_curve(t, absorption_time):
-    """Returns the fraction of total carbohydrate effect with a given absorption time on blood
-    glucose at the specified number of minutes after eating.
+GLUCOSE_DATE_KEYS = ('dateString', 'display_time', 'date')
+GLUCOSE_VALUE_KEYS = ('sgv', 'amount', 'glucose', 'meter_glucose')
 
-    This is the integral of Carbs on Board (COB), defined by a Scheiner GI curve from Think Link a
-    Pancreas, fig 7-8. This is based on an algorithm that first appeared in GlucoDyn
 
-    See: https://github.com/kenstack/GlucoDyn
+def glucose_schema(glucose_entry):
+    """Returns the date and value keys which `glucose_data_tuple` would read from an entry
 
-    :param t: The time in minutes since the carbs were eaten
-    :type t: float
-    :param absorption_time: The total absorption time of the carbohydrates in minutes
-    :type absorption_time: int
-    :return: A percentage of the initial carb intake, from 0 to 1
-    :rtype: float
+    :param glucose_entry: A Nightscout, Dexcom, Medtronic or openaps glucose entry
+    :type glucose_entry: dict
+    :return: The date key and the value key
+    :rtype: tuple(str, str)
     """
+    return (
+        next((key for key in GLUCOSE_DATE_KEYS if glucose_entry.get(key)), 'date'),
+        next((key for key in GLUCOSE_VALUE_KEYS if glucose_entry.get(key)), 'meter_glucose')
+    )
 
-    if t <= 0:
-        return 0.0
-    elif t <= absorption_time / 2.0:
-        return 2.0 / (absorption_time ** 2) * (t ** 2)
-    elif t < absorption_time:
-        return -1.0 + 4.0 / absorption_time * (t - t ** 2 / (2.0 * absorption_time))
-    else:
-        return 1.0
 
+class GlucoseSeries(object):
+    """Glucose entries as columns of dates and values, in the order of the entries
 
-def walsh_iob_curve(t, insulin_action_duration):
-    """Returns the fraction of a single insulin dosage remaining at the specified number of minutes
-    after delivery; also known as Insulin On Board (IOB).
+    The schema of the entries is detected once, from the first entry, and each column is then read with a single key.
+    A file which mixes schemas, where an entry lacks the detected keys or has one that `glucose_data_tuple` prefers,
+    falls back to reading every entry with `glucose_data_tuple`. Dates are parsed on demand, since most callers only
+    need the latest few.
+    """
+    def __init__(self, recent_glucose):
+        """
 
-    This is a Walsh IOB curve, and is based on an algorithm that first appeared in GlucoDyn
+        :param recent_glucose: Glucose entries, usually in reverse-chronological order
+        :type recent_glucose: list(dict)
+        """
+        self.entries = recent_glucose
+
+        if len(recent_glucose) == 0:
+            dates, values = [], []
+        else:
+            date_key, value_key = glucose_schema(recent_glucose[0])
+            dates = [entry.get(date_key) for entry in recent_glucose]
+            values = [entry.get(value_key) for entry in recent_glucose]
+
+            # Keys which take precedence over the detected ones in `glucose_data_tuple`
+            preferred_keys = (
+                GLUCOSE_DATE_KEYS[:GLUCOSE_DATE_KEYS.index(date_key)] +
+                GLUCOSE_VALUE_KEYS[:GLUCOSE_VALUE_KEYS.index(value_key)]
+            )
+
+            if not (all(dates) and all(values)) or any(
+                entry.get(key) for entry in recent_glucose for key in preferred_keys
+            ):
+                dates, values = zip(*map(glucose_data_tuple, recent_glucose))
+
+        self.dates = list(dates)
+        self.values = numpy.array(values, dtype=float)
+        self._datetimes = {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def datetime(self, index):
+        """Returns the parsed date of an entry
+
+        :param index: The index of the entry
+        :type index: int
+        :rtype: datetime.datetime
+        """
+        if index not in self._datetimes:
+            self._datetimes[index] = parse(self.dates[index])
 
-    See: https://github.com/kenstack/GlucoDyn
+        return self._datetimes[index]
 
-    :param t: time in minutes since the dose began
-    :type t: float
-    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
-    :type insulin_action_duration: int
-    :return: The fraction of a insulin dosage remaining at the specified time
-    :rtype: float
+
+def as_glucose_series(recent_glucose):
+    """Returns glucose entries as a GlucoseSeries, reusing one that was already built
+
+    :param recent_glucose: Glucose entries, or their series
+    :type recent_glucose: list(dict)|GlucoseSeries
+    :rtype: GlucoseSeries
     """
-    # assert insulin_action_duration in (3 * 60, 4 * 60, 5 * 60, 6 * 60)
-    iob = 0
+    if isinstance(recent_glucose, GlucoseSeries):
+        return recent_glucose
 
-    if t >= insulin_action_duration:
-        iob = 0.0
-    elif t <= 0:
-        iob = 1.0
-    elif insulin_action_duration == 180:
-        iob = -3.2030e-9 * (t**4) + 1.354e-6 * (t**3) - 1.759e-4 * (t**2) + 9.255e-4 * t + 0.99951
-    elif insulin_action_duration == 240:
-        iob = -3.310e-10 * (t**4) + 2.530e-7 * (t**3) - 5.510e-5 * (t**2) - 9.086e-4 * t + 0.99950
-    elif insulin_action_duration == 300:
-        iob = -2.950e-10 * (t**4) + 2.320e-7 * (t**3) - 5.550e-5 * (t**2) + 4.490e-4 * t + 0.99300
-    elif insulin_action_duration == 360:
-        iob = -1.493e-10 * (t**4) + 1.413e-7 * (t**3) - 4.095e-5 * (t**2) + 6.365e-4 * t + 0.99700
+    return GlucoseSeries(recent_glucose)
 
-    return iob
 
+class EffectSeries(object):
+    """Effect values on an evenly spaced grid, with the start date, interval and unit stored once
+
+    Iterating a series yields the same entries as the list it was built from, so it can be passed wherever an effect
+    list is read. Dates are formatted on demand, from the start date and interval.
+    """
+    def __init__(self, start, dt, unit, values):
+        """
+
+        :param start: The ISO date of the first value
+        :type start: basestring
+        :param dt: The interval between values in seconds
+        :type dt: int
+        :param unit: The unit of the values
+        :type unit: basestring
+        :param values: The value at each date
+        :type values: numpy.ndarray
+        """
+        self.start = start
+        self.dt = dt
+        self.unit = unit
+        self.values = numpy.asarray(values, dtype=float)
+        self._dates = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for date, amount in zip(self.dates, self.values.tolist()):
+            yield {'date': date, 'amount': amount, 'unit': self.unit}
+
+    @property
+    def dates(self):
+        """The ISO date of each value
+
+        :rtype: list(str)
+        """
+        if self._dates is None:
+            if len(self) == 0:
+                self._dates = []
+            else:
+                start = parse(self.start)
+                self._dates = [
+                    (start + datetime.timedelta(seconds=self.dt * i)).isoformat() for i in range(len(self))
+                ]
+
+        return self._dates
+
+
+def as_effect_series(effect):
+    """Returns an effect list as an EffectSeries, reusing one that was already built
+
+    :param effect: A list of timestamps and values in chronological order, or its series
+    :type effect: list(dict)|EffectSeries
+    :rtype: EffectSeries
+    :raises ValueError: If the dates aren't evenly spaced, or the entries mix units
+    """
+    if isinstance(effect, EffectSeries):
+        return effect
+
+    if len(effect) == 0:
+        return EffectSeries('', 0, '', [])
 
-def integrate_iob(t0, t1, insulin_action_duration, t):
-    """Integrates IOB using Simpson's rule for spread-out (basal-like) doses
+    unit = effect[0]['unit']
+    dt = microseconds(parse(effect[1]['date']) - parse(effect[0]['date'])) // 10 ** 6 if len(effect) > 1 else 0
+    series = EffectSeries(effect[0]['date'], dt, unit, [entry['amount'] for entry in effect])
 
-    TODO: Clean this up and use scipy.integrate.simps
+    if series.dates != [entry['date'] for entry in effect]:
+        raise ValueError('Effect dates must be evenly spaced')
+
+    if any(entry['unit'] != unit for entry in effect):
+        raise ValueError('Effect entries must share a unit')
+
+    return series
+
+
+def carb_absorption_time(event, absorption_duration):
+    """Returns the absorption time of a carb entry, which may be specified per meal with an `absorption_time` key
+
+    :param event: The carb history event
+    :type event: dict
+    :param absorption_duration: The default absorption time in minutes
+    :type absorption_duration: int
+    :return: The absorption time in minutes
+    :rtype: int
+    """
+    return event.get('absorption_time') or absorption_duration
+
+
+def carb_event_groups(normalized_history, absorption_duration):
+    """Groups carb entries by their absorption time, in the order each absorption time first appears
+
+    :param normalized_history: History data, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param absorption_duration: The default absorption time in minutes
+    :type absorption_duration: int
+    :return: A dictionary of absorption times to lists of carb events
+    :rtype: OrderedDict
+    """
+    groups = OrderedDict()
+
+    for history_event in normalized_history:
+        if history_event['unit'] == Unit.grams:
+            groups.setdefault(carb_absorption_time(history_event, absorption_duration), []).append(history_event)
+
+    return groups
+
+
+def microseconds(delta):
+    """Returns the exact number of microseconds in a timedelta
+
+    :param delta: The timedelta
+    :type delta: datetime.timedelta
+    :return: The number of microseconds
+    :rtype: int
+    """
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def integrate_iob(t0, t1, insulin_action_duration, t, integrator=None):
+    """Integrates IOB over the delivery of a spread-out (basal-like) dose
 
     :param t0: The start time in minutes of the dose
     :type t0: float
@@ -158,26 +368,20 @@ def integrate_iob(t0, t1, insulin_action_duration, t):
     :type insulin_action_duration: int
     :param t: The current time in minutes
     :type t: float
+    :param integrator: The integration strategy. Defaults to Simpson's rule over 50 segments.
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
     :return:
     :rtype: float
     """
-    nn = 50  # nn needs to be even
-
-    # initialize with first and last terms of simpson series
-    dx = (t1 - t0) / nn
-    integral = walsh_iob_curve(t - t0, insulin_action_duration) + walsh_iob_curve(t - t1, insulin_action_duration)
+    if recorder.enabled:
+        recorder.count('integrate_iob')
 
-    for i in range(1, nn - 1, 2):
-        integral += 4 * walsh_iob_curve(
-            t - (t0 + i * dx), insulin_action_duration
-        ) + 2 * walsh_iob_curve(
-            t - (t0 + (i + 1) * dx), insulin_action_duration
-        )
+    integrator = integrator or default_integrator
 
-    return integral * dx / 3.0
+    return integrator.integrate(lambda s: walsh_iob_curve(t - s, insulin_action_duration), t0, t1)
 
 
-def sum_iob(t0, t1, insulin_action_duration, t, dt, absorption_delay=0):
+def sum_iob(t0, t1, insulin_action_duration, t, dt, absorption_delay=0, integrator=None):
     """Sums the percent IOB activity at a given time for a temp basal dose
 
     :param t0: The start time in minutes of the dose
@@ -193,16 +397,18 @@ def sum_iob(t0, t1, insulin_action_duration, t, dt, absorption_delay=0):
                              specified time before decaying.
     :type absorption_delay: int
     :param dt: The segment size over which to sum
+    :param integrator: The integration strategy. Defaults to a Riemann sum over segments of dt.
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
     :return: The sum of IOB at time t, in percent
     """
-    iob = 0
+    integrator = integrator or RiemannSum(dt)
 
-    # Divide the dose into equal segments of dt, from t0 to t1
-    for i in arange(t0, min(t1 + dt, math.floor((t + absorption_delay) / dt) * dt + dt), dt):
-        segment = max(0, min(i + dt, t1) - i) / (t1 - t0)
-        iob += segment * walsh_iob_curve(t - i, insulin_action_duration)
+    # Only the segments of dt delivered by time t contribute
+    delivered_end = min(t1, math.floor((t + absorption_delay) / dt) * dt + dt)
 
-    return iob
+    return integrator.integrate(
+        lambda s: walsh_iob_curve(t - s, insulin_action_duration), t0, delivered_end, scale=t1 - t0
+    )
 
 
 def cumulative_bolus_effect_at_time(event, t, insulin_sensitivity, insulin_action_duration):
@@ -240,7 +446,8 @@ def carb_effect_at_datetime(event, t, insulin_sensitivity, carb_ratio, absorptio
     return insulin_sensitivity / carb_ratio * event['amount'] * carb_effect_curve(t, absorption_rate)
 
 
-def cumulative_temp_basal_effect_at_time(event, t, t0, t1, insulin_sensitivity, insulin_action_duration):
+def cumulative_temp_basal_effect_at_time(event, t, t0, t1, insulin_sensitivity, insulin_action_duration,
+                                         integrator=None):
     """
 
     :param event:
@@ -255,6 +462,8 @@ def cumulative_temp_basal_effect_at_time(event, t, t0, t1, insulin_sensitivity,
     :type insulin_sensitivity: int
     :param insulin_action_duration: in minutes
     :type insulin_action_duration: int
+    :param integrator: The integration strategy used for IOB
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
     :return:
     :rtype: float
     """
@@ -264,11 +473,157 @@ def cumulative_temp_basal_effect_at_time(event, t, t0, t1, insulin_sensitivity,
     if t > t1 + insulin_action_duration:
         int_iob = 0
     else:
-        int_iob = integrate_iob(t0, t1, insulin_action_duration, t)
+        int_iob = integrate_iob(t0, t1, insulin_action_duration, t, integrator=integrator)
 
     return event['amount'] / 60.0 * -insulin_sensitivity * ((t1 - t0) - int_iob)
 
 
+def bolus_effects(event, t, insulin_sensitivity, insulin_model):
+    """Returns the cumulative effect of a bolus on blood glucose over an array of times
+
+    :param event: The bolus history event, describing a value in Units of insulin
+    :type event: dict
+    :param t: The times in minutes from the beginning of the dose
+    :type t: numpy.ndarray
+    :param insulin_sensitivity: The insulin sensitivity at the time of the dose, in mg/dL/U
+    :type insulin_sensitivity: float
+    :param insulin_model: The insulin action model
+    :type insulin_model: WalshInsulinModel|ExponentialInsulinModel
+    :return: The cumulative effect of the bolus on blood glucose at each time, in mg/dL
+    :rtype: numpy.ndarray
+    """
+    return numpy.where(t < 0, 0.0, -event['amount'] * insulin_sensitivity * (1 - insulin_model.iob(t)))
+
+
+def temp_basal_effects(event, t, t0, t1, insulin_sensitivities, insulin_model):
+    """Returns the cumulative effect of a temp basal on blood glucose over an array of times, integrating the insulin
+    model in closed form
+
+    :param event: The temp basal history event, describing a rate in Units/hour
+    :type event: dict
+    :param t: The times in minutes from the beginning of the dose
+    :type t: numpy.ndarray
+    :param t0: The start time in minutes of the dose
+    :type t0: float
+    :param t1: The end time in minutes of the dose
+    :type t1: float
+    :param insulin_sensitivities: The insulin sensitivity at each time, in mg/dL/U
+    :type insulin_sensitivities: numpy.ndarray
+    :param insulin_model: The insulin action model
+    :type insulin_model: WalshInsulinModel|ExponentialInsulinModel
+    :return: The cumulative effect of the temp basal on blood glucose at each time, in mg/dL
+    :rtype: numpy.ndarray
+    """
+    int_iob = insulin_model.integrated_iob(t0, t1, t)
+
+    return numpy.where(t < t0, 0.0, event['amount'] / 60.0 * -insulin_sensitivities * ((t1 - t0) - int_iob))
+
+
+def effect_window(history_event, insulin_action_duration, absorption_duration=180, absorption_delay=10,
+                  basal_dosing_end=None):
+    """Returns the span of time over which a history event changes blood glucose
+
+    The effect of an event is 0 before the window, and constant after it.
+
+    :param history_event: The history event, normalized by openapscontrib.mmhistorytools
+    :type history_event: dict
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: int
+    :param absorption_duration: The absorption time in minutes of carb entries which don't specify an `absorption_time`
+    :type absorption_duration: int
+    :param absorption_delay: The delay time before a dose or meal begins absorption in minutes
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+    :type basal_dosing_end: datetime.datetime
+    :return: The start and end of the window, or None if the event has no effect
+    :rtype: tuple(datetime.datetime, datetime.datetime)|NoneType
+    """
+    start_at = parse(history_event['start_at'])
+
+    if history_event['unit'] == Unit.grams:
+        return start_at, start_at + datetime.timedelta(
+            minutes=absorption_delay + carb_absorption_time(history_event, absorption_duration)
+        )
+    elif history_event['unit'] in (Unit.units, Unit.units_per_hour):
+        end_at = parse(history_event['end_at'])
+        effect_end_at = end_at + datetime.timedelta(minutes=insulin_action_duration)
+
+        if history_event['type'] == 'TempBasal' and basal_dosing_end and end_at > basal_dosing_end:
+            end_at = basal_dosing_end
+
+        t1 = (end_at - start_at).total_seconds() / 60.0
+
+        return start_at, max(
+            effect_end_at,
+            start_at + datetime.timedelta(minutes=absorption_delay + max(t1, 0) + insulin_action_duration)
+        )
+
+
+def history_index(normalized_history, insulin_action_curve, absorption_duration=180, absorption_delay=10,
+                  basal_dosing_end=None):
+    """Indexes history events by the span of time over which each one changes blood glucose
+
+    :param normalized_history: History data, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param insulin_action_curve: Duration of insulin action for the patient in hours
+    :type insulin_action_curve: float
+    :param absorption_duration: The absorption time in minutes of carb entries which don't specify an `absorption_time`
+    :type absorption_duration: int
+    :param absorption_delay: The delay time before a dose or meal begins absorption in minutes
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+    :type basal_dosing_end: datetime.datetime
+    :return: An index of the events
+    :rtype: IntervalIndex
+    """
+    intervals = []
+
+    for history_event in normalized_history:
+        window = effect_window(
+            history_event,
+            insulin_action_curve * 60,
+            absorption_duration=absorption_duration,
+            absorption_delay=absorption_delay,
+            basal_dosing_end=basal_dosing_end
+        )
+
+        if window is not None:
+            intervals.append(window + (history_event,))
+
+    return IntervalIndex(intervals)
+
+
+def active_events(normalized_history, timestamp, insulin_action_curve, absorption_duration=180, absorption_delay=10,
+                  basal_dosing_end=None):
+    """Returns the doses and meals which are changing blood glucose at a given time
+
+    To query many times against the same history, build the index once with `history_index`.
+
+    :param normalized_history: History data, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param timestamp: The time to query
+    :type timestamp: datetime.datetime
+    :param insulin_action_curve: Duration of insulin action for the patient in hours
+    :type insulin_action_curve: float
+    :param absorption_duration: The absorption time in minutes of carb entries which don't specify an `absorption_time`
+    :type absorption_duration: int
+    :param absorption_delay: The delay time before a dose or meal begins absorption in minutes
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+    :type basal_dosing_end: datetime.datetime
+    :return: The active events, in history order
+    :rtype: list(dict)
+    """
+    return history_index(
+        normalized_history,
+        insulin_action_curve,
+        absorption_duration=absorption_duration,
+        absorption_delay=absorption_delay,
+        basal_dosing_end=basal_dosing_end
+    ).at(timestamp)
+
+
+@timed()
 def calculate_momentum_effect(
     recent_glucose,
     recent_calibrations=(),
@@ -279,7 +634,7 @@ def calculate_momentum_effect(
     """Calculates predicted short-term blood glucose based on recent historical glucose data
 
     :param recent_glucose: Glucose data in reverse-chronological order, cleaned by openapscontrib.glucosetools
-    :type recent_glucose: list(dict)
+    :type recent_glucose: list(dict)|GlucoseSeries
     :param recent_calibrations: Glucose calibration data in reverse-chronological order
     :type recent_calibrations: list(dict)
     :param dt: The time differential for calculation and return value spacing in minutes
@@ -291,11 +646,12 @@ def calculate_momentum_effect(
     :return: A list of relative blood glucose values and their timestamps
     :rtype: list(dict)
     """
+    recent_glucose = as_glucose_series(recent_glucose)
+
     if len(recent_glucose) < fit_points:
         return []
 
-    last_glucose_date, last_glucose_value = glucose_data_tuple(recent_glucose[0])
-    last_glucose_datetime = parse(last_glucose_date)
+    last_glucose_datetime = recent_glucose.datetime(0)
     simulation_start = floor_datetime_at_minute_interval(last_glucose_datetime, dt)
     simulation_end = simulation_start + datetime.timedelta(minutes=prediction_time)
     simulation_minutes = range(0, int(math.ceil((simulation_end - simulation_start).total_seconds() / 60.0)) + dt, dt)
@@ -303,13 +659,8 @@ def calculate_momentum_effect(
     simulation_count = len(simulation_minutes)
     momentum_effect = [0.0] * simulation_count
 
-    fit_x = []
-    fit_y = []
-
-    for i in range(fit_points):
-        date, value = glucose_data_tuple(recent_glucose[i])
-        fit_x.append((parse(date) - last_glucose_datetime).total_seconds())
-        fit_y.append(value)
+    fit_x = [(recent_glucose.datetime(i) - last_glucose_datetime).total_seconds() for i in range(fit_points)]
+    fit_y = recent_glucose.values[:fit_points]
 
     # check that glucose values exist for the last three timestamps
     if abs(datetime.timedelta(seconds=fit_x[0] - fit_x[-1])) > datetime.timedelta(minutes=dt * fit_points):
@@ -328,23 +679,31 @@ def calculate_momentum_effect(
         t = max(0, (timestamp - last_glucose_datetime).total_seconds())
         momentum_effect[i] = t * glucose_slope
 
-    return [{
-        'date': timestamp.isoformat(),
-        'amount': momentum_effect[i],
-        'unit': Unit.milligrams_per_deciliter
-    } for i, timestamp in enumerate(simulation_timestamps)]
+    with span('serialize'):
+        return [{
+            'date': timestamp.isoformat(),
+            'amount': momentum_effect[i],
+            'unit': Unit.milligrams_per_deciliter
+        } for i, timestamp in enumerate(simulation_timestamps)]
 
 
+@timed()
 def calculate_carb_effect(
     normalized_history,
     carb_ratio_schedule,
     insulin_sensitivity_schedule,
     dt=5,
     absorption_duration=180,
-    absorption_delay=10
+    absorption_delay=10,
+    start_at=None,
+    end_at=None,
+    carb_model='scheiner'
 ):
     """Calculates the relative effect of carbohydrate absorption on blood glucose for a sequence of meals
 
+    Only timestamps between `start_at` and `end_at` are evaluated. Meals which finished absorbing before the start
+    contribute their total effect without being simulated, and meals after the end are skipped.
+
     :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
     :type normalized_history: list(dict)
     :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
@@ -353,113 +712,340 @@ def calculate_carb_effect(
     :type insulin_sensitivity_schedule: Schedule
     :param dt: The time differential for calculation and return value spacing in minutes
     :type dt: int
-    :param absorption_duration: The total absorption time of the carbohydrates in minutes
+    :param absorption_duration: The total absorption time of the carbohydrates in minutes, for entries which
+                                don't specify their own `absorption_time`
     :type absorption_duration: int
     :param absorption_delay: The delay time before a meal begins absorption in minutes
     :type absorption_delay: int
+    :param start_at: A datetime override at which to begin the output
+    :type start_at: datetime.datetime
+    :param end_at: A datetime override at which to end the output
+    :type end_at: datetime.datetime
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
     :return: A list of relative blood glucose values and their timestamps
     :rtype: list(dict)
     """
     if len(normalized_history) == 0:
         return []
 
+    carb_groups = carb_event_groups(normalized_history, absorption_duration)
+    max_absorption_duration = max([absorption_duration] + list(carb_groups.keys()))
+
     first_history_event = min(normalized_history, key=lambda e: e['start_at'])
     last_history_event = max(normalized_history, key=lambda e: e['end_at'])
     last_history_datetime = ceil_datetime_at_minute_interval(parse(last_history_event['end_at']), dt)
-    simulation_start = floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
-    simulation_end = last_history_datetime + datetime.timedelta(minutes=(absorption_duration + absorption_delay))
+    simulation_start = start_at or floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
+    simulation_end = end_at or last_history_datetime + datetime.timedelta(
+        minutes=(max_absorption_duration + absorption_delay)
+    )
 
     simulation_minutes = range(0, int(math.ceil((simulation_end - simulation_start).total_seconds() / 60.0)) + dt, dt)
     simulation_timestamps = [simulation_start + datetime.timedelta(minutes=m) for m in simulation_minutes]
     simulation_count = len(simulation_minutes)
 
-    carb_effect = [0.0] * simulation_count
+    if simulation_count == 0:
+        return []
 
-    for history_event in normalized_history:
-        if history_event['unit'] == Unit.grams:
-            start_at = parse(history_event['start_at'])
+    simulation_microseconds = numpy.array(simulation_minutes, dtype=numpy.int64) * 60 * 10 ** 6
 
-            carb_ratio = carb_ratio_schedule.at(start_at.time())['ratio']
-            insulin_sensitivity = insulin_sensitivity_schedule.at(start_at.time())['sensitivity']
+    carb_effect = numpy.zeros(simulation_count)
+    completed_effect = 0.0
 
-            for i, timestamp in enumerate(simulation_timestamps):
-                t = (timestamp - start_at).total_seconds() / 60.0 - absorption_delay
+    with span('events'):
+        # Evaluate the curve for all meals sharing an absorption time at once
+        for absorption_time, events in carb_groups.items():
+            absorbing_events = []
+            starts = []
 
-                effect = carb_effect_at_datetime(history_event, t, insulin_sensitivity, carb_ratio, absorption_duration)
-                carb_effect[i] += effect
+            for history_event in events:
+                event_start_at = parse(history_event['start_at'])
 
-    return [{
-        'date': timestamp.isoformat(),
-        'amount': carb_effect[i],
-        'unit': Unit.milligrams_per_deciliter
-    } for i, timestamp in enumerate(simulation_timestamps)]
+                if event_start_at > simulation_timestamps[-1]:
+                    continue
+                # A meal which finished absorbing before the simulation start has a constant effect
+                elif simulation_start >= event_start_at + datetime.timedelta(
+                    minutes=absorption_delay + absorption_time
+                ):
+                    carb_ratio = carb_ratio_schedule.at(event_start_at.time())['ratio']
+                    insulin_sensitivity = insulin_sensitivity_schedule.at(event_start_at.time())['sensitivity']
+
+                    completed_effect += insulin_sensitivity / carb_ratio * history_event['amount']
+                else:
+                    absorbing_events.append(history_event)
+                    starts.append(event_start_at)
+
+            if len(absorbing_events) == 0:
+                continue
+
+            offsets = numpy.array([microseconds(s - simulation_start) for s in starts], dtype=numpy.int64)
+            t = (simulation_microseconds - offsets[:, numpy.newaxis]) / 1e6 / 60.0 - absorption_delay
+            curves = get_carb_model(carb_model, absorption_time).absorbed(t)
+
+            for history_event, event_start_at, curve in zip(absorbing_events, starts, curves):
+                carb_ratio = carb_ratio_schedule.at(event_start_at.time())['ratio']
+                insulin_sensitivity = insulin_sensitivity_schedule.at(event_start_at.time())['sensitivity']
+
+                carb_effect += insulin_sensitivity / carb_ratio * history_event['amount'] * curve
+
+    if completed_effect != 0.0:
+        carb_effect = completed_effect + carb_effect
+
+    carb_effect = carb_effect.tolist()
+
+    with span('serialize'):
+        return [{
+            'date': timestamp.isoformat(),
+            'amount': carb_effect[i],
+            'unit': Unit.milligrams_per_deciliter
+        } for i, timestamp in enumerate(simulation_timestamps)]
 
 
+@timed()
 def calculate_cob(
     normalized_history,
     dt=5,
     absorption_duration=180,
-    absorption_delay=10
+    absorption_delay=10,
+    start_at=None,
+    end_at=None,
+    carb_model='scheiner'
 ):
     """Calculates the carbohydrate absorption degradation for a sequence of meals
 
+    Only timestamps between `start_at` and `end_at` are evaluated, and meals which finished absorbing before the start
+    or were eaten after the end are skipped.
+
     :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
     :type normalized_history: list(dict)
     :param dt: The time differential for calculation and return value spacing in minutes
     :type dt: int
-    :param absorption_duration: The total absorption time of the carbohydrates in minutes
+    :param absorption_duration: The total absorption time of the carbohydrates in minutes, for entries which
+                                don't specify their own `absorption_time`
     :type absorption_duration: int
     :param absorption_delay: The delay time before a meal begins absorption in minutes
     :type absorption_delay: int
+    :param start_at: A datetime override at which to begin the output
+    :type start_at: datetime.datetime
+    :param end_at: A datetime override at which to end the output
+    :type end_at: datetime.datetime
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
     :return: A list of remaining carbohydrate values and their timestamps
     :rtype: list(dict)
     """
     if len(normalized_history) == 0:
         return []
 
+    carb_groups = carb_event_groups(normalized_history, absorption_duration)
+    max_absorption_duration = max([absorption_duration] + list(carb_groups.keys()))
+
+    first_history_event = min(normalized_history, key=lambda e: e['start_at'])
+    last_history_event = max(normalized_history, key=lambda e: e['end_at'])
+    last_history_datetime = ceil_datetime_at_minute_interval(parse(last_history_event['end_at']), dt)
+    simulation_start = start_at or floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
+    simulation_end = end_at or last_history_datetime + datetime.timedelta(
+        minutes=(max_absorption_duration + absorption_delay)
+    )
+
+    simulation_minutes = range(0, int(math.ceil((simulation_end - simulation_start).total_seconds() / 60.0)) + dt, dt)
+    simulation_timestamps = [simulation_start + datetime.timedelta(minutes=m) for m in simulation_minutes]
+    simulation_count = len(simulation_minutes)
+
+    if simulation_count == 0:
+        return []
+
+    simulation_microseconds = numpy.array(simulation_minutes, dtype=numpy.int64) * 60 * 10 ** 6
+
+    carbs = numpy.zeros(simulation_count)
+
+    with span('events'):
+        # Evaluate the curve for all meals sharing an absorption time at once
+        for absorption_time, events in carb_groups.items():
+            absorption_end = datetime.timedelta(minutes=absorption_delay + absorption_time)
+            absorbing_events = []
+            starts = []
+
+            for history_event in events:
+                event_start_at = parse(history_event['start_at'])
+
+                if simulation_start < event_start_at + absorption_end and event_start_at <= simulation_timestamps[-1]:
+                    absorbing_events.append(history_event)
+                    starts.append(event_start_at)
+
+            if len(absorbing_events) == 0:
+                continue
+
+            offsets = numpy.array([microseconds(s - simulation_start) for s in starts], dtype=numpy.int64)
+            t = (simulation_microseconds - offsets[:, numpy.newaxis]) / 1e6 / 60.0 - absorption_delay
+            remaining = numpy.where(
+                t >= 0 - absorption_delay, 1 - get_carb_model(carb_model, absorption_time).absorbed(t), 0.0
+            )
+
+            for history_event, curve in zip(absorbing_events, remaining):
+                carbs += history_event['amount'] * curve
+
+    carbs = carbs.tolist()
+
+    with span('serialize'):
+        return [{
+            'date': timestamp.isoformat(),
+            'amount': carbs[i],
+            'unit': Unit.grams
+        } for i, timestamp in enumerate(simulation_timestamps)]
+
+
+@timed()
+def calculate_cob_and_carb_effect(
+    normalized_history,
+    carb_ratio_schedule,
+    insulin_sensitivity_schedule,
+    dt=5,
+    absorption_duration=180,
+    absorption_delay=10,
+    start_at=None,
+    end_at=None,
+    carb_model='scheiner'
+):
+    """Calculates carbohydrates on board and the relative effect of carbohydrates on blood glucose in a single pass
+    over the history
+
+    The results are identical to `calculate_cob` and `calculate_carb_effect` with the same arguments, and each
+    absorption curve is evaluated once for both outputs.
+
+    :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
+    :type carb_ratio_schedule: Schedule
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_duration: The total absorption time of the carbohydrates in minutes, for entries which
+                                don't specify their own `absorption_time`
+    :type absorption_duration: int
+    :param absorption_delay: The delay time before a meal begins absorption in minutes
+    :type absorption_delay: int
+    :param start_at: A datetime override at which to begin the output
+    :type start_at: datetime.datetime
+    :param end_at: A datetime override at which to end the output
+    :type end_at: datetime.datetime
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
+    :return: A dictionary of the remaining carbohydrate values and relative blood glucose values, each with their
+             timestamps
+    :rtype: dict(str, list(dict))
+    """
+    if len(normalized_history) == 0:
+        return {'cob': [], 'carb_effect': []}
+
+    carb_groups = carb_event_groups(normalized_history, absorption_duration)
+    max_absorption_duration = max([absorption_duration] + list(carb_groups.keys()))
+
     first_history_event = min(normalized_history, key=lambda e: e['start_at'])
     last_history_event = max(normalized_history, key=lambda e: e['end_at'])
     last_history_datetime = ceil_datetime_at_minute_interval(parse(last_history_event['end_at']), dt)
-    simulation_start = floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
-    simulation_end = last_history_datetime + datetime.timedelta(minutes=(absorption_duration + absorption_delay))
+    simulation_start = start_at or floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
+    simulation_end = end_at or last_history_datetime + datetime.timedelta(
+        minutes=(max_absorption_duration + absorption_delay)
+    )
 
     simulation_minutes = range(0, int(math.ceil((simulation_end - simulation_start).total_seconds() / 60.0)) + dt, dt)
     simulation_timestamps = [simulation_start + datetime.timedelta(minutes=m) for m in simulation_minutes]
     simulation_count = len(simulation_minutes)
 
-    carbs = [0.0] * simulation_count
+    if simulation_count == 0:
+        return {'cob': [], 'carb_effect': []}
 
-    for history_event in normalized_history:
-        if history_event['unit'] == Unit.grams:
-            start_at = parse(history_event['start_at'])
+    simulation_microseconds = numpy.array(simulation_minutes, dtype=numpy.int64) * 60 * 10 ** 6
 
-            for i, timestamp in enumerate(simulation_timestamps):
-                t = (timestamp - start_at).total_seconds() / 60.0 - absorption_delay
+    carbs = numpy.zeros(simulation_count)
+    carb_effect = numpy.zeros(simulation_count)
+    completed_effect = 0.0
+
+    with span('events'):
+        # Evaluate the curve for all meals sharing an absorption time at once
+        for absorption_time, events in carb_groups.items():
+            absorbing_events = []
+            starts = []
+
+            for history_event in events:
+                event_start_at = parse(history_event['start_at'])
 
-                if t >= 0 - absorption_delay:
-                    carbs[i] += history_event['amount'] * (1 - carb_effect_curve(t, absorption_duration))
+                if event_start_at > simulation_timestamps[-1]:
+                    continue
+                # A meal which finished absorbing before the simulation start has no COB, and a constant effect
+                elif simulation_start >= event_start_at + datetime.timedelta(
+                    minutes=absorption_delay + absorption_time
+                ):
+                    carb_ratio = carb_ratio_schedule.at(event_start_at.time())['ratio']
+                    insulin_sensitivity = insulin_sensitivity_schedule.at(event_start_at.time())['sensitivity']
 
-    return [{
-        'date': timestamp.isoformat(),
-        'amount': carbs[i],
-        'unit': Unit.grams
-    } for i, timestamp in enumerate(simulation_timestamps)]
+                    completed_effect += insulin_sensitivity / carb_ratio * history_event['amount']
+                else:
+                    absorbing_events.append(history_event)
+                    starts.append(event_start_at)
 
+            if len(absorbing_events) == 0:
+                continue
+
+            offsets = numpy.array([microseconds(s - simulation_start) for s in starts], dtype=numpy.int64)
+            t = (simulation_microseconds - offsets[:, numpy.newaxis]) / 1e6 / 60.0 - absorption_delay
+            curves = get_carb_model(carb_model, absorption_time).absorbed(t)
+            remaining = numpy.where(t >= 0 - absorption_delay, 1 - curves, 0.0)
+
+            for history_event, event_start_at, curve, remaining_curve in zip(
+                absorbing_events, starts, curves, remaining
+            ):
+                carb_ratio = carb_ratio_schedule.at(event_start_at.time())['ratio']
+                insulin_sensitivity = insulin_sensitivity_schedule.at(event_start_at.time())['sensitivity']
+
+                carbs += history_event['amount'] * remaining_curve
+                carb_effect += insulin_sensitivity / carb_ratio * history_event['amount'] * curve
+
+    if completed_effect != 0.0:
+        carb_effect = completed_effect + carb_effect
+
+    carbs = carbs.tolist()
+    carb_effect = carb_effect.tolist()
+
+    with span('serialize'):
+        return {
+            'cob': [{
+                'date': timestamp.isoformat(),
+                'amount': carbs[i],
+                'unit': Unit.grams
+            } for i, timestamp in enumerate(simulation_timestamps)],
+            'carb_effect': [{
+                'date': timestamp.isoformat(),
+                'amount': carb_effect[i],
+                'unit': Unit.milligrams_per_deciliter
+            } for i, timestamp in enumerate(simulation_timestamps)]
+        }
 
+
+@timed()
 def calculate_insulin_effect(
     normalized_history,
     insulin_action_curve,
     insulin_sensitivity_schedule,
     dt=5,
     absorption_delay=10,
-    basal_dosing_end=None
+    basal_dosing_end=None,
+    integrator=None,
+    start_at=None,
+    end_at=None,
+    insulin_model='walsh'
 ):
     """Calculates the relative effect of insulin absorption on blood glucose for a sequence of doses
 
+    Only timestamps between `start_at` and `end_at` are evaluated. Doses which finished acting before the start
+    contribute their total effect without being simulated, and doses after the end are skipped.
+
     :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
     :type normalized_history: list(dict)
     :param insulin_action_curve: Duration of insulin action for the patient in hours
-    :type insulin_action_curve: int
+    :type insulin_action_curve: float
     :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
     :type insulin_sensitivity_schedule: Schedule
     :param dt: The time differential for calculation and return value spacing in minutes
@@ -468,10 +1054,18 @@ def calculate_insulin_effect(
     :type absorption_delay: int
     :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
     :type basal_dosing_end: datetime.datetime
+    :param integrator: The integration strategy for temp basal doses of the Walsh model. Defaults to Simpson's rule
+                       over 50 segments.
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+    :param start_at: A datetime override at which to begin the output
+    :type start_at: datetime.datetime
+    :param end_at: A datetime override at which to end the output
+    :type end_at: datetime.datetime
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
     :return: A list of relative blood glucose values and their timestamps
     :rtype: list(dict)
     """
-    assert insulin_action_curve in (3, 4, 5, 6)
     insulin_action_curve *= 60
 
     if len(normalized_history) == 0:
@@ -480,72 +1074,170 @@ def calculate_insulin_effect(
     first_history_event = min(normalized_history, key=lambda e: e['start_at'])
     last_history_event = max(normalized_history, key=lambda e: e['end_at'])
     last_history_datetime = ceil_datetime_at_minute_interval(parse(last_history_event['end_at']), dt)
-    simulation_start = floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
-    simulation_end = last_history_datetime + datetime.timedelta(minutes=(insulin_action_curve + absorption_delay))
+    simulation_start = start_at or floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
+    simulation_end = end_at or last_history_datetime + datetime.timedelta(
+        minutes=(insulin_action_curve + absorption_delay)
+    )
 
     # For each incremental minute from the simulation start time, calculate the effect values
     simulation_minutes = range(0, int(math.ceil((simulation_end - simulation_start).total_seconds() / 60.0)) + dt, dt)
     simulation_timestamps = [simulation_start + datetime.timedelta(minutes=m) for m in simulation_minutes]
     simulation_count = len(simulation_minutes)
 
-    insulin_effect = [0.0] * simulation_count
-
-    for history_event in normalized_history:
-        start_at = parse(history_event['start_at'])
-        end_at = parse(history_event['end_at'])
-        effect_end_at = end_at + datetime.timedelta(minutes=insulin_action_curve)
+    if simulation_count == 0:
+        return []
 
-        insulin_sensitivity = insulin_sensitivity_schedule.at(start_at.time())['sensitivity']
+    insulin_effect = [0.0] * simulation_count
+    completed_effect = 0.0
+
+    model = get_insulin_model(insulin_model, insulin_action_curve)
+
+    # The Walsh model keeps its integrators and native loops. Other models are evaluated in closed form.
+    closed_form = not isinstance(model, WalshInsulinModel)
+
+    # The native loops reproduce the default integrator
+    native = backend.native() and integrator is None and not closed_form
+
+    with span('events'):
+        for history_event in normalized_history:
+            event_start_at = parse(history_event['start_at'])
+            end_at = parse(history_event['end_at'])
+            effect_end_at = end_at + datetime.timedelta(minutes=insulin_action_curve)
+
+            insulin_sensitivity = insulin_sensitivity_schedule.at(event_start_at.time())['sensitivity']
+
+            if history_event['type'] == 'TempBasal' and basal_dosing_end and end_at > basal_dosing_end:
+                end_at = basal_dosing_end
+
+            t0 = 0
+            t1 = (end_at - event_start_at).total_seconds() / 60.0
+
+            # Optimize rate-based events as single points in time if their duration is less than dt
+            if history_event['unit'] == Unit.units_per_hour and t1 - t0 <= 1.05 * dt:
+                history_event = {
+                    'type': history_event['type'],
+                    'start_at': event_start_at,
+                    'end_at': event_start_at,
+                    'unit': Unit.units,
+                    'amount': history_event['amount'] * (t1 - t0) / 60.0
+                }
+
+            def model_effects(timestamps):
+                t = numpy.array([
+                    (timestamp - event_start_at).total_seconds() / 60.0 for timestamp in timestamps
+                ]) - absorption_delay
+
+                if history_event['unit'] == Unit.units:
+                    return bolus_effects(history_event, t, insulin_sensitivity, model)
+                else:
+                    return temp_basal_effects(history_event, t, t0, t1, numpy.array([
+                        insulin_sensitivity_schedule.at(min(effect_end_at, timestamp).time())['sensitivity']
+                        for timestamp in timestamps
+                    ], dtype=float), model)
+
+            def effect_at(timestamp):
+                t = (timestamp - event_start_at).total_seconds() / 60.0 - absorption_delay
+
+                if t < 0 - absorption_delay:
+                    return None
+                elif closed_form and history_event['unit'] in (Unit.units, Unit.units_per_hour):
+                    return float(model_effects([timestamp])[0])
+                elif history_event['unit'] == Unit.units:
+                    return cumulative_bolus_effect_at_time(
+                        history_event, t, insulin_sensitivity, insulin_action_curve
+                    )
+                elif history_event['unit'] == Unit.units_per_hour:
+                    # Cap the time used to determine the sensitivity so it doesn't fluctuate
+                    # after completion
+                    sensitivity_time = min(effect_end_at, timestamp)
+                    basal_insulin_sensitivity = insulin_sensitivity_schedule.at(
+                        sensitivity_time.time()
+                    )['sensitivity']
+
+                    return cumulative_temp_basal_effect_at_time(
+                        history_event,
+                        t,
+                        t0,
+                        t1,
+                        basal_insulin_sensitivity,
+                        insulin_action_curve,
+                        integrator=integrator
+                    )
+
+            # A dose which finished acting before the simulation start has a constant effect
+            completed_at = max(
+                effect_end_at,
+                event_start_at + datetime.timedelta(minutes=absorption_delay + max(t1, 0) + insulin_action_curve)
+            )
+
+            if event_start_at > simulation_timestamps[-1]:
+                continue
+            elif simulation_start > completed_at:
+                completed_effect += effect_at(simulation_start) or 0.0
+                continue
 
-        if history_event['type'] == 'TempBasal' and basal_dosing_end and end_at > basal_dosing_end:
-            end_at = basal_dosing_end
+            # Only the timestamps while the dose is acting are evaluated, and its final effect holds after that
+            first, last = timestamp_range(simulation_timestamps, event_start_at, completed_at)
+
+            if closed_form and history_event['unit'] in (Unit.units, Unit.units_per_hour):
+                for i, effect in zip(range(first, last), model_effects(simulation_timestamps[first:last]).tolist()):
+                    insulin_effect[i] += effect
+            elif native and history_event['unit'] in (Unit.units, Unit.units_per_hour):
+                t = numpy.array([
+                    (timestamp - event_start_at).total_seconds() / 60.0
+                    for timestamp in simulation_timestamps[first:last]
+                ]) - absorption_delay
+
+                if history_event['unit'] == Unit.units:
+                    effects = backend.bolus_effects(
+                        t,
+                        float(history_event['amount']),
+                        float(insulin_sensitivity),
+                        float(insulin_action_curve),
+                        walsh_iob_curve_coefficients(insulin_action_curve)
+                    )
+                else:
+                    effects = backend.temp_basal_effects(
+                        t,
+                        float(history_event['amount']),
+                        float(t1),
+                        numpy.array([
+                            insulin_sensitivity_schedule.at(min(effect_end_at, timestamp).time())['sensitivity']
+                            for timestamp in simulation_timestamps[first:last]
+                        ], dtype=float),
+                        float(insulin_action_curve),
+                        walsh_iob_curve_coefficients(insulin_action_curve),
+                        default_integrator.segments
+                    )
+
+                for i, effect in zip(range(first, last), effects.tolist()):
+                    insulin_effect[i] += effect
+            else:
+                for i in range(first, last):
+                    effect = effect_at(simulation_timestamps[i])
 
-        t0 = 0
-        t1 = (end_at - start_at).total_seconds() / 60.0
+                    if effect is not None:
+                        insulin_effect[i] += effect
 
-        # Optimize rate-based events as single points in time if their duration is less than dt
-        if history_event['unit'] == Unit.units_per_hour and t1 - t0 <= 1.05 * dt:
-            history_event = {
-                'type': history_event['type'],
-                'start_at': start_at,
-                'end_at': start_at,
-                'unit': Unit.units,
-                'amount': history_event['amount'] * (t1 - t0) / 60.0
-            }
+            if last < simulation_count:
+                effect = effect_at(simulation_timestamps[last])
 
-        for i, timestamp in enumerate(simulation_timestamps):
-            t = (timestamp - start_at).total_seconds() / 60.0 - absorption_delay
+                if effect is not None:
+                    for i in range(last, simulation_count):
+                        insulin_effect[i] += effect
 
-            if t < 0 - absorption_delay:
-                continue
-            elif history_event['unit'] == Unit.units:
-                effect = cumulative_bolus_effect_at_time(history_event, t, insulin_sensitivity, insulin_action_curve)
-            elif history_event['unit'] == Unit.units_per_hour:
-                # Cap the time used to determine the sensitivity so it doesn't fluctuate
-                # after completion
-                sensitivity_time = min(effect_end_at, timestamp)
-                insulin_sensitivity = insulin_sensitivity_schedule.at(sensitivity_time.time())['sensitivity']
-
-                effect = cumulative_temp_basal_effect_at_time(
-                    history_event,
-                    t,
-                    t0,
-                    t1,
-                    insulin_sensitivity,
-                    insulin_action_curve
-                )
-            else:
-                continue
+    if completed_effect != 0.0:
+        insulin_effect = [completed_effect + effect for effect in insulin_effect]
 
-            insulin_effect[i] += effect
-
-    return [{
-        'date': timestamp.isoformat(),
-        'amount': insulin_effect[i],
-        'unit': Unit.milligrams_per_deciliter
-    } for i, timestamp in enumerate(simulation_timestamps)]
+    with span('serialize'):
+        return [{
+            'date': timestamp.isoformat(),
+            'amount': insulin_effect[i],
+            'unit': Unit.milligrams_per_deciliter
+        } for i, timestamp in enumerate(simulation_timestamps)]
 
 
+@timed()
 def calculate_iob(
     normalized_history,
     insulin_action_curve,
@@ -554,14 +1246,17 @@ def calculate_iob(
     basal_dosing_end=None,
     start_at=None,
     end_at=None,
-    visual_iob_only=True
+    visual_iob_only=True,
+    integrator=None,
+    insulin_model='walsh'
 ):
-    """Calculates insulin on board degradation according to Walsh's algorithm, from the latest history entry until 0
+    """Calculates insulin on board degradation according to an insulin action model, from the latest history entry
+    until 0
 
     :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
     :type normalized_history: list(dict)
     :param insulin_action_curve: Duration of insulin action for the patient in hours
-    :type insulin_action_curve: int
+    :type insulin_action_curve: float
     :param dt: The time differential for calculation and return value spacing in minutes
     :type dt: int
     :param absorption_delay: The delay time before a dose begins absorption in minutes
@@ -575,10 +1270,14 @@ def calculate_iob(
     :param visual_iob_only: Whether the dose should appear as IOB immediately after delivery rather than waiting for the
                             absorption delay. You might want this to be False if you plan to integrate the area under
                             the resulting curve.
+    :param integrator: The integration strategy for temp basal doses of the Walsh model. Defaults to a Riemann sum
+                       over segments of dt.
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
     :return: A list of IOB values and their timestamps
     :rtype: list(dict)
     """
-    assert insulin_action_curve in (3, 4, 5, 6)
     insulin_duration_minutes = insulin_action_curve * 60.0
 
     if len(normalized_history) == 0:
@@ -599,57 +1298,364 @@ def calculate_iob(
 
     iob = [0.0] * simulation_count
 
-    for history_event in normalized_history:
-        start_at = parse(history_event['start_at'])
-        end_at = parse(history_event['end_at'])
+    model = get_insulin_model(insulin_model, insulin_duration_minutes)
 
-        if history_event['type'] == 'TempBasal' and basal_dosing_end and end_at > basal_dosing_end:
-            end_at = basal_dosing_end
+    # The Walsh model keeps its integrators and native loops. Other models are evaluated in closed form.
+    closed_form = not isinstance(model, WalshInsulinModel)
+
+    # The native loops reproduce the default integrator
+    native = backend.native() and integrator is None and not closed_form
+
+    with span('events'):
+        for history_event in normalized_history:
+            start_at = parse(history_event['start_at'])
+            end_at = parse(history_event['end_at'])
+
+            if history_event['type'] == 'TempBasal' and basal_dosing_end and end_at > basal_dosing_end:
+                end_at = basal_dosing_end
+
+            t0 = 0
+            t1 = (end_at - start_at).total_seconds() / 60.0
+            amount = history_event['amount'] * (t1 - t0) / 60.0
+
+            # Optimize rate-based events as single points in time if their duration is less than dt
+            if history_event['unit'] == Unit.units_per_hour and t1 - t0 <= 1.05 * dt:
+                history_event = {
+                    'type': history_event['type'],
+                    'start_at': start_at,
+                    'end_at': start_at,
+                    'unit': Unit.units,
+                    'amount': history_event['amount'] * (t1 - t0) / 60.0
+                }
+
+            # A dose has no IOB once it has finished acting, so only the timestamps until then are evaluated
+            first, last = timestamp_range(
+                simulation_timestamps,
+                start_at,
+                start_at + datetime.timedelta(minutes=absorption_delay + max(t1, 0) + insulin_duration_minutes)
+            )
+
+            if closed_form and history_event['unit'] in (Unit.units, Unit.units_per_hour):
+                t = numpy.array([
+                    (timestamp - start_at).total_seconds() / 60.0 for timestamp in simulation_timestamps[first:last]
+                ]) - absorption_delay
+
+                if history_event['unit'] == Unit.units:
+                    effects = numpy.where(
+                        numpy.logical_or(visual_iob_only, t >= 0), history_event['amount'] * model.iob(t), 0.0
+                    )
+                else:
+                    # Only the segments of dt delivered by each time contribute, as in `sum_iob`
+                    delivery_delay = absorption_delay if visual_iob_only else 0
+                    delivered_end = numpy.clip(numpy.floor((t + delivery_delay) / dt) * dt + dt, t0, t1)
+                    effects = amount * model.integrated_iob(t0, delivered_end, t) / (t1 - t0)
+
+                for i, effect in zip(range(first, last), effects.tolist()):
+                    iob[i] += effect
 
-        t0 = 0
-        t1 = (end_at - start_at).total_seconds() / 60.0
-        amount = history_event['amount'] * (t1 - t0) / 60.0
-
-        # Optimize rate-based events as single points in time if their duration is less than dt
-        if history_event['unit'] == Unit.units_per_hour and t1 - t0 <= 1.05 * dt:
-            history_event = {
-                'type': history_event['type'],
-                'start_at': start_at,
-                'end_at': start_at,
-                'unit': Unit.units,
-                'amount': history_event['amount'] * (t1 - t0) / 60.0
-            }
-
-        for i, timestamp in enumerate(simulation_timestamps):
-            t = (timestamp - start_at).total_seconds() / 60.0 - absorption_delay
-            effect = 0
-
-            if t < 0 - absorption_delay:
                 continue
-            elif history_event['unit'] == Unit.units:
-                if visual_iob_only or t >= 0:
-                    effect = history_event['amount'] * walsh_iob_curve(t, insulin_duration_minutes)
-            elif history_event['unit'] == Unit.units_per_hour:
-                effect = amount * sum_iob(
-                    t0,
-                    t1,
-                    insulin_duration_minutes,
-                    t,
-                    dt,
-                    absorption_delay=(absorption_delay if visual_iob_only else 0)
-                )
-            else:
+            elif native and history_event['unit'] in (Unit.units, Unit.units_per_hour):
+                t = numpy.array([
+                    (timestamp - start_at).total_seconds() / 60.0 for timestamp in simulation_timestamps[first:last]
+                ]) - absorption_delay
+
+                if history_event['unit'] == Unit.units:
+                    effects = backend.bolus_iob(
+                        t,
+                        float(history_event['amount']),
+                        insulin_duration_minutes,
+                        walsh_iob_curve_coefficients(insulin_duration_minutes),
+                        visual_iob_only
+                    )
+                else:
+                    effects = backend.temp_basal_iob(
+                        t,
+                        float(amount),
+                        float(t1),
+                        insulin_duration_minutes,
+                        walsh_iob_curve_coefficients(insulin_duration_minutes),
+                        float(dt),
+                        float(absorption_delay if visual_iob_only else 0)
+                    )
+
+                for i, effect in zip(range(first, last), effects.tolist()):
+                    iob[i] += effect
+
+                continue
+
+            for i in range(first, last):
+                timestamp = simulation_timestamps[i]
+                t = (timestamp - start_at).total_seconds() / 60.0 - absorption_delay
+                effect = 0
+
+                if t < 0 - absorption_delay:
+                    continue
+                elif history_event['unit'] == Unit.units:
+                    if visual_iob_only or t >= 0:
+                        effect = history_event['amount'] * walsh_iob_curve(t, insulin_duration_minutes)
+                elif history_event['unit'] == Unit.units_per_hour:
+                    effect = amount * sum_iob(
+                        t0,
+                        t1,
+                        insulin_duration_minutes,
+                        t,
+                        dt,
+                        absorption_delay=(absorption_delay if visual_iob_only else 0),
+                        integrator=integrator
+                    )
+                else:
+                    continue
+
+                iob[i] += effect
+
+    with span('serialize'):
+        return [{
+            'date': timestamp.isoformat(),
+            'amount': iob[i],
+            'unit': Unit.units
+        } for i, timestamp in enumerate(simulation_timestamps)]
+
+
+@timed()
+def calculate_iob_and_insulin_effect(
+    normalized_history,
+    insulin_action_curve,
+    insulin_sensitivity_schedule,
+    dt=5,
+    absorption_delay=10,
+    basal_dosing_end=None,
+    start_at=None,
+    end_at=None,
+    visual_iob_only=True,
+    integrator=None,
+    insulin_model='walsh'
+):
+    """Calculates insulin on board and the relative effect of insulin on blood glucose in a single pass over the history
+
+    The results are identical to `calculate_iob` and `calculate_insulin_effect` with the same arguments. History
+    entries are parsed and sensitivities looked up once, and each bolus curve value is shared between both outputs.
+
+    :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param insulin_action_curve: Duration of insulin action for the patient in hours
+    :type insulin_action_curve: float
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_delay: The delay time before a dose begins absorption in minutes
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+    :type basal_dosing_end: datetime.datetime
+    :param start_at: A datetime override at which to begin the output
+    :type start_at: datetime.datetime
+    :param end_at: A datetime override at which to end the output
+    :type end_at: datetime.datetime
+    :param visual_iob_only: Whether the dose should appear as IOB immediately after delivery rather than waiting for the
+                            absorption delay
+    :type visual_iob_only: bool
+    :param integrator: The integration strategy for temp basal doses of the Walsh model. Defaults to a Riemann sum
+                       over segments of dt for IOB, and Simpson's rule over 50 segments for insulin effect.
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :return: A dictionary of the IOB values and relative blood glucose values, each with their timestamps
+    :rtype: dict(str, list(dict))
+    """
+    insulin_action_curve *= 60
+
+    if len(normalized_history) == 0:
+        return {'iob': [], 'insulin_effect': []}
+
+    first_history_event = min(normalized_history, key=lambda e: e['start_at'])
+    last_history_event = max(normalized_history, key=lambda e: e['end_at'])
+    last_history_datetime = ceil_datetime_at_minute_interval(parse(last_history_event['end_at']), dt)
+    simulation_start = start_at or floor_datetime_at_minute_interval(parse(first_history_event['start_at']), dt)
+    simulation_end = end_at or last_history_datetime + datetime.timedelta(
+        minutes=(insulin_action_curve + absorption_delay)
+    )
+
+    simulation_minutes = range(0, int(math.ceil((simulation_end - simulation_start).total_seconds() / 60.0)) + dt, dt)
+    simulation_timestamps = [simulation_start + datetime.timedelta(minutes=m) for m in simulation_minutes]
+    simulation_count = len(simulation_minutes)
+
+    if simulation_count == 0:
+        return {'iob': [], 'insulin_effect': []}
+
+    iob = [0.0] * simulation_count
+    insulin_effect = [0.0] * simulation_count
+    completed_effect = 0.0
+
+    model = get_insulin_model(insulin_model, insulin_action_curve)
+
+    # The Walsh model keeps its integrators. Other models are evaluated in closed form.
+    closed_form = not isinstance(model, WalshInsulinModel)
+
+    with span('events'):
+        for history_event in normalized_history:
+            event_start_at = parse(history_event['start_at'])
+            event_end_at = parse(history_event['end_at'])
+            effect_end_at = event_end_at + datetime.timedelta(minutes=insulin_action_curve)
+
+            insulin_sensitivity = insulin_sensitivity_schedule.at(event_start_at.time())['sensitivity']
+
+            if history_event['type'] == 'TempBasal' and basal_dosing_end and event_end_at > basal_dosing_end:
+                event_end_at = basal_dosing_end
+
+            t0 = 0
+            t1 = (event_end_at - event_start_at).total_seconds() / 60.0
+            amount = history_event['amount'] * (t1 - t0) / 60.0
+            unit = history_event['unit']
+
+            # Optimize rate-based events as single points in time if their duration is less than dt
+            if unit == Unit.units_per_hour and t1 - t0 <= 1.05 * dt:
+                unit = Unit.units
+            elif unit == Unit.units:
+                amount = history_event['amount']
+            elif unit != Unit.units_per_hour:
+                continue
+
+            if event_start_at > simulation_timestamps[-1]:
                 continue
 
-            iob[i] += effect
+            # A dose which finished acting before the simulation start has no IOB, and a constant effect
+            completed_at = max(
+                effect_end_at,
+                event_start_at + datetime.timedelta(minutes=absorption_delay + max(t1, 0) + insulin_action_curve)
+            )
+
+            if simulation_start > completed_at:
+                if unit == Unit.units:
+                    completed_effect += -amount * insulin_sensitivity
+                else:
+                    sensitivity_time = min(effect_end_at, simulation_start)
+                    completed_effect += history_event['amount'] / 60.0 * -insulin_sensitivity_schedule.at(
+                        sensitivity_time.time()
+                    )['sensitivity'] * (t1 - t0)
+                continue
+
+            # Only the timestamps while the dose is acting are evaluated. It has no IOB after that, and its final
+            # effect holds.
+            first, last = timestamp_range(simulation_timestamps, event_start_at, completed_at)
+
+            if closed_form:
+                def model_values(timestamps):
+                    t = numpy.array([
+                        (timestamp - event_start_at).total_seconds() / 60.0 for timestamp in timestamps
+                    ]) - absorption_delay
+
+                    if unit == Unit.units:
+                        iob_fractions = model.iob(t)
+
+                        return (
+                            numpy.where(numpy.logical_or(visual_iob_only, t >= 0), amount * iob_fractions, 0.0),
+                            numpy.where(t >= 0, -amount * insulin_sensitivity * (1 - iob_fractions), 0.0)
+                        )
+
+                    # Only the segments of dt delivered by each time contribute to IOB, as in `sum_iob`
+                    delivery_delay = absorption_delay if visual_iob_only else 0
+                    delivered_end = numpy.clip(numpy.floor((t + delivery_delay) / dt) * dt + dt, t0, t1)
+                    sensitivities = numpy.array([
+                        insulin_sensitivity_schedule.at(min(effect_end_at, timestamp).time())['sensitivity']
+                        for timestamp in timestamps
+                    ], dtype=float)
 
-    return [{
-        'date': timestamp.isoformat(),
-        'amount': iob[i],
-        'unit': Unit.units
-    } for i, timestamp in enumerate(simulation_timestamps)]
+                    return (
+                        amount * model.integrated_iob(t0, delivered_end, t) / (t1 - t0),
+                        temp_basal_effects(history_event, t, t0, t1, sensitivities, model)
+                    )
 
+                event_iob, effects = model_values(simulation_timestamps[first:last])
 
+                for i, value, effect in zip(range(first, last), event_iob.tolist(), effects.tolist()):
+                    iob[i] += value
+                    insulin_effect[i] += effect
+
+                if last < simulation_count:
+                    effect = float(model_values([simulation_timestamps[last]])[1][0])
+
+                    for i in range(last, simulation_count):
+                        insulin_effect[i] += effect
+
+                continue
+
+            for i in range(first, last):
+                timestamp = simulation_timestamps[i]
+                t = (timestamp - event_start_at).total_seconds() / 60.0 - absorption_delay
+
+                if t < 0 - absorption_delay:
+                    continue
+                elif unit == Unit.units:
+                    iob_fraction = walsh_iob_curve(t, insulin_action_curve)
+
+                    if visual_iob_only or t >= 0:
+                        iob[i] += amount * iob_fraction
+
+                    if t >= 0:
+                        insulin_effect[i] += -amount * insulin_sensitivity * (1 - iob_fraction)
+                elif t > t1 + insulin_action_curve:
+                    # Both integrals are zero once the dose has finished acting
+                    sensitivity_time = min(effect_end_at, timestamp)
+                    insulin_effect[i] += history_event['amount'] / 60.0 * -insulin_sensitivity_schedule.at(
+                        sensitivity_time.time()
+                    )['sensitivity'] * (t1 - t0)
+                else:
+                    iob[i] += amount * sum_iob(
+                        t0,
+                        t1,
+                        insulin_action_curve,
+                        t,
+                        dt,
+                        absorption_delay=(absorption_delay if visual_iob_only else 0),
+                        integrator=integrator
+                    )
+
+                    if t >= t0:
+                        sensitivity_time = min(effect_end_at, timestamp)
+                        insulin_effect[i] += cumulative_temp_basal_effect_at_time(
+                            history_event,
+                            t,
+                            t0,
+                            t1,
+                            insulin_sensitivity_schedule.at(sensitivity_time.time())['sensitivity'],
+                            insulin_action_curve,
+                            integrator=integrator
+                        )
+
+            if last < simulation_count:
+                if unit == Unit.units:
+                    effect = -amount * insulin_sensitivity * (1 - walsh_iob_curve(
+                        (simulation_timestamps[last] - event_start_at).total_seconds() / 60.0 - absorption_delay,
+                        insulin_action_curve
+                    ))
+                else:
+                    sensitivity_time = min(effect_end_at, simulation_timestamps[last])
+                    effect = history_event['amount'] / 60.0 * -insulin_sensitivity_schedule.at(
+                        sensitivity_time.time()
+                    )['sensitivity'] * (t1 - t0)
+
+                for i in range(last, simulation_count):
+                    insulin_effect[i] += effect
+
+    if completed_effect != 0.0:
+        insulin_effect = [completed_effect + effect for effect in insulin_effect]
+
+    with span('serialize'):
+        return {
+            'iob': [{
+                'date': timestamp.isoformat(),
+                'amount': iob[i],
+                'unit': Unit.units
+            } for i, timestamp in enumerate(simulation_timestamps)],
+            'insulin_effect': [{
+                'date': timestamp.isoformat(),
+                'amount': insulin_effect[i],
+                'unit': Unit.milligrams_per_deciliter
+            } for i, timestamp in enumerate(simulation_timestamps)]
+        }
+
+
+@timed()
 def calculate_glucose_from_effects(effects, recent_glucose, momentum=()):
     """Calculates predicted glucose values from effect schedules starting from the end of measured glucose history
 
@@ -661,23 +1667,36 @@ def calculate_glucose_from_effects(effects, recent_glucose, momentum=()):
 
     When working with multiple lists, they should have the same dt interval to ensure a smooth output.
 
-    :param effects: A list of lists of timestamps and glucose values, relative to 0, in chronological order
-    :type effects: list(list(dict))
+    :param effects: A list of lists of timestamps and glucose values, relative to 0, in chronological order, or their
+                    series
+    :type effects: list(list(dict)|EffectSeries)
     :param recent_glucose: Historical glucose in reverse-chronological order, cleaned by openapscontrib.glucosetools
-    :type recent_glucose: list(dict)
+    :type recent_glucose: list(dict)|GlucoseSeries
     :param momentum: A list of relative glucose effect values, in chronological order, describing the momentum
     :type momentum: list(dict)
     :return: A list of predicted glucose values
     :rtype: list(dict)
     """
+    recent_glucose = as_glucose_series(recent_glucose)
+
     if len(recent_glucose) == 0:
         return []
 
-    last_glucose_date, last_glucose_value = glucose_data_tuple(recent_glucose[0])
+    last_glucose_date = recent_glucose.dates[0]
+    last_glucose_value = recent_glucose.values[0]
 
     timestamp_to_effect_dict = defaultdict(float)
 
     for effect in effects:
+        if isinstance(effect, EffectSeries):
+            # Compact effects are read as columns, without building an entry for each value
+            steps = numpy.diff(effect.values, prepend=0.0).tolist()
+
+            for date, step in zip(effect.dates, steps):
+                timestamp_to_effect_dict[date] += step
+
+            continue
+
         last_effect_amount = 0
 
         for entry in effect:
@@ -726,6 +1745,7 @@ def calculate_glucose_from_effects(effects, recent_glucose, momentum=()):
     return predicted_glucose
 
 
+@timed()
 def future_glucose(
     normalized_history,
     recent_glucose,
@@ -734,16 +1754,20 @@ def future_glucose(
     carb_ratio_schedule,
     dt=5,
     absorption_delay=10,
-    basal_dosing_end=None
+    basal_dosing_end=None,
+    integrator=None,
+    start_at=None,
+    insulin_model='walsh',
+    carb_model='scheiner'
 ):
     """
 
     :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
     :type normalized_history: list(dict)
     :param recent_glucose: Historical glucose in reverse-chronological order, cleaned by openapscontrib.glucosetools
-    :type recent_glucose: list(dict)
+    :type recent_glucose: list(dict)|GlucoseSeries
     :param insulin_action_curve: Duration of insulin action for the patient
-    :type insulin_action_curve: int
+    :type insulin_action_curve: float
     :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
     :type insulin_sensitivity_schedule: Schedule
     :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
@@ -754,6 +1778,14 @@ def future_glucose(
     :type absorption_delay: int
     :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
     :type basal_dosing_end: datetime.datetime
+    :param integrator: The integration strategy for temp basal doses
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+    :param start_at: A datetime at which to begin simulating effects. Must be on or before the latest glucose entry.
+    :type start_at: datetime.datetime
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
     :return: A list of predicted glucose values
     :rtype: list(dict)
     """
@@ -763,7 +1795,10 @@ def future_glucose(
         insulin_sensitivity_schedule,
         dt=dt,
         absorption_delay=absorption_delay,
-        basal_dosing_end=basal_dosing_end
+        basal_dosing_end=basal_dosing_end,
+        integrator=integrator,
+        start_at=start_at,
+        insulin_model=insulin_model
     )
 
     carb_effect = calculate_carb_effect(
@@ -771,7 +1806,9 @@ def future_glucose(
         carb_ratio_schedule,
         insulin_sensitivity_schedule,
         dt=dt,
-        absorption_delay=absorption_delay
+        absorption_delay=absorption_delay,
+        start_at=start_at,
+        carb_model=carb_model
     )
 
     return calculate_glucose_from_effects([insulin_effect, carb_effect], recent_glucose)
@@ -0,0 +1,153 @@
+"""
+recommend - temp basal recommendations scored against a glucose prediction
+
+The prediction without any new temp basal is computed once. Insulin effect is linear in the dose, so each candidate
+temp basal only adds its own effect to that baseline. The effect of a 1 U/hour temp basal of each duration is computed
+analytically from the integral of the insulin model's curve, and then scaled by every candidate rate. Scoring a grid of
+rates and durations costs one vector operation, instead of one prediction per candidate.
+"""
+import datetime
+from dateutil.parser import parse
+import numpy
+
+from .instrumentation import span
+from .instrumentation import timed
+from .predict import glucose_data_tuple
+from .scenarios import Baseline
+from .scenarios import temp_basal_effect
+
+
+def glucose_outside_range(predicted_glucose, target_range):
+    """Returns the squared distance of predicted glucose values from a target range, summed over time
+
+    :param predicted_glucose: Predicted glucose values, with time along the last axis
+    :type predicted_glucose: numpy.ndarray
+    :param target_range: The low and high target glucose, in mg/dL
+    :type target_range: tuple(float, float)
+    :return: The score of each prediction. Lower is better.
+    :rtype: numpy.ndarray
+    """
+    low, high = target_range
+    below = numpy.maximum(low - predicted_glucose, 0.0)
+    above = numpy.maximum(predicted_glucose - high, 0.0)
+
+    return numpy.sum(below ** 2 + above ** 2, axis=-1)
+
+
+@timed()
+def recommend_temp_basal(
+    normalized_history,
+    recent_glucose,
+    insulin_action_curve,
+    insulin_sensitivity_schedule,
+    carb_ratio_schedule,
+    rates,
+    durations=(30,),
+    target_range=(90, 120),
+    dt=5,
+    absorption_delay=10,
+    basal_dosing_end=None,
+    integrator=None,
+    insulin_model='walsh',
+    carb_model='scheiner'
+):
+    """Scores candidate temp basals by how well they keep predicted glucose within a target range
+
+    Rates are relative to the scheduled basal, like the temp basal amounts in normalized history, so 0 is the
+    scheduled basal itself and a negative rate suspends some of it. Each candidate begins at the latest glucose entry.
+    Setting a temp basal replaces the one running on the pump, so temp basals in the history end there at the latest.
+
+    :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param recent_glucose: Historical glucose in reverse-chronological order, cleaned by openapscontrib.glucosetools
+    :type recent_glucose: list(dict)
+    :param insulin_action_curve: Duration of insulin action for the patient in hours
+    :type insulin_action_curve: float
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
+    :type carb_ratio_schedule: Schedule
+    :param rates: The candidate temp basal rates in U/hour, relative to the scheduled basal
+    :type rates: list(float)
+    :param durations: The candidate temp basal durations in minutes
+    :type durations: list(int)
+    :param target_range: The low and high target glucose, in mg/dL
+    :type target_range: tuple(float, float)
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_delay: The delay to expect between input effects and sensor glucose readings
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled, if before the
+                             latest glucose entry
+    :type basal_dosing_end: datetime.datetime
+    :param integrator: The integration strategy for temp basal doses in the baseline prediction
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
+    :return: The candidates ordered from best to worst, each with its rate, duration, score, and the lowest and final
+             predicted glucose values
+    :rtype: list(dict)
+    """
+    if len(recent_glucose) > 0:
+        # Predicted dates are ordered as strings, so any time zone of the latest glucose entry is ignored
+        last_glucose_datetime = parse(glucose_data_tuple(recent_glucose[0])[0]).replace(tzinfo=None)
+        basal_dosing_end = min(basal_dosing_end or last_glucose_datetime, last_glucose_datetime)
+
+    baseline = Baseline(
+        normalized_history,
+        recent_glucose,
+        insulin_action_curve,
+        insulin_sensitivity_schedule,
+        carb_ratio_schedule,
+        dt=dt,
+        absorption_delay=absorption_delay,
+        basal_dosing_end=basal_dosing_end,
+        integrator=integrator,
+        insulin_model=insulin_model,
+        carb_model=carb_model
+    )
+
+    if len(baseline.prediction) == 0:
+        return []
+
+    with span('deltas'):
+        start_at = baseline.timestamps[0]
+
+        # Each prediction is extended to the end of action of the longest candidate
+        simulation_timestamps, baseline_glucose = baseline.extended(
+            start_at + datetime.timedelta(minutes=max(durations) + insulin_action_curve * 60 + absorption_delay)
+        )
+
+        deltas = numpy.array([
+            temp_basal_effect(
+                simulation_timestamps,
+                start_at,
+                duration,
+                insulin_action_curve * 60,
+                insulin_sensitivity_schedule,
+                absorption_delay=absorption_delay,
+                insulin_model=insulin_model
+            ) for duration in durations
+        ])
+
+    with span('score'):
+        rate_vector = numpy.array(rates, dtype=float)
+
+        # Predictions indexed by rate, duration and time
+        predicted_glucose = baseline_glucose + rate_vector[:, numpy.newaxis, numpy.newaxis] * deltas
+        scores = glucose_outside_range(predicted_glucose, target_range).tolist()
+        lowest = predicted_glucose.min(axis=-1).tolist()
+        eventual = predicted_glucose[:, :, -1].tolist()
+
+    candidates = [{
+        'rate': rate,
+        'duration': duration,
+        'score': scores[i][j],
+        'min_glucose': lowest[i][j],
+        'eventual_glucose': eventual[i][j]
+    } for i, rate in enumerate(rate_vector.tolist()) for j, duration in enumerate(durations)]
+
+    # Prefer the smallest change in delivery among equal scores
+    return sorted(candidates, key=lambda c: (c['score'], abs(c['rate']) * c['duration']))
@@ -0,0 +1,397 @@
+"""
+scenarios - what-if predictions for hypothetical doses and meals
+
+Insulin and carb effects are linear in the doses and meals, so a hypothetical event changes the prediction by its own
+effect alone. A baseline prediction is computed once from the recorded history. The effect of each hypothetical event
+is computed as a vector over the prediction timestamps, and every scenario is then the baseline plus the sum of its
+events' vectors, evaluated together as one matrix product.
+"""
+import datetime
+from dateutil.parser import parse
+import numpy
+
+from .instrumentation import span
+from .instrumentation import timed
+from .models import Unit
+from .carbs import get_carb_model
+from .insulin import get_insulin_model
+from .predict import carb_absorption_time
+from .predict import future_glucose
+
+
+def minutes_since(simulation_timestamps, start_at):
+    """Returns the minutes from a start time to each timestamp
+
+    :param simulation_timestamps: The timestamps
+    :type simulation_timestamps: list(datetime.datetime)
+    :param start_at: The start time
+    :type start_at: datetime.datetime
+    :return: The minutes since the start time
+    :rtype: numpy.ndarray
+    """
+    return numpy.array([(timestamp - start_at).total_seconds() / 60.0 for timestamp in simulation_timestamps])
+
+
+def bolus_effect(simulation_timestamps, start_at, insulin_action_duration, insulin_sensitivity_schedule,
+                 absorption_delay=10, insulin_model='walsh'):
+    """Returns the relative effect on blood glucose of a 1 U bolus at each timestamp
+
+    :param simulation_timestamps: The timestamps at which to calculate the effect
+    :type simulation_timestamps: list(datetime.datetime)
+    :param start_at: The time of the bolus
+    :type start_at: datetime.datetime
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: int
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param absorption_delay: The delay time before a dose begins absorption in minutes
+    :type absorption_delay: int
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :return: The relative effect on blood glucose at each timestamp, in mg/dL
+    :rtype: numpy.ndarray
+    """
+    t = minutes_since(simulation_timestamps, start_at) - absorption_delay
+    insulin_sensitivity = insulin_sensitivity_schedule.at(start_at.time())['sensitivity']
+    model = get_insulin_model(insulin_model, insulin_action_duration)
+
+    return numpy.where(t < 0, 0.0, -insulin_sensitivity * (1 - model.iob(t)))
+
+
+def temp_basal_effect(simulation_timestamps, start_at, duration, insulin_action_duration, insulin_sensitivity_schedule,
+                      absorption_delay=10, insulin_model='walsh'):
+    """Returns the relative effect on blood glucose of a 1 U/hour temp basal at each timestamp
+
+    The sensitivity is taken at each timestamp until the dose has finished acting, as in `calculate_insulin_effect`.
+
+    :param simulation_timestamps: The timestamps at which to calculate the effect
+    :type simulation_timestamps: list(datetime.datetime)
+    :param start_at: The start of the temp basal
+    :type start_at: datetime.datetime
+    :param duration: The duration of the temp basal in minutes
+    :type duration: int
+    :param insulin_action_duration: The duration of insulin action (DIA) of the patient, in minutes
+    :type insulin_action_duration: int
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param absorption_delay: The delay time before a dose begins absorption in minutes
+    :type absorption_delay: int
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :return: The relative effect on blood glucose at each timestamp, in mg/dL
+    :rtype: numpy.ndarray
+    """
+    effect_end_at = start_at + datetime.timedelta(minutes=duration + insulin_action_duration)
+
+    t = minutes_since(simulation_timestamps, start_at) - absorption_delay
+
+    insulin_sensitivities = numpy.array([
+        insulin_sensitivity_schedule.at(min(effect_end_at, timestamp).time())['sensitivity']
+        for timestamp in simulation_timestamps
+    ])
+
+    # The integral of the IOB curve over the delivery, in minutes
+    int_iob = get_insulin_model(insulin_model, insulin_action_duration).integrated_iob(0, duration, t)
+
+    return numpy.where(t < 0, 0.0, -insulin_sensitivities / 60.0 * (duration - int_iob))
+
+
+def meal_effect(simulation_timestamps, start_at, absorption_time, carb_ratio_schedule, insulin_sensitivity_schedule,
+                absorption_delay=10, carb_model='scheiner'):
+    """Returns the relative effect on blood glucose of 1 g of carbohydrates at each timestamp
+
+    :param simulation_timestamps: The timestamps at which to calculate the effect
+    :type simulation_timestamps: list(datetime.datetime)
+    :param start_at: The time of the meal
+    :type start_at: datetime.datetime
+    :param absorption_time: The total absorption time of the carbohydrates in minutes
+    :type absorption_time: int
+    :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
+    :type carb_ratio_schedule: Schedule
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param absorption_delay: The delay time before a meal begins absorption in minutes
+    :type absorption_delay: int
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
+    :return: The relative effect on blood glucose at each timestamp, in mg/dL
+    :rtype: numpy.ndarray
+    """
+    t = minutes_since(simulation_timestamps, start_at) - absorption_delay
+    carb_ratio = carb_ratio_schedule.at(start_at.time())['ratio']
+    insulin_sensitivity = insulin_sensitivity_schedule.at(start_at.time())['sensitivity']
+
+    model = get_carb_model(carb_model, absorption_time)
+
+    return insulin_sensitivity / carb_ratio * model.absorbed(t)
+
+
+class Baseline(object):
+    """A glucose prediction from recorded history, to which the effects of hypothetical events are added
+
+    Keep an instance to evaluate any number of scenarios against the same history without recalculating it.
+    """
+    def __init__(
+        self,
+        normalized_history,
+        recent_glucose,
+        insulin_action_curve,
+        insulin_sensitivity_schedule,
+        carb_ratio_schedule,
+        dt=5,
+        absorption_delay=10,
+        basal_dosing_end=None,
+        integrator=None,
+        insulin_model='walsh',
+        carb_model='scheiner'
+    ):
+        """
+
+        :param normalized_history: History data in reverse-chronological order, normalized by
+                                   openapscontrib.mmhistorytools
+        :type normalized_history: list(dict)
+        :param recent_glucose: Historical glucose in reverse-chronological order, cleaned by openapscontrib.glucosetools
+        :type recent_glucose: list(dict)
+        :param insulin_action_curve: Duration of insulin action for the patient in hours
+        :type insulin_action_curve: float
+        :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+        :type insulin_sensitivity_schedule: Schedule
+        :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
+        :type carb_ratio_schedule: Schedule
+        :param dt: The time differential for calculation and return value spacing in minutes
+        :type dt: int
+        :param absorption_delay: The delay to expect between input effects and sensor glucose readings
+        :type absorption_delay: int
+        :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+        :type basal_dosing_end: datetime.datetime
+        :param integrator: The integration strategy for temp basal doses in the baseline prediction
+        :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+        :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+        :type insulin_model: basestring
+        :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+        :type carb_model: basestring
+        """
+        self.insulin_action_duration = insulin_action_curve * 60
+        self.insulin_model = insulin_model
+        self.carb_model = carb_model
+        self.insulin_sensitivity_schedule = insulin_sensitivity_schedule
+        self.carb_ratio_schedule = carb_ratio_schedule
+        self.dt = dt
+        self.absorption_delay = absorption_delay
+
+        with span('baseline'):
+            self.prediction = future_glucose(
+                normalized_history,
+                recent_glucose,
+                insulin_action_curve,
+                insulin_sensitivity_schedule,
+                carb_ratio_schedule,
+                dt=dt,
+                absorption_delay=absorption_delay,
+                basal_dosing_end=basal_dosing_end,
+                integrator=integrator,
+                insulin_model=insulin_model,
+                carb_model=carb_model
+            )
+
+        # Predicted dates are ordered as strings, so any time zone of the latest glucose entry is ignored
+        self.timestamps = [parse(entry['date']).replace(tzinfo=None) for entry in self.prediction]
+        self.glucose = numpy.array([entry['amount'] for entry in self.prediction])
+
+    def extended(self, end_at):
+        """Returns the prediction timestamps and glucose values, continued at the last value through a time
+
+        Effects of the recorded history are complete by the end of the prediction, so its last value holds after it.
+
+        :param end_at: The time through which to extend the prediction
+        :type end_at: datetime.datetime
+        :return: The timestamps and glucose values
+        :rtype: tuple(list(datetime.datetime), numpy.ndarray)
+        """
+        simulation_timestamps = list(self.timestamps)
+
+        while simulation_timestamps[-1] < end_at:
+            simulation_timestamps.append(simulation_timestamps[-1] + datetime.timedelta(minutes=self.dt))
+
+        glucose = numpy.append(
+            self.glucose,
+            numpy.repeat(self.glucose[-1], len(simulation_timestamps) - len(self.glucose))
+        )
+
+        return simulation_timestamps, glucose
+
+    def event_effect(self, event, simulation_timestamps, absorption_duration=180):
+        """Returns the relative effect on blood glucose of a hypothetical event, from the latest glucose entry
+
+        :param event: A history event in the normalized format, in U, U/hour or g
+        :type event: dict
+        :param simulation_timestamps: The prediction timestamps
+        :type simulation_timestamps: list(datetime.datetime)
+        :param absorption_duration: The absorption time in minutes of meals which don't specify an `absorption_time`
+        :type absorption_duration: int
+        :return: The change in predicted glucose at each timestamp, in mg/dL
+        :rtype: numpy.ndarray
+        """
+        start_at = parse(event['start_at'])
+
+        if event['unit'] == Unit.units:
+            effect = bolus_effect(
+                simulation_timestamps,
+                start_at,
+                self.insulin_action_duration,
+                self.insulin_sensitivity_schedule,
+                absorption_delay=self.absorption_delay,
+                insulin_model=self.insulin_model
+            )
+        elif event['unit'] == Unit.units_per_hour:
+            effect = temp_basal_effect(
+                simulation_timestamps,
+                start_at,
+                (parse(event['end_at']) - start_at).total_seconds() / 60.0,
+                self.insulin_action_duration,
+                self.insulin_sensitivity_schedule,
+                absorption_delay=self.absorption_delay,
+                insulin_model=self.insulin_model
+            )
+        elif event['unit'] == Unit.grams:
+            effect = meal_effect(
+                simulation_timestamps,
+                start_at,
+                carb_absorption_time(event, absorption_duration),
+                self.carb_ratio_schedule,
+                self.insulin_sensitivity_schedule,
+                absorption_delay=self.absorption_delay,
+                carb_model=self.carb_model
+            )
+        else:
+            return numpy.zeros(len(simulation_timestamps))
+
+        # The prediction begins at the latest glucose entry, so only the effect after it changes the prediction
+        return event['amount'] * (effect - effect[0])
+
+    def effect_end_at(self, event, absorption_duration=180):
+        """Returns the time after which a hypothetical event no longer changes blood glucose
+
+        :param event: A history event in the normalized format
+        :type event: dict
+        :param absorption_duration: The absorption time in minutes of meals which don't specify an `absorption_time`
+        :type absorption_duration: int
+        :return: The end of the effect
+        :rtype: datetime.datetime
+        """
+        if event['unit'] == Unit.grams:
+            duration = carb_absorption_time(event, absorption_duration)
+        else:
+            duration = self.insulin_action_duration
+
+        return parse(event['end_at']) + datetime.timedelta(minutes=duration + self.absorption_delay)
+
+    @timed('Baseline.predict')
+    def predict(self, scenarios, absorption_duration=180):
+        """Predicts glucose for each of a list of scenarios
+
+        :param scenarios: A list of scenarios, each a list of hypothetical history events in the normalized format
+        :type scenarios: list(list(dict))
+        :param absorption_duration: The absorption time in minutes of meals which don't specify an `absorption_time`
+        :type absorption_duration: int
+        :return: A list of predicted glucose values for each scenario
+        :rtype: list(list(dict))
+        """
+        if len(self.prediction) == 0:
+            return [[] for _ in scenarios]
+
+        events = [event for scenario in scenarios for event in scenario]
+
+        with span('effects'):
+            end_at = max([self.timestamps[-1]] + [self.effect_end_at(e, absorption_duration) for e in events])
+            simulation_timestamps, glucose = self.extended(end_at)
+
+            effects = numpy.zeros((len(events), len(simulation_timestamps)))
+
+            for i, event in enumerate(events):
+                effects[i] = self.event_effect(event, simulation_timestamps, absorption_duration=absorption_duration)
+
+            # Each row selects the events of one scenario
+            membership = numpy.zeros((len(scenarios), len(events)))
+            offset = 0
+
+            for i, scenario in enumerate(scenarios):
+                membership[i, offset:offset + len(scenario)] = 1.0
+                offset += len(scenario)
+
+        with span('combine'):
+            predictions = (glucose + membership.dot(effects)).tolist()
+
+        with span('serialize'):
+            dates = [entry['date'] for entry in self.prediction]
+            dates += [timestamp.isoformat() for timestamp in simulation_timestamps[len(dates):]]
+
+            return [[{
+                'date': date,
+                'amount': amount,
+                'unit': Unit.milligrams_per_deciliter
+            } for date, amount in zip(dates, prediction)] for prediction in predictions]
+
+
+@timed()
+def predict_scenarios(
+    normalized_history,
+    recent_glucose,
+    insulin_action_curve,
+    insulin_sensitivity_schedule,
+    carb_ratio_schedule,
+    scenarios,
+    dt=5,
+    absorption_duration=180,
+    absorption_delay=10,
+    basal_dosing_end=None,
+    integrator=None,
+    insulin_model='walsh',
+    carb_model='scheiner'
+):
+    """Predicts glucose for each of a list of hypothetical scenarios, such as a meal with or without a bolus
+
+    :param normalized_history: History data in reverse-chronological order, normalized by openapscontrib.mmhistorytools
+    :type normalized_history: list(dict)
+    :param recent_glucose: Historical glucose in reverse-chronological order, cleaned by openapscontrib.glucosetools
+    :type recent_glucose: list(dict)
+    :param insulin_action_curve: Duration of insulin action for the patient in hours
+    :type insulin_action_curve: float
+    :param insulin_sensitivity_schedule: Daily schedule of insulin sensitivity in mg/dL/U
+    :type insulin_sensitivity_schedule: Schedule
+    :param carb_ratio_schedule: Daily schedule of carb sensitivity in g/U
+    :type carb_ratio_schedule: Schedule
+    :param scenarios: A list of scenarios, each a list of hypothetical history events in the normalized format
+    :type scenarios: list(list(dict))
+    :param dt: The time differential for calculation and return value spacing in minutes
+    :type dt: int
+    :param absorption_duration: The absorption time in minutes of meals which don't specify an `absorption_time`
+    :type absorption_duration: int
+    :param absorption_delay: The delay to expect between input effects and sensor glucose readings
+    :type absorption_delay: int
+    :param basal_dosing_end: A datetime at which continuing doses should be assumed to be cancelled
+    :type basal_dosing_end: datetime.datetime
+    :param integrator: The integration strategy for temp basal doses in the baseline prediction
+    :type integrator: FixedSimpson|AdaptiveSimpson|RiemannSum
+    :param insulin_model: The name of the insulin action model in `insulin.insulin_models`
+    :type insulin_model: basestring
+    :param carb_model: The name of the carb absorption model in `carbs.carb_models`
+    :type carb_model: basestring
+    :return: A list of predicted glucose values for each scenario
+    :rtype: list(list(dict))
+    """
+    baseline = Baseline(
+        normalized_history,
+        recent_glucose,
+        insulin_action_curve,
+        insulin_sensitivity_schedule,
+        carb_ratio_schedule,
+        dt=dt,
+        absorption_delay=absorption_delay,
+        basal_dosing_end=basal_dosing_end,
+        integrator=integrator,
+        insulin_model=insulin_model,
+        carb_model=carb_model
+    )
+
+    return baseline.predict(scenarios, absorption_duration=absorption_duration)
@@ -5,7 +5,7 @@ long_description = '''openaps predict plugin
 This package is a vendor plugin for openaps that provides tools for predicting glucose trends.
 '''
 
-requires = ['openaps', 'python-dateutil', 'numpy', 'scipy', 'functools32']
+requires = ['openaps; python_version < "3"', 'python-dateutil', 'numpy>=1.16', 'scipy']
 
 __version__ = None
 exec(open('openapscontrib/predict/version.py').read())
@@ -27,13 +27,15 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
         'Topic :: Documentation',
         'Topic :: Utilities',
     ],
     platforms='any',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     install_requires=requires,
+    extras_require={'numba': ['numba']},
     namespace_packages=['openapscontrib'],
     test_suite='tests'
 )
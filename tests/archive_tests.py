@@ -0,0 +1,187 @@
+from datetime import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from openapscontrib.predict.archive import Archive
+from openapscontrib.predict.archive import isoformat
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import calculate_iob
+from openapscontrib.predict.predict import calculate_momentum_effect
+from tests.predict_tests import get_file_at_path
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'archive')
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            self.normalized_history = json.load(fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty(self):
+        archive = Archive(self.path)
+
+        self.assertEqual(0, len(archive))
+        self.assertListEqual([], archive.history())
+        self.assertListEqual([], archive.glucose())
+
+    def test_isoformat(self):
+        self.assertListEqual(
+            [datetime(2015, 10, 15, 22).isoformat(), datetime(2015, 10, 15, 22, 0, 1, 500).isoformat()],
+            isoformat(numpy.array([1444946400000000, 1444946401000500]))
+        )
+
+    def test_history_round_trip(self):
+        archive = Archive(self.path)
+        archive.append(archive.history_records(self.normalized_history))
+
+        reopened = Archive(self.path)
+
+        self.assertEqual(len(self.normalized_history), len(reopened))
+        self.assertIsInstance(reopened.all_records, numpy.memmap)
+        # Events which start together may be returned in either order
+        order = lambda event: (event['start_at'], event['type'])
+
+        self.assertListEqual(
+            sorted([{key: event[key] for key in ('type', 'start_at', 'end_at', 'amount', 'unit')}
+                    for event in self.normalized_history], key=order),
+            sorted(reopened.history(), key=order)
+        )
+        self.assertListEqual(
+            [event['start_at'] for event in self.normalized_history],
+            [event['start_at'] for event in reopened.history()]
+        )
+
+    def test_append_order(self):
+        archive = Archive(self.path)
+        records = archive.history_records(self.normalized_history)
+
+        # History is reverse-chronological, and each batch is sorted before it's appended
+        archive.append(records[:10])
+
+        with self.assertRaises(ValueError):
+            archive.append(records[10:])
+
+        self.assertEqual(10, len(Archive(self.path)))
+
+        archive = Archive(os.path.join(self.directory, 'ordered'))
+        archive.append(records[10:])
+        archive.append(records[:10])
+
+        self.assertEqual(len(records), len(archive))
+        self.assertTrue(numpy.all(numpy.diff(archive.all_records['start']) >= 0))
+
+    def test_incomplete_append_is_discarded(self):
+        archive = Archive(self.path)
+        records = archive.history_records(self.normalized_history)
+        archive.append(records[5:])
+
+        # Bytes written without an index update, as if interrupted
+        with open(archive.data_path, 'ab') as fp:
+            fp.write(records[:5].tobytes()[:30])
+
+        reopened = Archive(self.path)
+        reopened.append(records[:5])
+
+        self.assertEqual(len(records) * records.itemsize, os.path.getsize(archive.data_path))
+        self.assertListEqual(
+            numpy.sort(records, order='start', kind='mergesort').tolist(),
+            Archive(self.path).all_records.tolist()
+        )
+
+    def test_slices(self):
+        archive = Archive(self.path)
+        archive.append(archive.history_records(self.normalized_history))
+        start = datetime(2015, 10, 15, 20)
+        end = datetime(2015, 10, 15, 21)
+
+        records = archive.records(start, end)
+
+        self.assertIs(archive.all_records, records.base)
+        self.assertListEqual(
+            sorted(e['start_at'] for e in self.normalized_history
+                   if start.isoformat() <= e['start_at'] <= end.isoformat()),
+            isoformat(records['start'])
+        )
+
+        # Overlapping events include those which began before the range
+        self.assertListEqual(
+            [e['start_at'] for e in self.normalized_history
+             if e['end_at'] >= start.isoformat() and e['start_at'] <= end.isoformat()],
+            [e['start_at'] for e in archive.history(start, end)]
+        )
+
+    def test_calculators_read_slices(self):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path('fixtures/effect_from_history_output.json')) as fp:
+            expected = json.load(fp)
+
+        archive = Archive(self.path)
+        archive.append(archive.history_records(self.normalized_history))
+
+        self.assertListEqual(expected, calculate_insulin_effect(archive.history(), 4, insulin_sensitivities))
+        self.assertListEqual(calculate_iob(self.normalized_history, 4), calculate_iob(archive.history(), 4))
+
+    def test_glucose(self):
+        with open(get_file_at_path('fixtures/momentum_effect_rising_glucose_input.json')) as fp:
+            glucose = json.load(fp)
+
+        with open(get_file_at_path('fixtures/momentum_effect_rising_glucose_output.json')) as fp:
+            output = json.load(fp)
+
+        with open(get_file_at_path('fixtures/cgms_calibrations.json')) as fp:
+            calibrations = json.load(fp)
+
+        archive = Archive(self.path)
+        archive.append(archive.glucose_records(glucose))
+        archive.append(archive.glucose_records(calibrations, 'Calibration')[-1:])
+
+        self.assertListEqual(output, calculate_momentum_effect(Archive(self.path).glucose()))
+        self.assertListEqual(
+            [glucose[0]['date']],
+            [entry['date'] for entry in archive.glucose(start=glucose[0]['date'])]
+        )
+        self.assertEqual(1, len(archive.glucose(event_type='Calibration')))
+        self.assertListEqual([], archive.glucose(event_type='Sensor'))
+
+    def test_replace_tail(self):
+        archive = Archive(self.path)
+        records = numpy.sort(archive.history_records(self.normalized_history), order='start', kind='mergesort')
+        archive.append(records[:-5])
+
+        revised = records[-10:].copy()
+        revised['amount'] = 0
+        archive.replace_tail(len(records) - 10, revised)
+
+        self.assertEqual(len(records), len(Archive(self.path)))
+        self.assertListEqual(records[:-10].tolist(), Archive(self.path).all_records[:-10].tolist())
+        self.assertListEqual(revised.tolist(), Archive(self.path).all_records[-10:].tolist())
+
+        with self.assertRaises(ValueError):
+            archive.replace_tail(len(records) - 5, records[:5])
+
+    def test_interrupted_replacement_is_applied(self):
+        archive = Archive(self.path)
+        records = numpy.sort(archive.history_records(self.normalized_history), order='start', kind='mergesort')
+        archive.append(records[:-5])
+
+        # A journal written without being applied, as if interrupted
+        with open(archive.journal_path, 'wb') as fp:
+            fp.write(numpy.array([len(records) - 10], dtype='<i8').tobytes())
+            fp.write(records[-10:].tobytes())
+
+        reopened = Archive(self.path)
+
+        self.assertFalse(os.path.exists(archive.journal_path))
+        self.assertListEqual(records.tolist(), reopened.all_records.tolist())
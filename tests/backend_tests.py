@@ -0,0 +1,113 @@
+from datetime import datetime
+import json
+import unittest
+
+import numpy
+
+from openapscontrib.predict import backend
+from openapscontrib.predict import instrumentation
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_carb_effect
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import calculate_iob
+from openapscontrib.predict.predict import carb_effect_curves
+from openapscontrib.predict.predict import walsh_iob_curves
+from tests.predict_tests import get_file_at_path
+
+
+class BackendTestCase(unittest.TestCase):
+    def test_available(self):
+        self.assertIn(backend.NUMPY, backend.available())
+        self.assertIn(backend.name, backend.available())
+
+    def test_use(self):
+        name = backend.name
+
+        try:
+            backend.use(backend.NUMPY)
+            self.assertFalse(backend.native())
+            self.assertRaises(ValueError, backend.use, 'fortran')
+        finally:
+            backend.name = name
+
+    def test_report(self):
+        self.assertEqual(backend.name, instrumentation.recorder.report()['backend'])
+
+
+class NativeParityTestCase(unittest.TestCase):
+    """Runs the kernels against the NumPy and pure Python paths on the fixtures
+
+    Without numba, the kernels run uncompiled, which checks they reproduce the Python implementations.
+    """
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+        with open(get_file_at_path("fixtures/normalized_reservoir_history_output.json")) as fp:
+            cls.reservoir_history = json.load(fp)
+
+        with open(get_file_at_path("fixtures/carb_effect_from_history_input.json")) as fp:
+            cls.carb_history = json.load(fp)
+
+    def setUp(self):
+        self.name = backend.name
+
+    def tearDown(self):
+        backend.name = self.name
+
+    def native(self, f, *args, **kwargs):
+        backend.name = backend.NUMPY
+        expected = f(*args, **kwargs)
+        backend.name = backend.NUMBA
+        return expected, f(*args, **kwargs)
+
+    def assertEffectsAlmostEqual(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+
+        for e, a in zip(expected, actual):
+            self.assertEqual(e['date'], a['date'])
+            self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_curves(self):
+        t = numpy.linspace(-20, 400, 300).reshape(20, 15)
+
+        for insulin_action_duration in (180, 240, 300, 360):
+            expected, actual = self.native(walsh_iob_curves, t, insulin_action_duration)
+            numpy.testing.assert_allclose(expected, actual, rtol=0, atol=1e-12)
+
+        expected, actual = self.native(carb_effect_curves, t, 180)
+        numpy.testing.assert_allclose(expected, actual, rtol=0, atol=1e-12)
+
+    def test_insulin_effect(self):
+        for history in (self.normalized_history, self.reservoir_history):
+            for insulin_action_curve in (3, 4, 6):
+                self.assertEffectsAlmostEqual(*self.native(
+                    calculate_insulin_effect, history, insulin_action_curve, self.insulin_sensitivities
+                ))
+
+        self.assertEffectsAlmostEqual(*self.native(
+            calculate_insulin_effect,
+            self.normalized_history,
+            4,
+            self.insulin_sensitivities,
+            basal_dosing_end=datetime(2015, 10, 15, 20)
+        ))
+
+    def test_iob(self):
+        for history in (self.normalized_history, self.reservoir_history):
+            for visual_iob_only in (True, False):
+                self.assertEffectsAlmostEqual(*self.native(
+                    calculate_iob, history, 4, visual_iob_only=visual_iob_only
+                ))
+
+    def test_carb_effect(self):
+        self.assertEffectsAlmostEqual(*self.native(
+            calculate_carb_effect, self.carb_history, self.carb_ratios, self.insulin_sensitivities
+        ))
@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from openapscontrib.predict.backtest import CACHE_SIZE
+from openapscontrib.predict.backtest import _json_files
+from openapscontrib.predict.backtest import backtest
+from openapscontrib.predict.backtest import backtest_snapshot
+from openapscontrib.predict.backtest import load_json
+from openapscontrib.predict.backtest import load_manifest
+from openapscontrib.predict.backtest import load_schedule
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import future_glucose
+from tests.predict_tests import get_file_at_path
+
+
+class BacktestTestCase(unittest.TestCase):
+    glucose_dates = ('2015-10-15T21:00:00', '2015-10-15T21:30:00', '2015-10-15T22:00:00')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshots = []
+
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            normalized_history = json.load(fp)
+
+        self.actual_glucose = []
+
+        for i, date in enumerate(self.glucose_dates):
+            glucose = [{'date': date, 'sgv': 150}]
+            filename = 'glucose_{}.json'.format(i)
+
+            with open(os.path.join(self.directory, filename), 'w') as fp:
+                json.dump(glucose, fp)
+
+            self.snapshots.append({
+                'history': get_file_at_path("fixtures/normalize_history.json"),
+                'glucose': filename,
+                'insulin_action_curve': 4,
+                'insulin_sensitivities': get_file_at_path("fixtures/read_insulin_sensitivies.json"),
+                'carb_ratios': get_file_at_path("fixtures/read_carb_ratios.json")
+            })
+
+        # The recorded glucose follows the prediction of the first snapshot exactly
+        self.actual_glucose = future_glucose(
+            normalized_history, [{'date': self.glucose_dates[0], 'sgv': 150}], 4, insulin_sensitivities, carb_ratios
+        )
+
+        self.manifest = os.path.join(self.directory, 'snapshots.json')
+
+        with open(self.manifest, 'w') as fp:
+            json.dump(self.snapshots, fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_inputs(self):
+        path = get_file_at_path("fixtures/read_carb_ratios.json")
+
+        self.assertIs(load_json(path), load_json(path))
+        self.assertIs(load_schedule(path, 'schedule'), load_schedule(path, 'schedule'))
+
+    def test_cache_is_bounded(self):
+        paths = []
+
+        for i in range(CACHE_SIZE + 4):
+            paths.append(os.path.join(self.directory, 'settings_{}.json'.format(i)))
+
+            with open(paths[-1], 'w') as fp:
+                json.dump({'insulin_action_curve': i}, fp)
+
+            load_json(paths[-1])
+
+        self.assertEqual(CACHE_SIZE, len(_json_files))
+
+        # A changed file replaces its entry
+        settings = load_json(paths[-1])
+        os.utime(paths[-1], (0, 0))
+
+        self.assertIsNot(settings, load_json(paths[-1]))
+        self.assertEqual(CACHE_SIZE, len(_json_files))
+
+    def test_snapshot_inputs_are_not_cached(self):
+        backtest_snapshot(load_manifest(self.manifest)[0], horizons=(30,))
+
+        self.assertNotIn(
+            os.path.abspath(load_manifest(self.manifest)[0]['history']),
+            [path for path, key in _json_files]
+        )
+
+    def test_snapshot(self):
+        snapshot = load_manifest(self.manifest)[0]
+        result = backtest_snapshot(snapshot, horizons=(0, 30, 600))
+        expected = {entry['date']: entry['amount'] for entry in self.actual_glucose}
+
+        self.assertEqual('2015-10-15T21:00:00', result['date'])
+        self.assertEqual(150.0, result['predicted'][0])
+        self.assertAlmostEqual(expected['2015-10-15T21:30:00'], result['predicted'][30], places=9)
+        self.assertAlmostEqual(self.actual_glucose[-1]['amount'], result['predicted'][600], places=9)
+        self.assertSetEqual(
+            {'parse', 'insulin_effect', 'carb_effect', 'glucose_from_effects'}, set(result['timings'].keys())
+        )
+
+    def test_perfect_prediction(self):
+        summary = backtest(
+            load_manifest(self.manifest)[:1], actual_glucose=self.actual_glucose, horizons=(30, 60, 120), processes=1
+        )
+
+        self.assertEqual(1, summary['snapshots'])
+        self.assertListEqual([], summary['errors'])
+
+        for horizon in ('30', '60', '120'):
+            self.assertEqual(1, summary['horizons'][horizon]['count'])
+            self.assertAlmostEqual(0.0, summary['horizons'][horizon]['rmse'], places=9)
+
+    def test_process_pool_matches_serial(self):
+        snapshots = load_manifest(self.manifest)
+        snapshots.append(dict(snapshots[0], glucose=os.path.join(self.directory, 'missing.json')))
+
+        serial = backtest(snapshots, actual_glucose=self.actual_glucose, processes=1)
+        pooled = backtest(snapshots, actual_glucose=self.actual_glucose, processes=2)
+
+        self.assertDictEqual(serial['horizons'], pooled['horizons'])
+        self.assertEqual(4, pooled['snapshots'])
+        self.assertListEqual([3], [error['snapshot'] for error in pooled['errors']])
+        self.assertSetEqual(
+            {'parse', 'insulin_effect', 'carb_effect', 'glucose_from_effects'}, set(pooled['stages'].keys())
+        )
+
+    def test_default_actual_glucose(self):
+        summary = backtest(load_manifest(self.manifest), horizons=(30,), processes=1)
+
+        # Each snapshot's glucose is recorded 30 minutes after the previous one
+        self.assertEqual(2, summary['horizons']['30']['count'])
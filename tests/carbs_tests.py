@@ -0,0 +1,136 @@
+import json
+import unittest
+
+import numpy
+
+from openapscontrib.predict.carbs import BilinearCarbModel
+from openapscontrib.predict.carbs import ScheinerCarbModel
+from openapscontrib.predict.carbs import carb_models
+from openapscontrib.predict.carbs import get_carb_model
+from openapscontrib.predict.convolution import carb_effect_kernel
+from openapscontrib.predict.convolution import convolve_carb_effect
+from openapscontrib.predict.convolution import convolve_cob
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_carb_effect
+from openapscontrib.predict.predict import calculate_cob
+from openapscontrib.predict.predict import calculate_cob_and_carb_effect
+from openapscontrib.predict.predict import carb_effect_curve
+from tests.predict_tests import get_file_at_path
+
+
+class CarbModelTestCase(unittest.TestCase):
+    def test_registry(self):
+        self.assertListEqual(['scheiner', 'linear', 'parabolic', 'bilinear'], list(carb_models))
+        self.assertIsInstance(get_carb_model('scheiner', 180), ScheinerCarbModel)
+
+        with self.assertRaises(ValueError):
+            get_carb_model('exponential', 180)
+
+        with self.assertRaises(ValueError):
+            get_carb_model('linear', 0)
+
+    def test_curves(self):
+        t = numpy.arange(-10, 201, 0.5)
+
+        for name in carb_models:
+            absorbed = get_carb_model(name, 180).absorbed(t)
+
+            self.assertEqual(0.0, absorbed[0])
+            self.assertAlmostEqual(0.0, get_carb_model(name, 180).absorbed(0.0), places=12)
+            self.assertAlmostEqual(1.0, get_carb_model(name, 180).absorbed(180.0), places=12)
+            self.assertEqual(1.0, absorbed[-1])
+            self.assertTrue(numpy.all(numpy.diff(absorbed) >= 0), name)
+
+            # Each curve is continuous, with a rate no higher than twice the mean
+            self.assertLessEqual(numpy.diff(absorbed).max(), 2 * 0.5 / 180 + 1e-12, name)
+
+    def test_scheiner_matches_curve(self):
+        t = numpy.arange(-10, 200, 2.5)
+
+        self.assertListEqual(
+            [carb_effect_curve(x, 180) for x in t],
+            get_carb_model('scheiner', 180).absorbed(t).tolist()
+        )
+
+    def test_bilinear_rate(self):
+        model = BilinearCarbModel(100)
+        rate = numpy.diff(model.absorbed(numpy.arange(0, 101, 1.0)))
+
+        # The rate holds at its peak from 15% to 50% of the absorption time
+        self.assertTrue(numpy.allclose(2.0 / 1.35 / 100, rate[15:50]))
+        self.assertLess(rate[0], rate[14])
+        self.assertGreater(rate[50], rate[99])
+
+    def test_kernels(self):
+        for name in carb_models:
+            kernel = carb_effect_kernel(180, 5, 10, name)
+
+            self.assertIs(kernel, carb_effect_kernel(180, 5, 10, name))
+            self.assertEqual(0.0, kernel[2])
+            self.assertEqual(1.0, kernel[-1])
+            self.assertListEqual(
+                get_carb_model(name, 180).absorbed(numpy.arange(len(kernel)) * 5.0 - 10).tolist(), kernel.tolist()
+            )
+
+
+class CalculatorCarbModelTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/carb_effect_from_history_input.json")) as fp:
+            cls.history = json.load(fp)
+
+    def test_linear_meal(self):
+        normalized_history = [
+            {
+                "type": "Meal",
+                "start_at": "2015-07-15T14:30:00",
+                "end_at": "2015-07-15T14:30:00",
+                "amount": 9,
+                "unit": "g"
+            }
+        ]
+
+        effect = calculate_carb_effect(
+            normalized_history, self.carb_ratios, self.insulin_sensitivities, carb_model='linear'
+        )
+        cob = calculate_cob(normalized_history, carb_model='linear')
+
+        self.assertDictEqual({'date': '2015-07-15T14:40:00', 'amount': 0.0, 'unit': 'mg/dL'}, effect[2])
+        self.assertAlmostEqual(40.0 / 180 * 90, effect[20]['amount'], places=12)
+        self.assertDictEqual({'date': '2015-07-15T17:40:00', 'amount': 40.0, 'unit': 'mg/dL'}, effect[-1])
+        self.assertAlmostEqual(4.5, cob[20]['amount'], places=12)
+        self.assertEqual(0.0, cob[-1]['amount'])
+
+    def test_combined_matches_separate_calculators(self):
+        for name in carb_models:
+            result = calculate_cob_and_carb_effect(
+                self.history, self.carb_ratios, self.insulin_sensitivities, carb_model=name
+            )
+
+            self.assertListEqual(
+                calculate_carb_effect(self.history, self.carb_ratios, self.insulin_sensitivities, carb_model=name),
+                result['carb_effect']
+            )
+            self.assertListEqual(calculate_cob(self.history, carb_model=name), result['cob'])
+
+    def test_convolution_matches_calculator(self):
+        for name in carb_models:
+            effect = calculate_carb_effect(
+                self.history, self.carb_ratios, self.insulin_sensitivities, carb_model=name
+            )
+            convolved = convolve_carb_effect(
+                self.history, self.carb_ratios, self.insulin_sensitivities, carb_model=name
+            )
+
+            self.assertListEqual([e['date'] for e in effect], [c['date'] for c in convolved])
+            self.assertAlmostEqual(effect[-1]['amount'], convolved[-1]['amount'], places=9)
+
+            convolved_cob = convolve_cob(self.history, carb_model=name)
+
+            self.assertAlmostEqual(0.0, convolved_cob[-1]['amount'], places=9)
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from openapscontrib.predict import compact
+from openapscontrib.predict.predict import EffectSeries
+from openapscontrib.predict.predict import as_effect_series
+from openapscontrib.predict.predict import calculate_glucose_from_effects
+from tests.predict_tests import get_file_at_path
+
+
+class CompactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        with open(get_file_at_path('fixtures/glucose_from_effects_carb_effect_input.json')) as fp:
+            self.carb_effect = json.load(fp)
+
+        with open(get_file_at_path('fixtures/glucose_from_effects_insulin_effect_input.json')) as fp:
+            self.insulin_effect = json.load(fp)
+
+        with open(get_file_at_path('fixtures/glucose_from_effects_glucose_input.json')) as fp:
+            self.glucose = json.load(fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, effect):
+        path = os.path.join(self.directory, name)
+
+        with open(path, 'wb') as fp:
+            fp.write(compact.dumps(effect))
+
+        return path
+
+    def test_round_trip(self):
+        for name in ('iob.json', 'carbs_on_board_output.json', 'momentum_effect_rising_glucose_output.json'):
+            with open(get_file_at_path('fixtures/' + name)) as fp:
+                effect = json.load(fp)
+
+            path = self.write(name, effect)
+            series = compact.load(path)
+
+            self.assertTrue(compact.is_compact(path))
+            self.assertFalse(compact.is_compact(get_file_at_path('fixtures/' + name)))
+            self.assertEqual(300, series.dt)
+            self.assertListEqual(effect, list(series))
+
+    def test_size(self):
+        with open(get_file_at_path('fixtures/iob.json')) as fp:
+            effect = json.load(fp)
+
+        # The archive has a fixed overhead of about 1KB, then 8 bytes per value
+        self.assertLess(os.path.getsize(self.write('iob', effect)), len(json.dumps(effect)) / 4)
+
+    def test_empty(self):
+        self.assertListEqual([], list(compact.load(self.write('empty', []))))
+
+    def test_uneven_dates(self):
+        with open(get_file_at_path('fixtures/glucose_from_effects_no_momentum_output.json')) as fp:
+            glucose = json.load(fp)
+
+        self.assertRaises(ValueError, as_effect_series, glucose)
+        self.assertRaises(ValueError, as_effect_series, self.carb_effect[:2] + self.carb_effect[3:])
+
+    def test_mixed_units(self):
+        effect = self.carb_effect[:2] + [dict(self.carb_effect[2], unit='g')]
+
+        self.assertRaises(ValueError, as_effect_series, effect)
+
+    def test_glucose_from_effects(self):
+        carb_effect = compact.load(self.write('carb_effect', self.carb_effect))
+        insulin_effect = compact.load(self.write('insulin_effect', self.insulin_effect))
+
+        self.assertIsInstance(carb_effect, EffectSeries)
+        self.assertListEqual(
+            calculate_glucose_from_effects([self.carb_effect, self.insulin_effect], self.glucose),
+            calculate_glucose_from_effects([carb_effect, insulin_effect], self.glucose)
+        )
+        self.assertListEqual(
+            calculate_glucose_from_effects([self.carb_effect, self.insulin_effect], self.glucose),
+            calculate_glucose_from_effects([carb_effect, self.insulin_effect], self.glucose)
+        )
@@ -0,0 +1,318 @@
+from datetime import datetime
+import json
+import unittest
+
+import numpy
+
+from openapscontrib.predict import convolution
+from openapscontrib.predict.convolution import carb_effect_kernel
+from openapscontrib.predict.convolution import convolve_carb_effect
+from openapscontrib.predict.convolution import convolve_cob
+from openapscontrib.predict.convolution import convolve_cumulative
+from openapscontrib.predict.convolution import convolve_insulin_effect
+from openapscontrib.predict.convolution import insulin_effect_kernel
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_carb_effect
+from openapscontrib.predict.predict import calculate_cob
+from openapscontrib.predict.predict import calculate_insulin_effect
+from tests.predict_tests import get_file_at_path
+
+
+class ConvolutionTestCase(unittest.TestCase):
+    def test_kernel_is_cached(self):
+        kernel = insulin_effect_kernel(240, 5, 10)
+
+        self.assertIs(kernel, insulin_effect_kernel(240, 5, 10))
+        self.assertEqual(0.0, kernel[0])
+        self.assertEqual(0.0, kernel[2])
+        self.assertEqual(1.0, kernel[-1])
+        self.assertEqual(51, len(kernel))
+
+    def test_fft_matches_direct(self):
+        values = numpy.random.RandomState(0).normal(size=2000)
+        kernel = insulin_effect_kernel(360, 5, 10)
+
+        direct = numpy.cumsum(numpy.convolve(values, numpy.diff(kernel, prepend=0.0))[:len(values)])
+        threshold = convolution.FFT_THRESHOLD
+
+        try:
+            convolution.FFT_THRESHOLD = 0
+            numpy.testing.assert_allclose(direct, convolve_cumulative(values, kernel), atol=1e-9)
+        finally:
+            convolution.FFT_THRESHOLD = threshold
+
+
+class EffectTestCase(unittest.TestCase):
+    def assertEffectsAlmostEqual(self, expected, actual, delta):
+        self.assertEqual(len(expected), len(actual))
+
+        for e, a in zip(expected, actual):
+            self.assertEqual(e['date'], a['date'])
+            self.assertEqual(e['unit'], a['unit'])
+            self.assertAlmostEqual(e['amount'], a['amount'], delta=delta)
+
+
+class ConvolveInsulinEffectTestCase(EffectTestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+    def test_no_input_history(self):
+        self.assertListEqual([], convolve_insulin_effect([], 4, self.insulin_sensitivities))
+
+    def test_single_bolus_on_grid(self):
+        normalized_history = [
+            {
+                "type": "Bolus",
+                "start_at": "2015-07-13T12:00:00",
+                "end_at": "2015-07-13T12:00:00",
+                "amount": 1.5,
+                "unit": "U"
+            }
+        ]
+
+        self.assertEffectsAlmostEqual(
+            calculate_insulin_effect(normalized_history, 4, self.insulin_sensitivities),
+            convolve_insulin_effect(normalized_history, 4, self.insulin_sensitivities),
+            1e-9
+        )
+
+    def test_single_bolus(self):
+        with open(get_file_at_path('fixtures/effect_from_bolus_output.json')) as fp:
+            expected = json.load(fp)
+
+        effect = convolve_insulin_effect(
+            [
+                {
+                    "type": "Bolus",
+                    "start_at": "2015-07-13T12:01:32",
+                    "end_at": "2015-07-13T12:01:32",
+                    "amount": 1.5,
+                    "unit": "U"
+                }
+            ],
+            4,
+            self.insulin_sensitivities
+        )
+
+        self.assertEffectsAlmostEqual(expected, effect, 0.5)
+        self.assertEqual(-60.0, effect[-1]['amount'])
+
+    def test_square_bolus(self):
+        with open(get_file_at_path('fixtures/effect_from_square_bolus_output.json')) as fp:
+            expected = json.load(fp)
+
+        effect = convolve_insulin_effect(
+            [
+                {
+                    "type": "Bolus",
+                    "start_at": "2015-07-13T12:00:00",
+                    "end_at": "2015-07-13T13:00:00",
+                    "amount": 1.0,
+                    "unit": "U/hour"
+                }
+            ],
+            4,
+            self.insulin_sensitivities
+        )
+
+        # The fixed Simpson series under-counts undelivered insulin by 4/3 of a segment, about 1.07 mg/dL here
+        self.assertEffectsAlmostEqual(expected, effect, 1.2)
+        self.assertEqual(0.0, effect[2]['amount'])
+
+    def test_basal_dosing_end(self):
+        effect = convolve_insulin_effect(
+            [
+                {
+                    "type": "TempBasal",
+                    "start_at": "2015-07-13T12:00:00",
+                    "end_at": "2015-07-13T13:00:00",
+                    "amount": 1.0,
+                    "unit": "U/hour"
+                }
+            ],
+            4,
+            self.insulin_sensitivities,
+            basal_dosing_end=datetime(2015, 7, 13, 12, 30)
+        )
+
+        self.assertAlmostEqual(-20.0, effect[-1]['amount'])
+
+    def test_sensitivity_boundary(self):
+        insulin_sensitivities = Schedule([
+            {"start": "00:00:00", "offset": 0, "sensitivity": 40},
+            {"start": "12:30:00", "offset": 750, "sensitivity": 60}
+        ])
+        temp_basal = {
+            "type": "TempBasal",
+            "start_at": "2015-07-13T12:00:00",
+            "end_at": "2015-07-13T13:00:00",
+            "amount": 1.0,
+            "unit": "U/hour"
+        }
+        bolus = {
+            "type": "Bolus",
+            "start_at": "2015-07-13T12:15:00",
+            "end_at": "2015-07-13T12:15:00",
+            "amount": 1.0,
+            "unit": "U"
+        }
+
+        # Each half hour of the temp basal is weighted by the sensitivity when it's delivered
+        effect = convolve_insulin_effect([temp_basal], 4, insulin_sensitivities)
+        self.assertAlmostEqual(-50.0, effect[-1]['amount'])
+
+        # The event engine weights all of it by the sensitivity at the end of its action
+        expected = calculate_insulin_effect([temp_basal], 4, insulin_sensitivities)
+        self.assertAlmostEqual(-60.0, expected[-1]['amount'])
+
+        # A bolus is weighted by the sensitivity at its start by both
+        self.assertEffectsAlmostEqual(
+            calculate_insulin_effect([bolus], 4, insulin_sensitivities),
+            convolve_insulin_effect([bolus], 4, insulin_sensitivities),
+            0.5
+        )
+        self.assertAlmostEqual(-40.0, convolve_insulin_effect([bolus], 4, insulin_sensitivities)[-1]['amount'])
+
+    def test_complicated_history(self):
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            normalized_history = json.load(fp)
+
+        with open(get_file_at_path('fixtures/effect_from_history_output.json')) as fp:
+            expected = json.load(fp)
+
+        effect = convolve_insulin_effect(normalized_history, 4, self.insulin_sensitivities)
+
+        self.assertEffectsAlmostEqual(expected, effect, 2.5)
+        self.assertAlmostEqual(expected[-1]['amount'], effect[-1]['amount'], places=9)
+
+    def test_start_at_end_at(self):
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            normalized_history = json.load(fp)
+
+        start_at = datetime(2015, 10, 15, 19, 2)
+        end_at = datetime(2015, 10, 15, 21, 0)
+
+        self.assertEffectsAlmostEqual(
+            calculate_insulin_effect(
+                normalized_history, 4, self.insulin_sensitivities, start_at=start_at, end_at=end_at
+            ),
+            convolve_insulin_effect(
+                normalized_history, 4, self.insulin_sensitivities, start_at=start_at, end_at=end_at
+            ),
+            2.5
+        )
+
+    def test_float32(self):
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            normalized_history = json.load(fp)
+
+        for insulin_action_curve in (3, 4, 6):
+            self.assertEffectsAlmostEqual(
+                convolve_insulin_effect(normalized_history, insulin_action_curve, self.insulin_sensitivities),
+                convolve_insulin_effect(
+                    normalized_history, insulin_action_curve, self.insulin_sensitivities, dtype=numpy.float32
+                ),
+                5e-4
+            )
+
+
+class ConvolveCarbsTestCase(EffectTestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/carb_effect_from_history_input.json")) as fp:
+            cls.history = json.load(fp)
+
+    def test_kernel_is_cached(self):
+        kernel = carb_effect_kernel(180, 5, 10)
+
+        self.assertIs(kernel, carb_effect_kernel(180, 5, 10))
+        self.assertEqual(0.0, kernel[2])
+        self.assertEqual(1.0, kernel[-1])
+
+    def test_no_input_history(self):
+        self.assertListEqual([], convolve_carb_effect([], self.carb_ratios, self.insulin_sensitivities))
+        self.assertListEqual([], convolve_cob([]))
+
+    def test_carb_effect(self):
+        with open(get_file_at_path("fixtures/carb_effect_from_history_output.json")) as fp:
+            expected = json.load(fp)
+
+        effect = convolve_carb_effect(self.history, self.carb_ratios, self.insulin_sensitivities)
+
+        self.assertEffectsAlmostEqual(expected, effect, 0.5)
+        self.assertAlmostEqual(expected[-1]['amount'], effect[-1]['amount'], places=9)
+
+    def test_cob(self):
+        with open(get_file_at_path("fixtures/carbs_on_board_output.json")) as fp:
+            expected = json.load(fp)
+
+        cob = convolve_cob(self.history)
+
+        self.assertEffectsAlmostEqual(expected, cob, 0.1)
+        self.assertAlmostEqual(0.0, cob[-1]['amount'], places=9)
+        self.assertEqual(0.0, cob[0]['amount'])
+        self.assertEqual(30.0, cob[1]['amount'])
+
+    def test_fake_unit(self):
+        history = [
+            {
+                "type": "BolusWizard",
+                "start_at": "2015-09-07T22:23:00",
+                "end_at": "2015-09-07T22:23:00",
+                "amount": 12.0,
+                "unit": "beans"
+            }
+        ]
+
+        self.assertEqual(0.0, sum(e['amount'] for e in convolve_cob(history)))
+        self.assertEqual(
+            0.0,
+            sum(e['amount'] for e in convolve_carb_effect(history, self.carb_ratios, self.insulin_sensitivities))
+        )
+
+    def test_per_meal_absorption_time(self):
+        history = [
+            dict(e, absorption_time=60 if i % 2 else 240) for i, e in enumerate(self.history)
+        ]
+
+        self.assertEffectsAlmostEqual(
+            calculate_carb_effect(history, self.carb_ratios, self.insulin_sensitivities),
+            convolve_carb_effect(history, self.carb_ratios, self.insulin_sensitivities),
+            1.0
+        )
+        self.assertEffectsAlmostEqual(calculate_cob(history), convolve_cob(history), 0.2)
+
+    def test_start_at_end_at(self):
+        start_at = datetime(2015, 10, 15, 19, 32)
+        end_at = datetime(2015, 10, 15, 20, 30)
+
+        self.assertEffectsAlmostEqual(
+            calculate_cob(self.history, start_at=start_at, end_at=end_at),
+            convolve_cob(self.history, start_at=start_at, end_at=end_at),
+            0.1
+        )
+        self.assertEffectsAlmostEqual(
+            calculate_carb_effect(
+                self.history, self.carb_ratios, self.insulin_sensitivities, start_at=start_at, end_at=end_at
+            ),
+            convolve_carb_effect(
+                self.history, self.carb_ratios, self.insulin_sensitivities, start_at=start_at, end_at=end_at
+            ),
+            0.5
+        )
+
+    def test_float32(self):
+        self.assertEffectsAlmostEqual(
+            convolve_carb_effect(self.history, self.carb_ratios, self.insulin_sensitivities),
+            convolve_carb_effect(self.history, self.carb_ratios, self.insulin_sensitivities, dtype=numpy.float32),
+            5e-4
+        )
+        self.assertEffectsAlmostEqual(convolve_cob(self.history), convolve_cob(self.history, dtype='float32'), 1e-4)
@@ -0,0 +1,219 @@
+import json
+import unittest
+
+import numpy
+
+from openapscontrib.predict.convolution import carb_effect_kernel
+from openapscontrib.predict.convolution import carb_effect_kernels
+from openapscontrib.predict.convolution import convolve_carb_effect
+from openapscontrib.predict.convolution import convolve_insulin_effect
+from openapscontrib.predict.convolution import insulin_effect_kernel
+from openapscontrib.predict.convolution import insulin_effect_kernels
+from openapscontrib.predict.ensemble import predict_glucose_bands
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_glucose_from_effects
+from tests.predict_tests import get_file_at_path
+
+
+class EnsembleKernelTestCase(unittest.TestCase):
+    def test_unit_scale_matches_kernel(self):
+        numpy.testing.assert_array_equal(
+            insulin_effect_kernel(240, 5, 10),
+            insulin_effect_kernels(240, 5, 10, numpy.array([1.0]))[0]
+        )
+        numpy.testing.assert_array_equal(
+            carb_effect_kernel(180, 5, 10),
+            carb_effect_kernels(180, 5, 10, numpy.array([1.0]))[0]
+        )
+
+    def test_carb_model(self):
+        for carb_model in ('linear', 'parabolic', 'bilinear'):
+            numpy.testing.assert_allclose(
+                carb_effect_kernel(180, 5, 10, carb_model),
+                carb_effect_kernels(180, 5, 10, numpy.array([1.0]), carb_model=carb_model)[0],
+                rtol=0,
+                atol=1e-12
+            )
+
+    def test_scaled_kernels_end_absorbed(self):
+        kernels = insulin_effect_kernels(240, 5, 10, numpy.array([0.8, 1.0, 1.25]))
+
+        self.assertEqual(int(numpy.ceil((240 * 1.25 + 10) / 5.0)) + 1, kernels.shape[1])
+        numpy.testing.assert_array_equal(numpy.ones(3), kernels[:, -1])
+        self.assertGreater(kernels[1, 20], kernels[2, 20])
+
+    def test_kernel_dtype(self):
+        scales = numpy.array([0.8, 1.0, 1.25])
+
+        self.assertEqual(numpy.float64, insulin_effect_kernels(240, 5, 10, scales).dtype)
+        self.assertEqual(numpy.float32, insulin_effect_kernels(240, 5, 10, scales, dtype=numpy.float32).dtype)
+        self.assertEqual(numpy.float32, carb_effect_kernels(180, 5, 10, scales, dtype=numpy.float32).dtype)
+
+
+class GlucoseBandsTestCase(unittest.TestCase):
+    glucose = [{"date": "2015-10-15T22:32:00", "sgv": 150}]
+
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+    def test_no_glucose(self):
+        self.assertDictEqual(
+            {'10': [], '50': [], '90': []},
+            predict_glucose_bands(self.normalized_history, [], 4, self.insulin_sensitivities, self.carb_ratios)
+        )
+
+    def test_no_error_matches_prediction(self):
+        expected = calculate_glucose_from_effects(
+            [
+                convolve_insulin_effect(self.normalized_history, 4, self.insulin_sensitivities),
+                convolve_carb_effect(self.normalized_history, self.carb_ratios, self.insulin_sensitivities)
+            ],
+            self.glucose
+        )
+
+        bands = predict_glucose_bands(
+            self.normalized_history,
+            self.glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            members=4,
+            isf_error=0.0,
+            carb_ratio_error=0.0,
+            absorption_error=0.0,
+            insulin_action_error=0.0
+        )
+
+        for band in bands.values():
+            self.assertEqual(len(expected), len(band))
+
+            for e, a in zip(expected, band):
+                self.assertEqual(e['date'], a['date'])
+                self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_insulin_model(self):
+        expected = calculate_glucose_from_effects(
+            [
+                convolve_insulin_effect(
+                    self.normalized_history, 4, self.insulin_sensitivities, insulin_model='rapid_acting'
+                ),
+                convolve_carb_effect(self.normalized_history, self.carb_ratios, self.insulin_sensitivities)
+            ],
+            self.glucose
+        )
+
+        bands = predict_glucose_bands(
+            self.normalized_history,
+            self.glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            members=4,
+            isf_error=0.0,
+            carb_ratio_error=0.0,
+            absorption_error=0.0,
+            insulin_action_error=0.0,
+            insulin_model='rapid_acting'
+        )
+
+        for band in bands.values():
+            self.assertEqual(len(expected), len(band))
+
+            for e, a in zip(expected, band):
+                self.assertEqual(e['date'], a['date'])
+                self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_carb_model(self):
+        expected = calculate_glucose_from_effects(
+            [
+                convolve_insulin_effect(self.normalized_history, 4, self.insulin_sensitivities),
+                convolve_carb_effect(
+                    self.normalized_history, self.carb_ratios, self.insulin_sensitivities, carb_model='linear'
+                )
+            ],
+            self.glucose
+        )
+
+        bands = predict_glucose_bands(
+            self.normalized_history,
+            self.glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            members=4,
+            isf_error=0.0,
+            carb_ratio_error=0.0,
+            absorption_error=0.0,
+            insulin_action_error=0.0,
+            carb_model='linear'
+        )
+
+        for band in bands.values():
+            self.assertEqual(len(expected), len(band))
+
+            for e, a in zip(expected, band):
+                self.assertEqual(e['date'], a['date'])
+                self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_bands_are_ordered(self):
+        bands = predict_glucose_bands(
+            self.normalized_history,
+            self.glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            members=200,
+            seed=0
+        )
+
+        low, median, high = [numpy.array([e['amount'] for e in bands[key]]) for key in ('10', '50', '90')]
+
+        self.assertEqual(150.0, low[0])
+        self.assertEqual(150.0, high[0])
+        self.assertTrue(numpy.all(low <= median))
+        self.assertTrue(numpy.all(median <= high))
+        self.assertGreater(high[-1] - low[-1], 10.0)
+
+    def test_chunk_size_does_not_change_bands(self):
+        kwargs = dict(percentiles=(5, 95), members=100, seed=3)
+
+        expected = predict_glucose_bands(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios, **kwargs
+        )
+        bands = predict_glucose_bands(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios,
+            chunk_size=7, **kwargs
+        )
+
+        self.assertListEqual(['5', '95'], sorted(bands.keys(), key=float))
+
+        for key in expected:
+            for e, a in zip(expected[key], bands[key]):
+                self.assertEqual(e['date'], a['date'])
+                self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_float32(self):
+        kwargs = dict(members=200, seed=0)
+
+        expected = predict_glucose_bands(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios, **kwargs
+        )
+        bands = predict_glucose_bands(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios,
+            dtype=numpy.float32, **kwargs
+        )
+
+        for key in expected:
+            self.assertEqual(len(expected[key]), len(bands[key]))
+
+            for e, a in zip(expected[key], bands[key]):
+                self.assertEqual(e['date'], a['date'])
+                self.assertAlmostEqual(e['amount'], a['amount'], delta=5e-4)
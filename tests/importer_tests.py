@@ -0,0 +1,170 @@
+import json
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from openapscontrib.predict.importer import Importer
+from openapscontrib.predict.importer import report_kind
+from tests.predict_tests import get_file_at_path
+
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.reports = os.path.join(self.directory, 'monitor')
+        self.archive = os.path.join(self.directory, 'monitor', 'archive')
+        os.makedirs(self.reports)
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            self.normalized_history = json.load(fp)
+
+        with open(get_file_at_path("fixtures/momentum_effect_rising_glucose_input.json")) as fp:
+            self.glucose = json.load(fp)
+
+        with open(get_file_at_path("fixtures/cgms_calibrations.json")) as fp:
+            self.calibrations = json.load(fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_report(self, filename, entries):
+        path = os.path.join(self.reports, filename)
+
+        with open(path, 'w') as fp:
+            json.dump(entries, fp)
+
+        return path
+
+    def test_report_kind(self):
+        self.assertEqual('history', report_kind(self.normalized_history))
+        self.assertEqual('glucose', report_kind(self.glucose))
+        self.assertEqual('calibrations', report_kind(self.calibrations))
+        self.assertIsNone(report_kind({'insulin_action_curve': 4}))
+        self.assertIsNone(report_kind([]))
+        self.assertIsNone(report_kind([{'date': '2015-10-25T19:30:00', 'amount': 129, 'unit': 'mg/dL'}]))
+
+    def test_ingest(self):
+        self.write_report('history.json', self.normalized_history)
+        self.write_report('glucose.json', self.glucose)
+        self.write_report('calibrations.json', self.calibrations)
+        self.write_report('settings.json', {'insulin_action_curve': 4})
+
+        result = Importer(self.archive).ingest(self.reports)
+
+        self.assertDictEqual(
+            {'history': len(self.normalized_history), 'glucose': len(self.glucose),
+             'calibrations': len(self.calibrations)},
+            result['appended']
+        )
+        self.assertEqual(4, len(result['files']))
+
+        # Unchanged files aren't read again, and the archive itself isn't ingested
+        result = Importer(self.archive).ingest(self.reports)
+
+        self.assertDictEqual({'history': 0, 'glucose': 0, 'calibrations': 0}, result['appended'])
+        self.assertDictEqual({'history': 0, 'glucose': 0, 'calibrations': 0}, result['updated'])
+        self.assertDictEqual({}, result['files'])
+
+        importer = Importer(self.archive)
+
+        self.assertListEqual(self.glucose, [
+            {'date': entry['date'], 'amount': entry['amount']} for entry in importer.archives['glucose'].glucose()
+        ])
+
+    def test_overlapping_history(self):
+        self.write_report('history.json', self.normalized_history[10:])
+        Importer(self.archive).ingest(self.reports)
+
+        # The next read overlaps the last one, and a second report repeats some of it. Rewritten reports are detected
+        # by size as well as modification time.
+        self.write_report('history.json', self.normalized_history[:15])
+        self.write_report('history_copy.json', self.normalized_history[5:20])
+        result = Importer(self.archive).ingest(self.reports)
+
+        archive = Importer(self.archive).archives['history']
+        archived = sorted((event['start_at'], event['type']) for event in archive.history())
+
+        self.assertEqual(len(archived), len(set(archived)))
+        self.assertListEqual(
+            sorted((event['start_at'], event['type']) for event in self.normalized_history),
+            archived
+        )
+        self.assertEqual(10, result['appended']['history'])
+
+    def test_interrupted_ingest(self):
+        self.write_report('glucose.json', self.glucose)
+        importer = Importer(self.archive)
+        importer.ingest(self.reports)
+
+        # As if the state weren't saved after the archive was appended
+        os.remove(importer.state_path)
+
+        result = Importer(self.archive).ingest(self.reports)
+
+        self.assertEqual(0, result['appended']['glucose'])
+        self.assertEqual(len(self.glucose), len(Importer(self.archive).archives['glucose']))
+
+    def test_revised_end(self):
+        temp_basal = {
+            'type': 'TempBasal',
+            'start_at': '2015-10-15T21:00:00',
+            'end_at': '2015-10-15T21:30:00',
+            'amount': 1.5,
+            'unit': 'U/hour'
+        }
+        self.write_report('history.json', [temp_basal])
+        Importer(self.archive).ingest(self.reports)
+
+        # The next loop replaces the temp basal, which shortens the first
+        self.write_report('history.json', [
+            dict(temp_basal, start_at='2015-10-15T21:05:00', end_at='2015-10-15T21:35:00', amount=0.5),
+            dict(temp_basal, end_at='2015-10-15T21:05:00')
+        ])
+        result = Importer(self.archive).ingest(self.reports)
+
+        self.assertEqual(1, result['appended']['history'])
+        self.assertEqual(1, result['updated']['history'])
+        self.assertListEqual(
+            [('2015-10-15T21:05:00', '2015-10-15T21:35:00'), ('2015-10-15T21:00:00', '2015-10-15T21:05:00')],
+            [(event['start_at'], event['end_at']) for event in Importer(self.archive).archives['history'].history()]
+        )
+
+    def test_newer_file_takes_precedence(self):
+        planned = dict(self.normalized_history[0], end_at='2015-10-16T01:00:00')
+        older = self.write_report('history_old.json', [planned])
+        self.write_report('history.json', self.normalized_history[:1])
+        os.utime(older, (time.time() - 60, time.time() - 60))
+
+        Importer(self.archive).ingest(self.reports)
+
+        self.assertEqual(
+            self.normalized_history[0]['end_at'],
+            Importer(self.archive).archives['history'].history()[0]['end_at']
+        )
+
+    def test_backfilled_glucose(self):
+        # Readings missed while the receiver was out of range arrive after later readings are archived
+        self.write_report('glucose.json', self.glucose[:2] + self.glucose[4:])
+        Importer(self.archive).ingest(self.reports)
+
+        self.write_report('glucose.json', self.glucose)
+        result = Importer(self.archive).ingest(self.reports)
+
+        self.assertEqual(2, result['appended']['glucose'])
+        self.assertListEqual(self.glucose, [
+            {'date': entry['date'], 'amount': entry['amount']}
+            for entry in Importer(self.archive).archives['glucose'].glucose()
+        ])
+
+    def test_records_before_look_back_are_dropped(self):
+        self.write_report('glucose.json', [{'date': '2015-10-17T00:00:00', 'sgv': 100}])
+        Importer(self.archive).ingest(self.reports)
+
+        self.write_report('glucose.json', [{'date': '2015-10-16T12:00:00', 'sgv': 110},
+                                           {'date': '2015-10-15T12:00:00', 'sgv': 120}])
+        result = Importer(self.archive).ingest(self.reports)
+
+        self.assertEqual(1, result['appended']['glucose'])
+        self.assertEqual(2, len(Importer(self.archive).archives['glucose']))
@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+import unittest
+
+from openapscontrib.predict import instrumentation
+from openapscontrib.predict.predict import calculate_iob
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    history = [
+        {
+            "type": "TempBasal",
+            "start_at": "2015-07-13T12:00:00",
+            "end_at": "2015-07-13T12:30:00",
+            "amount": 1.0,
+            "unit": "U/hour"
+        },
+        {
+            "type": "Bolus",
+            "start_at": "2015-07-13T12:00:00",
+            "end_at": "2015-07-13T12:00:00",
+            "amount": 1.0,
+            "unit": "U"
+        }
+    ]
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_disabled(self):
+        calculate_iob(self.history, 4)
+
+        report = instrumentation.recorder.report()
+
+        self.assertListEqual([], report['spans'])
+        self.assertDictEqual({}, report['counters'])
+
+    def test_spans_and_counters(self):
+        instrumentation.enable(None)
+
+        with instrumentation.span('main'):
+            calculate_iob(self.history, 4)
+
+        report = instrumentation.recorder.report()
+        names = [s['name'] for s in report['spans']]
+
+        self.assertIn('main', names)
+        self.assertIn('main/calculate_iob', names)
+        self.assertIn('main/calculate_iob/events', names)
+        self.assertIn('main/calculate_iob/serialize', names)
+        self.assertGreater(report['counters']['walsh_iob_curve'], 0)
+
+    def test_run_writes_report(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+
+        try:
+            instrumentation.enable(path)
+
+            with instrumentation.run('walsh_iob'):
+                calculate_iob(self.history, 4)
+
+            with open(path) as fp:
+                report = json.loads(fp.readline())
+
+            self.assertEqual('walsh_iob', report['spans'][0]['name'])
+            self.assertEqual(1, report['spans'][0]['count'])
+            self.assertListEqual([], instrumentation.recorder.report()['spans'])
+        finally:
+            os.remove(path)
@@ -0,0 +1,185 @@
+from datetime import datetime
+import json
+import unittest
+
+import numpy
+
+from openapscontrib.predict.convolution import convolve_insulin_effect
+from openapscontrib.predict.insulin import ExponentialInsulinModel
+from openapscontrib.predict.insulin import WalshInsulinModel
+from openapscontrib.predict.insulin import get_insulin_model
+from openapscontrib.predict.insulin import insulin_models
+from openapscontrib.predict.integration import AdaptiveSimpson
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import calculate_iob
+from openapscontrib.predict.predict import calculate_iob_and_insulin_effect
+from openapscontrib.predict.predict import integrate_iob
+from openapscontrib.predict.predict import walsh_iob_curve
+from tests.predict_tests import get_file_at_path
+
+
+class InsulinModelTestCase(unittest.TestCase):
+    def test_registry(self):
+        self.assertListEqual(['walsh', 'rapid_acting', 'ultra_rapid'], list(insulin_models))
+        self.assertIsInstance(get_insulin_model('walsh', 240), WalshInsulinModel)
+        self.assertEqual(75, get_insulin_model('rapid_acting', 360).peak_activity_time)
+        self.assertEqual(55, get_insulin_model('ultra_rapid', 360).peak_activity_time)
+
+        with self.assertRaises(ValueError):
+            get_insulin_model('regular', 360)
+
+    def test_invalid_peak(self):
+        with self.assertRaises(ValueError):
+            ExponentialInsulinModel(120, 75)
+
+    def test_walsh_matches_curve(self):
+        model = WalshInsulinModel(240)
+        t = numpy.arange(-10, 250, 5.0)
+
+        self.assertListEqual([walsh_iob_curve(x, 240) for x in t], model.iob(t).tolist())
+        self.assertAlmostEqual(
+            integrate_iob(0, 60.0, 240, 90.0, integrator=AdaptiveSimpson(tolerance=1e-10)),
+            model.integrated_iob(0, 60.0, 90.0),
+            places=6
+        )
+
+    def test_exponential_curve(self):
+        for name in ('rapid_acting', 'ultra_rapid'):
+            model = get_insulin_model(name, 360)
+            t = numpy.arange(-10, 371, 1.0)
+            iob = model.iob(t)
+
+            self.assertEqual(1.0, iob[0])
+            self.assertAlmostEqual(1.0, model.iob(0.001), places=6)
+            self.assertAlmostEqual(0.0, model.iob(359.999), places=9)
+            self.assertEqual(0.0, iob[-1])
+            self.assertTrue(numpy.all(numpy.diff(iob) <= 0))
+
+            # Activity, the rate of absorption, peaks at the peak activity time
+            self.assertEqual(model.peak_activity_time, t[numpy.argmin(numpy.diff(iob))])
+
+    def test_exponential_integral(self):
+        model = get_insulin_model('rapid_acting', 300)
+        integrator = AdaptiveSimpson(tolerance=1e-10)
+
+        for t0, t1, t in ((0, 30, 60), (0, 120, 90), (15, 45, 400), (0, 30, -5)):
+            self.assertAlmostEqual(
+                integrator.integrate(lambda s: float(model.iob(t - s)), t0, t1),
+                float(model.integrated_iob(t0, t1, t)),
+                places=6
+            )
+
+
+class CalculatorInsulinModelTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+    def test_bolus(self):
+        normalized_history = [
+            {
+                'type': 'Bolus',
+                'start_at': '2015-07-13T12:00:00',
+                'end_at': '2015-07-13T12:00:00',
+                'amount': 1.5,
+                'unit': 'U'
+            }
+        ]
+
+        effect = calculate_insulin_effect(
+            normalized_history, 6, self.insulin_sensitivities, insulin_model='rapid_acting'
+        )
+        iob = calculate_iob(normalized_history, 6, insulin_model='rapid_acting')
+
+        self.assertDictEqual({'date': '2015-07-13T12:00:00', 'amount': 0.0, 'unit': 'mg/dL'}, effect[0])
+        self.assertDictEqual({'date': '2015-07-13T18:10:00', 'amount': -60.0, 'unit': 'mg/dL'}, effect[-1])
+        self.assertDictEqual({'date': '2015-07-13T12:00:00', 'amount': 1.5, 'unit': 'U'}, iob[0])
+        self.assertDictEqual({'date': '2015-07-13T18:10:00', 'amount': 0.0, 'unit': 'U'}, iob[-1])
+
+        # The ultra-rapid curve acts sooner
+        ultra_rapid = calculate_insulin_effect(
+            normalized_history, 6, self.insulin_sensitivities, insulin_model='ultra_rapid'
+        )
+
+        self.assertLess(ultra_rapid[12]['amount'], effect[12]['amount'])
+
+    def test_temp_basal_matches_numerical_integration(self):
+        normalized_history = [
+            {
+                'type': 'TempBasal',
+                'start_at': '2015-07-13T12:00:00',
+                'end_at': '2015-07-13T12:30:00',
+                'amount': 1.0,
+                'unit': 'U/hour'
+            }
+        ]
+
+        effect = calculate_insulin_effect(
+            normalized_history, 6, self.insulin_sensitivities, insulin_model='rapid_acting'
+        )
+
+        model = get_insulin_model('rapid_acting', 360)
+        integrator = AdaptiveSimpson(tolerance=1e-10)
+
+        for entry, t in zip(effect, numpy.arange(len(effect)) * 5.0 - 10):
+            expected = 0.0 if t < 0 else 1.0 / 60.0 * -40 * (
+                30 - integrator.integrate(lambda s: float(model.iob(t - s)), 0, 30)
+            )
+
+            self.assertAlmostEqual(expected, entry['amount'], places=6)
+
+        self.assertAlmostEqual(-20.0, effect[-1]['amount'], places=12)
+
+    def test_combined_matches_separate_calculators(self):
+        basal_dosing_end = datetime(2015, 10, 15, 22, 10)
+        start_at = datetime(2015, 10, 15, 21, 2)
+
+        for visual_iob_only in (True, False):
+            result = calculate_iob_and_insulin_effect(
+                self.normalized_history,
+                4,
+                self.insulin_sensitivities,
+                basal_dosing_end=basal_dosing_end,
+                start_at=start_at,
+                visual_iob_only=visual_iob_only,
+                insulin_model='rapid_acting'
+            )
+
+            expected_iob = calculate_iob(
+                self.normalized_history,
+                4,
+                basal_dosing_end=basal_dosing_end,
+                start_at=start_at,
+                visual_iob_only=visual_iob_only,
+                insulin_model='rapid_acting'
+            )
+            expected_effect = calculate_insulin_effect(
+                self.normalized_history,
+                4,
+                self.insulin_sensitivities,
+                basal_dosing_end=basal_dosing_end,
+                start_at=start_at,
+                insulin_model='rapid_acting'
+            )
+
+            for expected, actual in ((expected_iob, result['iob']), (expected_effect, result['insulin_effect'])):
+                self.assertListEqual([e['date'] for e in expected], [a['date'] for a in actual])
+
+                for e, a in zip(expected, actual):
+                    self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_convolution_matches_calculator_once_complete(self):
+        effect = calculate_insulin_effect(
+            self.normalized_history, 4, self.insulin_sensitivities, insulin_model='ultra_rapid'
+        )
+        convolved = convolve_insulin_effect(
+            self.normalized_history, 4, self.insulin_sensitivities, insulin_model='ultra_rapid'
+        )
+
+        self.assertEqual(effect[-1]['date'], convolved[-1]['date'])
+        self.assertAlmostEqual(effect[-1]['amount'], convolved[-1]['amount'], places=6)
@@ -0,0 +1,96 @@
+import json
+import unittest
+
+from openapscontrib.predict.integration import AdaptiveSimpson
+from openapscontrib.predict.integration import FixedSimpson
+from openapscontrib.predict.integration import RiemannSum
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import calculate_iob
+from openapscontrib.predict.predict import integrate_iob
+from openapscontrib.predict.predict import walsh_iob_curve
+from tests.predict_tests import get_file_at_path
+
+
+class CountingCurve(object):
+    def __init__(self, t, insulin_action_duration):
+        self.t = t
+        self.insulin_action_duration = insulin_action_duration
+        self.calls = 0
+
+    def __call__(self, s):
+        self.calls += 1
+        return walsh_iob_curve(self.t - s, self.insulin_action_duration)
+
+
+class IntegratorTestCase(unittest.TestCase):
+    def test_cubic_is_exact(self):
+        self.assertAlmostEqual(4.0, AdaptiveSimpson().integrate(lambda x: x ** 3, 0.0, 2.0), places=12)
+
+    def test_riemann_sum_clips_final_segment(self):
+        self.assertAlmostEqual(7.0, RiemannSum(5).integrate(lambda x: 1.0, 0.0, 7.0))
+        self.assertAlmostEqual(3.5, RiemannSum(5).integrate(lambda x: 1.0, 0.0, 7.0, scale=2.0))
+
+    def test_scale(self):
+        self.assertAlmostEqual(
+            FixedSimpson().integrate(lambda x: x, 0.0, 10.0) / 4.0,
+            FixedSimpson().integrate(lambda x: x, 0.0, 10.0, scale=4.0)
+        )
+
+    def test_default_matches_integrate_iob(self):
+        self.assertEqual(
+            FixedSimpson(50).integrate(lambda s: walsh_iob_curve(90.0 - s, 240), 0, 60.0),
+            integrate_iob(0, 60.0, 240, 90.0)
+        )
+
+    def test_short_dose_is_cheap(self):
+        curve = CountingCurve(60.0, 240)
+        integral = AdaptiveSimpson().integrate(curve, 0.0, 0.5)
+
+        self.assertLessEqual(curve.calls, 5)
+        self.assertAlmostEqual(0.5 * walsh_iob_curve(59.75, 240), integral, places=6)
+
+    def test_long_dose_is_accurate(self):
+        reference = FixedSimpson(20000).integrate(CountingCurve(720.0, 240), 0.0, 1440.0)
+        curve = CountingCurve(720.0, 240)
+        integral = AdaptiveSimpson(tolerance=1e-4).integrate(curve, 0.0, 1440.0)
+
+        self.assertAlmostEqual(reference, integral, delta=1440.0 * 1e-4)
+        self.assertLess(curve.calls, 2000)
+        self.assertGreater(
+            abs(reference - FixedSimpson(50).integrate(CountingCurve(720.0, 240), 0.0, 1440.0)),
+            abs(reference - integral)
+        )
+
+
+class CalculatorIntegratorTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = json.load(fp)
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.history = json.load(fp)
+
+    def test_insulin_effect(self):
+        schedule = Schedule(self.insulin_sensitivities['sensitivities'])
+        expected = calculate_insulin_effect(self.history, 4, schedule)
+        effect = calculate_insulin_effect(self.history, 4, schedule, integrator=AdaptiveSimpson())
+
+        self.assertEqual(len(expected), len(effect))
+
+        for e, a in zip(expected, effect):
+            self.assertEqual(e['date'], a['date'])
+            self.assertAlmostEqual(e['amount'], a['amount'], delta=2.0)
+
+        self.assertAlmostEqual(expected[-1]['amount'], effect[-1]['amount'], places=9)
+
+    def test_iob(self):
+        expected = calculate_iob(self.history, 4)
+        iob = calculate_iob(self.history, 4, integrator=AdaptiveSimpson())
+
+        self.assertEqual(len(expected), len(iob))
+
+        for e, a in zip(expected, iob):
+            self.assertEqual(e['date'], a['date'])
+            self.assertAlmostEqual(e['amount'], a['amount'], delta=0.1)
@@ -0,0 +1,103 @@
+from datetime import datetime
+import unittest
+
+from openapscontrib.predict.intervals import IntervalIndex
+from openapscontrib.predict.intervals import timestamp_range
+from openapscontrib.predict.predict import active_events
+from openapscontrib.predict.predict import effect_window
+from openapscontrib.predict.predict import history_index
+
+
+class IntervalIndexTestCase(unittest.TestCase):
+    def test_empty(self):
+        index = IntervalIndex([])
+
+        self.assertEqual(0, len(index))
+        self.assertListEqual([], index.at(1.0))
+
+    def test_at(self):
+        index = IntervalIndex([(5.0, 20.0, 'a'), (0.0, 2.0, 'b'), (1.0, 6.0, 'c'), (8.0, 9.0, 'd')])
+
+        self.assertListEqual(['b'], index.at(0.0))
+        self.assertListEqual(['b', 'c'], index.at(2.0))
+        self.assertListEqual(['a', 'c'], index.at(5.5))
+        self.assertListEqual(['a', 'd'], index.at(8.0))
+        self.assertListEqual([], index.at(20.5))
+
+    def test_overlapping(self):
+        index = IntervalIndex([(5.0, 20.0, 'a'), (0.0, 2.0, 'b'), (1.0, 6.0, 'c'), (8.0, 9.0, 'd')])
+
+        self.assertListEqual(['a', 'c', 'd'], index.overlapping(3.0, 8.5))
+        self.assertListEqual(['a', 'b', 'c', 'd'], index.overlapping(-1.0, 30.0))
+
+    def test_timestamp_range(self):
+        timestamps = [datetime(2015, 7, 13, 12, m) for m in range(0, 60, 5)]
+
+        self.assertTupleEqual((0, 12), timestamp_range(timestamps, datetime(2015, 7, 13, 11), datetime(2015, 7, 13, 13)))
+        self.assertTupleEqual(
+            (1, 3), timestamp_range(timestamps, datetime(2015, 7, 13, 12, 5), datetime(2015, 7, 13, 12, 14))
+        )
+        self.assertTupleEqual((12, 12), timestamp_range(timestamps, datetime(2015, 7, 13, 13), datetime(2015, 7, 13, 14)))
+
+
+class ActiveEventsTestCase(unittest.TestCase):
+    history = [
+        {
+            "type": "Bolus",
+            "start_at": "2015-07-13T12:00:00",
+            "end_at": "2015-07-13T12:00:00",
+            "amount": 1.0,
+            "unit": "U"
+        },
+        {
+            "type": "Meal",
+            "start_at": "2015-07-13T13:00:00",
+            "end_at": "2015-07-13T13:00:00",
+            "amount": 20,
+            "unit": "g",
+            "absorption_time": 60
+        },
+        {
+            "type": "TempBasal",
+            "start_at": "2015-07-13T13:00:00",
+            "end_at": "2015-07-13T13:30:00",
+            "amount": 1.0,
+            "unit": "U/hour"
+        },
+        {
+            "type": "PumpSuspend",
+            "start_at": "2015-07-13T13:00:00",
+            "end_at": "2015-07-13T13:00:00",
+            "amount": 0,
+            "unit": "event"
+        }
+    ]
+
+    def test_effect_window(self):
+        self.assertTupleEqual(
+            (datetime(2015, 7, 13, 12), datetime(2015, 7, 13, 16, 10)), effect_window(self.history[0], 240)
+        )
+        self.assertTupleEqual(
+            (datetime(2015, 7, 13, 13), datetime(2015, 7, 13, 14, 10)), effect_window(self.history[1], 240)
+        )
+        self.assertTupleEqual(
+            (datetime(2015, 7, 13, 13), datetime(2015, 7, 13, 17, 40)), effect_window(self.history[2], 240)
+        )
+        self.assertTupleEqual(
+            (datetime(2015, 7, 13, 13), datetime(2015, 7, 13, 16, 30)),
+            effect_window(self.history[2], 180, basal_dosing_end=datetime(2015, 7, 13, 13, 10))
+        )
+        self.assertIsNone(effect_window(self.history[3], 240))
+
+    def test_active_events(self):
+        self.assertListEqual([], active_events(self.history, datetime(2015, 7, 13, 11, 59), 4))
+        self.assertListEqual(self.history[:1], active_events(self.history, datetime(2015, 7, 13, 12, 30), 4))
+        self.assertListEqual(self.history[:3], active_events(self.history, datetime(2015, 7, 13, 13, 30), 4))
+        self.assertListEqual(self.history[2:3], active_events(self.history, datetime(2015, 7, 13, 16, 11), 4))
+
+    def test_history_index(self):
+        index = history_index(self.history, 3)
+
+        self.assertEqual(3, len(index))
+        self.assertListEqual(self.history[:3], index.at(datetime(2015, 7, 13, 14, 10)))
+        self.assertListEqual(self.history[2:3], index.at(datetime(2015, 7, 13, 15, 30)))
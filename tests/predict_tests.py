@@ -1,19 +1,27 @@
 from datetime import datetime
+from datetime import time
 from dateutil.parser import parse
 from dateutil.tz import tzutc
 import json
 import os
+import threading
 import unittest
 
+from openapscontrib.predict.predict import GlucoseSeries
 from openapscontrib.predict.predict import Schedule
 from openapscontrib.predict.predict import calculate_carb_effect
 from openapscontrib.predict.predict import calculate_cob
+from openapscontrib.predict.predict import calculate_cob_and_carb_effect
 from openapscontrib.predict.predict import calculate_glucose_from_effects
 from openapscontrib.predict.predict import calculate_insulin_effect
 from openapscontrib.predict.predict import calculate_iob
+from openapscontrib.predict.predict import calculate_iob_and_insulin_effect
 from openapscontrib.predict.predict import calculate_momentum_effect
 from openapscontrib.predict.predict import future_glucose
 from openapscontrib.predict.predict import glucose_data_tuple
+from openapscontrib.predict.predict import walsh_iob_coefficients
+from openapscontrib.predict.predict import walsh_iob_curve
+from openapscontrib.predict.predict import walsh_iob_curve_coefficients
 
 
 def get_file_at_path(path):
@@ -54,7 +62,7 @@ class GlucoseDataTupleTestCase(unittest.TestCase):
             "glucose": 150
         })
 
-        self.assertEqual(datetime(2015, 07, 13, 10, tzinfo=tzutc()), parse(date))
+        self.assertEqual(datetime(2015, 7, 13, 10, tzinfo=tzutc()), parse(date))
         self.assertEqual(150, glucose)
 
     def test_medtronic_entry(self):
@@ -68,7 +76,7 @@ class GlucoseDataTupleTestCase(unittest.TestCase):
             "op": 71
         })
 
-        self.assertEqual(datetime(2015, 07, 28, 23, 1), parse(date))
+        self.assertEqual(datetime(2015, 7, 28, 23, 1), parse(date))
         self.assertEqual(142, glucose)
 
     def test_dexcom_reader_entry(self):
@@ -83,6 +91,114 @@ class GlucoseDataTupleTestCase(unittest.TestCase):
         self.assertEqual(143, glucose)
 
 
+class GlucoseSeriesTestCase(unittest.TestCase):
+    def assertMatchesTuples(self, recent_glucose):
+        series = GlucoseSeries(recent_glucose)
+        dates, values = zip(*map(glucose_data_tuple, recent_glucose))
+
+        self.assertListEqual(list(dates), series.dates)
+        self.assertListEqual([float(value) for value in values], series.values.tolist())
+
+        return series
+
+    def test_schemas(self):
+        for filename in (
+            'glucose_from_effects_glucose_input.json',
+            'momentum_effect_bouncing_glucose_input.json',
+            'cgms_calibrations.json'
+        ):
+            with open(get_file_at_path('fixtures/' + filename)) as fp:
+                self.assertMatchesTuples(json.load(fp))
+
+        self.assertMatchesTuples([
+            {'dateString': '2015-07-13T10:05:00+00:00', 'date': 1436781900000, 'sgv': 152},
+            {'dateString': '2015-07-13T10:00:00+00:00', 'date': 1436781600000, 'sgv': 150}
+        ])
+
+    def test_mixed_schemas(self):
+        series = self.assertMatchesTuples([
+            {'date': '2015-07-28T23:06:00', 'sgv': 145},
+            {'display_time': '2015-07-28T23:01:00', 'glucose': 142}
+        ])
+
+        self.assertEqual(datetime(2015, 7, 28, 23, 1), series.datetime(1))
+
+    def test_later_entries_with_preferred_keys(self):
+        series = self.assertMatchesTuples([
+            {'date': '2015-07-28T23:06:00', 'glucose': 145},
+            {'dateString': '2015-07-28T23:01:00', 'date': '2015-07-28T22:01:00', 'sgv': 142, 'glucose': 100}
+        ])
+
+        self.assertEqual(datetime(2015, 7, 28, 23, 1), series.datetime(1))
+        self.assertEqual(142, series.values[1])
+
+    def test_empty(self):
+        series = GlucoseSeries([])
+
+        self.assertEqual(0, len(series))
+        self.assertEqual(0, len(series.values))
+
+
+class ScheduleTestCase(unittest.TestCase):
+    def setUp(self):
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            self.entries = json.load(fp)['schedule']
+
+    def test_per_instance_cache(self):
+        schedule = Schedule(self.entries, cache_size=2)
+        other = Schedule(self.entries)
+
+        self.assertDictEqual(self.entries[0], schedule.at(time(0, 30)))
+        self.assertDictEqual(self.entries[0], schedule.at(time(0, 30)))
+        self.assertDictEqual(self.entries[1], schedule.at(time(12, 0)))
+        self.assertDictEqual(self.entries[-1], schedule.at(time(23, 59)))
+
+        self.assertDictEqual({'hits': 1, 'misses': 3, 'maxsize': 2, 'currsize': 2}, schedule.cache_info())
+        self.assertDictEqual({'hits': 0, 'misses': 0, 'maxsize': 128, 'currsize': 0}, other.cache_info())
+
+        # The least recently used lookup was evicted
+        schedule.at(time(0, 30))
+
+        self.assertEqual(4, schedule.cache_info()['misses'])
+
+        schedule.cache_clear()
+
+        self.assertDictEqual({'hits': 0, 'misses': 0, 'maxsize': 2, 'currsize': 0}, schedule.cache_info())
+
+    def test_disabled_cache(self):
+        schedule = Schedule(self.entries, cache_size=0)
+
+        schedule.at(time(0, 30))
+        schedule.at(time(0, 30))
+
+        self.assertDictEqual({'hits': 0, 'misses': 2, 'maxsize': 0, 'currsize': 0}, schedule.cache_info())
+
+    def test_concurrent_lookups(self):
+        schedule = Schedule(self.entries, cache_size=16)
+        times = [time(hour, minute) for hour in range(24) for minute in (0, 30)]
+        expected = [Schedule(self.entries, cache_size=0).at(t) for t in times]
+        results = []
+
+        def lookup():
+            results.append([schedule.at(t) for t in times * 4])
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for result in results:
+            self.assertListEqual(expected * 4, result)
+
+        info = schedule.cache_info()
+
+        self.assertEqual(8 * 4 * len(times), info['hits'] + info['misses'])
+        self.assertEqual(16, info['currsize'])
+
+
 class FutureGlucoseTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -550,6 +666,66 @@ class CalculateCarbEffectTestCase(unittest.TestCase):
             effect
         )
 
+    def test_start_at(self):
+        with open(get_file_at_path("fixtures/carb_effect_from_history_input.json")) as fp:
+            normalized_history = json.load(fp)
+        with open(get_file_at_path("fixtures/carb_effect_from_history_output.json")) as fp:
+            expected_output = json.load(fp)
+
+        start_at = parse(expected_output[-20]['date'])
+
+        effect = calculate_carb_effect(
+            normalized_history,
+            Schedule(self.carb_ratios['schedule']),
+            Schedule(self.insulin_sensitivities['sensitivities']),
+            start_at=start_at
+        )
+
+        self.assertEqual(20, len(effect))
+
+        for e, a in zip(expected_output[-20:], effect):
+            self.assertEqual(e['date'], a['date'])
+            self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_per_meal_absorption_time(self):
+        normalized_history = [
+            {
+                "type": "Meal",
+                "start_at": "2015-07-15T14:30:00",
+                "end_at": "2015-07-15T14:30:00",
+                "amount": 9,
+                "unit": "g",
+                "absorption_time": 60
+            },
+            {
+                "type": "Meal",
+                "start_at": "2015-07-15T14:00:00",
+                "end_at": "2015-07-15T14:00:00",
+                "amount": 9,
+                "unit": "g",
+                "absorption_time": 240
+            }
+        ]
+
+        effect = calculate_carb_effect(
+            normalized_history,
+            Schedule(self.carb_ratios['schedule']),
+            Schedule(self.insulin_sensitivities['sensitivities'])
+        )
+
+        fast_effect = calculate_carb_effect(
+            normalized_history[:1],
+            Schedule(self.carb_ratios['schedule']),
+            Schedule(self.insulin_sensitivities['sensitivities']),
+            absorption_duration=60
+        )
+
+        self.assertDictEqual({'date': '2015-07-15T14:00:00', 'amount': 0.0, 'unit': 'mg/dL'}, effect[0])
+        self.assertDictContainsSubset({'date': '2015-07-15T15:40:00', 'unit': 'mg/dL'}, effect[20])
+        self.assertEqual(fast_effect[-1]['date'], '2015-07-15T15:40:00')
+        self.assertGreater(effect[20]['amount'], fast_effect[-1]['amount'])
+        self.assertDictEqual({'date': '2015-07-15T18:40:00', 'amount': 80.0, 'unit': 'mg/dL'}, effect[-1])
+
 
 class CalculateCOBTestCase(unittest.TestCase):
     def test_carb_completion(self):
@@ -569,6 +745,36 @@ class CalculateCOBTestCase(unittest.TestCase):
 
         self.assertDictEqual({'date': '2015-07-15T17:40:00', 'amount': 0.0, 'unit': 'g'}, effect[-1])
 
+    def test_per_meal_absorption_time(self):
+        normalized_history = [
+            {
+                "type": "Meal",
+                "start_at": "2015-07-15T14:30:00",
+                "end_at": "2015-07-15T14:30:00",
+                "amount": 9,
+                "unit": "g",
+                "absorption_time": 60
+            },
+            {
+                "type": "Meal",
+                "start_at": "2015-07-15T14:30:00",
+                "end_at": "2015-07-15T14:30:00",
+                "amount": 20,
+                "unit": "g"
+            }
+        ]
+
+        effect = calculate_cob(normalized_history)
+        fast_effect = calculate_cob(normalized_history[:1], absorption_duration=60)
+        slow_effect = calculate_cob(normalized_history[1:])
+
+        self.assertEqual(len(slow_effect), len(effect))
+        self.assertEqual(0.0, fast_effect[-1]['amount'])
+
+        for i, entry in enumerate(effect):
+            fast_amount = fast_effect[i]['amount'] if i < len(fast_effect) else 0.0
+            self.assertAlmostEqual(fast_amount + slow_effect[i]['amount'], entry['amount'])
+
     def test_no_input_history(self):
         normalized_history = []
 
@@ -612,6 +818,75 @@ class CalculateCOBTestCase(unittest.TestCase):
             effect
         )
 
+    def test_start_at_end_at(self):
+        with open(get_file_at_path("fixtures/carb_effect_from_history_input.json")) as fp:
+            normalized_history = json.load(fp)
+        with open(get_file_at_path("fixtures/carbs_on_board_output.json")) as fp:
+            expected_output = json.load(fp)
+
+        effect = calculate_cob(
+            normalized_history,
+            start_at=parse(expected_output[10]['date']),
+            end_at=parse(expected_output[40]['date'])
+        )
+
+        self.assertListEqual(expected_output[10:41], effect)
+
+
+class CalculateCOBAndCarbEffectTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/carb_effect_from_history_input.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+    def test_no_input_history(self):
+        self.assertDictEqual(
+            {'cob': [], 'carb_effect': []},
+            calculate_cob_and_carb_effect([], self.carb_ratios, self.insulin_sensitivities)
+        )
+
+    def test_complicated_history(self):
+        with open(get_file_at_path("fixtures/carb_effect_from_history_output.json")) as fp:
+            expected_effect = json.load(fp)
+
+        with open(get_file_at_path("fixtures/carbs_on_board_output.json")) as fp:
+            expected_cob = json.load(fp)
+
+        result = calculate_cob_and_carb_effect(self.normalized_history, self.carb_ratios, self.insulin_sensitivities)
+
+        self.assertListEqual(expected_effect, result['carb_effect'])
+        self.assertListEqual(expected_cob, result['cob'])
+
+    def test_matches_separate_calculators(self):
+        normalized_history = [
+            dict(e, absorption_time=60 if i % 2 else 240) for i, e in enumerate(self.normalized_history)
+        ]
+        start_at = datetime(2015, 10, 15, 19, 32)
+
+        result = calculate_cob_and_carb_effect(
+            normalized_history,
+            self.carb_ratios,
+            self.insulin_sensitivities,
+            start_at=start_at
+        )
+
+        self.assertListEqual(calculate_cob(normalized_history, start_at=start_at), result['cob'])
+        self.assertListEqual(
+            calculate_carb_effect(
+                normalized_history,
+                self.carb_ratios,
+                self.insulin_sensitivities,
+                start_at=start_at
+            ),
+            result['carb_effect']
+        )
+
 
 class CalculateInsulinEffectTestCase(unittest.TestCase):
     @classmethod
@@ -664,6 +939,26 @@ class CalculateInsulinEffectTestCase(unittest.TestCase):
         self.assertDictEqual({'date': '2015-07-13T12:00:00', 'amount': 0.0, 'unit': 'mg/dL'}, effect[0])
         self.assertDictEqual({'date': '2015-07-13T16:20:00', 'amount': -40.0, 'unit': 'mg/dL'}, effect[-1])
 
+    def test_bolus_with_derived_curve(self):
+        normalized_history = [
+            {
+                "type": "Bolus",
+                "start_at": "2015-07-13T12:00:00",
+                "end_at": "2015-07-13T12:00:00",
+                "amount": 1.5,
+                "unit": "U"
+            }
+        ]
+
+        effect = calculate_insulin_effect(
+            normalized_history,
+            4.5,
+            Schedule(self.insulin_sensitivities['sensitivities'])
+        )
+
+        self.assertDictEqual({'date': '2015-07-13T12:00:00', 'amount': 0.0, 'unit': 'mg/dL'}, effect[0])
+        self.assertDictEqual({'date': '2015-07-13T16:40:00', 'amount': -60.0, 'unit': 'mg/dL'}, effect[-1])
+
     def test_datetime_rounding(self):
         normalized_history = [
             {
@@ -1013,6 +1308,44 @@ class CalculateInsulinEffectTestCase(unittest.TestCase):
 
         self.assertListEqual(expected, effect)
 
+    def test_start_at(self):
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            normalized_history = json.load(fp)
+
+        with open(get_file_at_path('fixtures/effect_from_history_output.json')) as fp:
+            expected = json.load(fp)
+
+        start_at = parse(expected[-30]['date'])
+
+        effect = calculate_insulin_effect(
+            normalized_history,
+            4,
+            Schedule(self.insulin_sensitivities['sensitivities']),
+            start_at=start_at
+        )
+
+        self.assertEqual(30, len(effect))
+
+        for e, a in zip(expected[-30:], effect):
+            self.assertEqual(e['date'], a['date'])
+            self.assertAlmostEqual(e['amount'], a['amount'], places=9)
+
+    def test_end_at(self):
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            normalized_history = json.load(fp)
+
+        with open(get_file_at_path('fixtures/effect_from_history_output.json')) as fp:
+            expected = json.load(fp)
+
+        effect = calculate_insulin_effect(
+            normalized_history,
+            4,
+            Schedule(self.insulin_sensitivities['sensitivities']),
+            end_at=parse(expected[20]['date'])
+        )
+
+        self.assertListEqual(expected[:21], effect)
+
 
 class CalculateIOBTestCase(unittest.TestCase):
     def test_single_bolus(self):
@@ -1327,7 +1660,7 @@ class CalculateIOBTestCase(unittest.TestCase):
             normalized_history,
             4,
             start_at=datetime(2015, 10, 15, 22, 11, 00),
-            end_at=datetime(2015, 10, 16, 00, 01, 50),
+            end_at=datetime(2015, 10, 16, 00, 1, 50),
             visual_iob_only=False
         )
 
@@ -1368,6 +1701,68 @@ class CalculateIOBTestCase(unittest.TestCase):
         self.assertListEqual(expected_output, effect)
 
 
+class CalculateIOBAndInsulinEffectTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+    def test_no_input_history(self):
+        self.assertDictEqual(
+            {'iob': [], 'insulin_effect': []},
+            calculate_iob_and_insulin_effect([], 4, self.insulin_sensitivities)
+        )
+
+    def test_complicated_history(self):
+        with open(get_file_at_path('fixtures/effect_from_history_output.json')) as fp:
+            expected_effect = json.load(fp)
+
+        with open(get_file_at_path('fixtures/iob.json')) as fp:
+            expected_iob = json.load(fp)
+
+        result = calculate_iob_and_insulin_effect(self.normalized_history, 4, self.insulin_sensitivities)
+
+        self.assertListEqual(expected_effect, result['insulin_effect'])
+        self.assertListEqual(expected_iob, result['iob'])
+
+    def test_matches_separate_calculators(self):
+        basal_dosing_end = datetime(2015, 10, 15, 22, 10)
+        start_at = datetime(2015, 10, 15, 21, 2)
+
+        result = calculate_iob_and_insulin_effect(
+            self.normalized_history,
+            4,
+            self.insulin_sensitivities,
+            basal_dosing_end=basal_dosing_end,
+            start_at=start_at,
+            visual_iob_only=False
+        )
+
+        self.assertListEqual(
+            calculate_iob(
+                self.normalized_history,
+                4,
+                basal_dosing_end=basal_dosing_end,
+                start_at=start_at,
+                visual_iob_only=False
+            ),
+            result['iob']
+        )
+        self.assertListEqual(
+            calculate_insulin_effect(
+                self.normalized_history,
+                4,
+                self.insulin_sensitivities,
+                basal_dosing_end=basal_dosing_end,
+                start_at=start_at
+            ),
+            result['insulin_effect']
+        )
+
+
 class CalculateGlucoseFromEffectsTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -1690,3 +2085,36 @@ class CalculateMomentumEffectTestCase(unittest.TestCase):
             ],
             [{'date': m['date'], 'unit': m['unit'], 'amount': round(m['amount'], 2)} for m in momentum]
         )
+
+
+class WalshIOBCurveTestCase(unittest.TestCase):
+    def test_fitted_durations(self):
+        for duration, coefficients in walsh_iob_coefficients.items():
+            self.assertIs(coefficients, walsh_iob_curve_coefficients(duration))
+
+        self.assertEqual(
+            -3.310e-10 * (60**4) + 2.530e-7 * (60**3) - 5.510e-5 * (60**2) - 9.086e-4 * 60 + 0.99950,
+            walsh_iob_curve(60, 240)
+        )
+
+    def test_derived_duration(self):
+        for t in range(15, 240, 15):
+            iob = walsh_iob_curve(t, 270)
+
+            self.assertLessEqual(walsh_iob_curve(t, 240), iob)
+            self.assertGreaterEqual(walsh_iob_curve(t, 300), iob)
+
+        self.assertLess(walsh_iob_curve(269, 270), 0.01)
+        self.assertEqual(0.0, walsh_iob_curve(270, 270))
+        self.assertEqual(1.0, walsh_iob_curve(0, 270))
+
+    def test_derived_duration_outside_fitted_range(self):
+        self.assertAlmostEqual(walsh_iob_curve(45, 180), walsh_iob_curve(30, 120), places=12)
+        self.assertAlmostEqual(walsh_iob_curve(240, 360), walsh_iob_curve(320, 480), places=12)
+
+    def test_cached(self):
+        self.assertIs(walsh_iob_curve_coefficients(270), walsh_iob_curve_coefficients(270.0))
+
+    def test_invalid_duration(self):
+        with self.assertRaises(ValueError):
+            walsh_iob_curve_coefficients(0)
@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta
+import json
+import unittest
+
+from openapscontrib.predict.integration import AdaptiveSimpson
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import calculate_insulin_effect
+from openapscontrib.predict.predict import future_glucose
+from openapscontrib.predict.recommend import recommend_temp_basal
+from openapscontrib.predict.scenarios import temp_basal_effect
+from tests.predict_tests import get_file_at_path
+
+
+class RecommendTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+    def test_temp_basal_effect(self):
+        history = [
+            {
+                "type": "TempBasal",
+                "start_at": "2015-07-13T12:00:00",
+                "end_at": "2015-07-13T13:00:00",
+                "amount": 1.0,
+                "unit": "U/hour"
+            }
+        ]
+
+        expected = calculate_insulin_effect(
+            history, 4, self.insulin_sensitivities, integrator=AdaptiveSimpson(tolerance=1e-8)
+        )
+        timestamps = [datetime(2015, 7, 13, 12) + timedelta(minutes=5 * i) for i in range(len(expected))]
+
+        effect = temp_basal_effect(timestamps, timestamps[0], 60, 240, self.insulin_sensitivities)
+
+        for e, a in zip(expected, effect):
+            self.assertAlmostEqual(e['amount'], a, places=4)
+
+    def test_candidate_matches_prediction(self):
+        glucose = [{"date": "2015-10-15T22:30:00", "sgv": 180}]
+        candidate = {
+            "type": "TempBasal",
+            "start_at": "2015-10-15T22:30:00",
+            "end_at": "2015-10-15T23:30:00",
+            "amount": 2.0,
+            "unit": "U/hour"
+        }
+        integrator = AdaptiveSimpson(tolerance=1e-8)
+
+        expected = future_glucose(
+            self.normalized_history + [candidate],
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            integrator=integrator
+        )
+
+        recommendations = recommend_temp_basal(
+            self.normalized_history,
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            [2.0],
+            durations=[60],
+            integrator=integrator
+        )
+
+        self.assertEqual(1, len(recommendations))
+        self.assertAlmostEqual(expected[-1]['amount'], recommendations[0]['eventual_glucose'], places=3)
+        self.assertAlmostEqual(
+            min(e['amount'] for e in expected), recommendations[0]['min_glucose'], places=3
+        )
+
+    def test_running_temp_basal_is_replaced(self):
+        glucose = [{"date": "2015-07-13T12:00:00", "sgv": 150}]
+        history = [
+            {
+                "type": "TempBasal",
+                "start_at": "2015-07-13T11:50:00",
+                "end_at": "2015-07-13T12:20:00",
+                "amount": 2.0,
+                "unit": "U/hour"
+            }
+        ]
+
+        expected = future_glucose(
+            history,
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            basal_dosing_end=datetime(2015, 7, 13, 12)
+        )
+
+        recommendations = recommend_temp_basal(
+            history, glucose, 4, self.insulin_sensitivities, self.carb_ratios, [0.0], durations=[30]
+        )
+
+        self.assertAlmostEqual(expected[-1]['amount'], recommendations[0]['eventual_glucose'], places=3)
+
+        # An earlier end of dosing is kept
+        expected = future_glucose(
+            history,
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            basal_dosing_end=datetime(2015, 7, 13, 11, 55)
+        )
+
+        recommendations = recommend_temp_basal(
+            history,
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            [0.0],
+            durations=[30],
+            basal_dosing_end=datetime(2015, 7, 13, 11, 55)
+        )
+
+        self.assertAlmostEqual(expected[-1]['amount'], recommendations[0]['eventual_glucose'], places=3)
+
+    def test_insulin_model(self):
+        glucose = [{"date": "2015-10-15T22:30:00", "sgv": 180}]
+        candidate = {
+            "type": "TempBasal",
+            "start_at": "2015-10-15T22:30:00",
+            "end_at": "2015-10-15T23:30:00",
+            "amount": 2.0,
+            "unit": "U/hour"
+        }
+
+        expected = future_glucose(
+            self.normalized_history + [candidate],
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            insulin_model='rapid_acting'
+        )
+
+        recommendations = recommend_temp_basal(
+            self.normalized_history,
+            glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            [2.0],
+            durations=[60],
+            insulin_model='rapid_acting'
+        )
+
+        self.assertAlmostEqual(expected[-1]['amount'], recommendations[0]['eventual_glucose'], places=6)
+        self.assertAlmostEqual(
+            min(e['amount'] for e in expected), recommendations[0]['min_glucose'], places=6
+        )
+
+    def test_ranking(self):
+        rates = [-1.0, -0.5, 0.0, 0.5, 1.0, 2.0, 4.0]
+
+        high = recommend_temp_basal(
+            self.normalized_history,
+            [{"date": "2015-10-15T22:30:00", "sgv": 300}],
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            rates,
+            durations=[30, 60]
+        )
+
+        low = recommend_temp_basal(
+            self.normalized_history,
+            [{"date": "2015-10-15T22:30:00", "sgv": 60}],
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            rates,
+            durations=[30, 60]
+        )
+
+        self.assertEqual(len(rates) * 2, len(high))
+        self.assertDictContainsSubset({'rate': 4.0, 'duration': 60}, high[0])
+        self.assertLess(low[0]['rate'], 0.0)
+        self.assertLessEqual(high[0]['score'], high[-1]['score'])
+
+    def test_no_glucose(self):
+        self.assertListEqual(
+            [],
+            recommend_temp_basal(
+                self.normalized_history, [], 4, self.insulin_sensitivities, self.carb_ratios, [0.0]
+            )
+        )
@@ -0,0 +1,143 @@
+import json
+import unittest
+
+from openapscontrib.predict.integration import AdaptiveSimpson
+from openapscontrib.predict.predict import Schedule
+from openapscontrib.predict.predict import future_glucose
+from openapscontrib.predict.scenarios import Baseline
+from openapscontrib.predict.scenarios import predict_scenarios
+from tests.predict_tests import get_file_at_path
+
+
+class ScenariosTestCase(unittest.TestCase):
+    glucose = [{"date": "2015-10-15T22:32:00", "sgv": 150}]
+    bolus = {
+        "type": "Bolus",
+        "start_at": "2015-10-15T22:32:00",
+        "end_at": "2015-10-15T22:32:00",
+        "amount": 3.0,
+        "unit": "U"
+    }
+    meal = {
+        "type": "Meal",
+        "start_at": "2015-10-15T22:32:00",
+        "end_at": "2015-10-15T22:32:00",
+        "amount": 40,
+        "unit": "g"
+    }
+    temp_basal = {
+        "type": "TempBasal",
+        "start_at": "2015-10-15T22:32:00",
+        "end_at": "2015-10-15T23:02:00",
+        "amount": -1.0,
+        "unit": "U/hour"
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/read_insulin_sensitivies.json")) as fp:
+            cls.insulin_sensitivities = Schedule(json.load(fp)['sensitivities'])
+
+        with open(get_file_at_path("fixtures/read_carb_ratios.json")) as fp:
+            cls.carb_ratios = Schedule(json.load(fp)['schedule'])
+
+        with open(get_file_at_path("fixtures/normalize_history.json")) as fp:
+            cls.normalized_history = json.load(fp)
+
+    def assertPredictionsAlmostEqual(self, expected, actual, places):
+        self.assertEqual(len(expected), len(actual))
+
+        for e, a in zip(expected, actual):
+            self.assertEqual(e['date'], a['date'])
+            self.assertAlmostEqual(e['amount'], a['amount'], places=places)
+
+    def test_empty_scenario_is_baseline(self):
+        expected = future_glucose(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios
+        )
+
+        predictions = predict_scenarios(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios, [[]]
+        )
+
+        self.assertListEqual([expected], predictions)
+
+    def test_scenarios_match_prediction(self):
+        integrator = AdaptiveSimpson(tolerance=1e-8)
+        scenarios = [[self.bolus], [self.meal], [self.meal, self.bolus], [self.temp_basal]]
+
+        baseline = Baseline(
+            self.normalized_history,
+            self.glucose,
+            4,
+            self.insulin_sensitivities,
+            self.carb_ratios,
+            integrator=integrator
+        )
+        predictions = baseline.predict(scenarios)
+
+        self.assertEqual(len(scenarios), len(predictions))
+
+        for scenario, prediction in zip(scenarios, predictions):
+            expected = future_glucose(
+                self.normalized_history + scenario,
+                self.glucose,
+                4,
+                self.insulin_sensitivities,
+                self.carb_ratios,
+                integrator=integrator
+            )
+
+            # The baseline is continued at its last value to the end of the longest scenario
+            self.assertPredictionsAlmostEqual(expected, prediction[:len(expected)], 3)
+
+            for entry in prediction[len(expected):]:
+                self.assertAlmostEqual(expected[-1]['amount'], entry['amount'], places=3)
+
+    def test_insulin_model(self):
+        scenarios = [[self.bolus], [self.temp_basal]]
+
+        predictions = predict_scenarios(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios, scenarios,
+            insulin_model='rapid_acting'
+        )
+
+        for scenario, prediction in zip(scenarios, predictions):
+            expected = future_glucose(
+                self.normalized_history + scenario,
+                self.glucose,
+                4,
+                self.insulin_sensitivities,
+                self.carb_ratios,
+                insulin_model='rapid_acting'
+            )
+
+            self.assertPredictionsAlmostEqual(expected, prediction[:len(expected)], 6)
+
+    def test_carb_model(self):
+        scenarios = [[self.meal], [self.meal, self.bolus]]
+
+        predictions = predict_scenarios(
+            self.normalized_history, self.glucose, 4, self.insulin_sensitivities, self.carb_ratios, scenarios,
+            carb_model='linear'
+        )
+
+        for scenario, prediction in zip(scenarios, predictions):
+            expected = future_glucose(
+                self.normalized_history + scenario,
+                self.glucose,
+                4,
+                self.insulin_sensitivities,
+                self.carb_ratios,
+                carb_model='linear'
+            )
+
+            self.assertPredictionsAlmostEqual(expected, prediction[:len(expected)], 6)
+
+    def test_no_glucose(self):
+        self.assertListEqual(
+            [[], []],
+            predict_scenarios(
+                self.normalized_history, [], 4, self.insulin_sensitivities, self.carb_ratios, [[self.bolus], []]
+            )
+        )